@@ -1,9 +1,76 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import gzip
+import hashlib
 import json
+import os
+import time
 import colorama
 from colorama import Fore
-from competitive_analysis_gpt.llm_util import chat_completion_request, GPT4, GPT35
+from competitive_analysis_gpt.llm_util import (
+    chat_completion_request,
+    stream_chat_completion_request,
+    count_message_tokens,
+    MessageHistory,
+    GPT4,
+    GPT35,
+    MODEL_CONTEXT_WINDOWS,
+    DEFAULT_CONTEXT_WINDOW,
+)
+from competitive_analysis_gpt.prefetch import Prefetcher
+from competitive_analysis_gpt import profiling
+
+# Use colorama's init function to enable colored output on Windows. This is done once at import
+# time since init() re-wraps sys.stdout on every call.
+colorama.init()
+
+# Fraction of the model's context window the conversation may use before it is compacted
+DEFAULT_TOKEN_BUDGET_RATIO = 0.5
+# Number of most recent function results that are always kept verbatim
+KEEP_RECENT_RESULTS = 2
+# Number of characters of a compacted function result kept as its digest
+DIGEST_CHARS = 500
+COMPACTED_PREFIX = "[Compacted "
+
+CHECKPOINT_DIRECTORY = "cache/checkpoints"
+CHECKPOINT_VERSION = 1
+# Checkpoints older than this many seconds are ignored instead of resumed
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+
+# Runs function calls that are ready before their completion has finished streaming
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
+
+def get_checkpoint_path(key):
+    """
+    Checkpoint file of a run identified by key, e.g. its model, user prompt and a run or job id,
+    so that concurrent runs of the same prompt don't share a checkpoint
+    """
+    return os.path.join(
+        CHECKPOINT_DIRECTORY, hashlib.sha256(key.encode()).hexdigest()[:32] + ".json.gz"
+    )
+
+
+def _parse_arguments(arguments):
+    try:
+        return json.loads(arguments)
+    except ValueError:
+        return arguments
+
+
+def _same_call(early_execution, name, arguments):
+    """True if a function call started early is the same call, whatever its JSON formatting"""
+    return early_execution.get("name") == name and _parse_arguments(
+        early_execution.get("arguments")
+    ) == _parse_arguments(arguments)
+
+
+def _cancel_early_execution(early_execution):
+    # A call that already started runs to completion, its result is just not used
+    if early_execution and "future" in early_execution:
+        early_execution["future"].cancel()
 
 
 def convert_pydantic_to_openai_schema(pydantic_model):
@@ -19,8 +86,18 @@ def convert_pydantic_to_openai_schema(pydantic_model):
 
 
 class AgentRunner:
-    def __init__(self, functions=None, model=GPT35, complete_function="ResearchComplete"):
-        self.conversation_history = []
+    def __init__(
+        self,
+        functions=None,
+        model=GPT35,
+        complete_function="ResearchComplete",
+        token_budget=None,
+        keep_recent_results=KEEP_RECENT_RESULTS,
+        stream=False,
+        checkpoint_path=None,
+        prefetch=False,
+    ):
+        self.conversation_history = MessageHistory()
         self.functions = (
             [convert_pydantic_to_openai_schema(f) for f in functions]
             if functions is not None
@@ -33,9 +110,20 @@ class AgentRunner:
         )
         self.complete = False
         self.num_function_calls = 0
+        self.num_steps = 0
         self.model = model
         self.final_response = None
         self.complete_function = complete_function
+        self.token_budget = token_budget or int(
+            MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) * DEFAULT_TOKEN_BUDGET_RATIO
+        )
+        self.keep_recent_results = keep_recent_results
+        self.stream = stream
+        self.checkpoint_path = checkpoint_path
+        # Fetches the pages the model is likely to ask for next while it is thinking
+        self.prefetcher = Prefetcher() if prefetch else None
+        # Estimated token count of each message in conversation_history
+        self.message_tokens = []
 
     def add_message(self, role, content, name=None, function_call=None):
         message = {"role": role, "content": content}
@@ -45,6 +133,91 @@ class AgentRunner:
             message.update({"function_call": function_call})
         self.conversation_history.append(message)
 
+    def save_checkpoint(self):
+        """Atomically writes the state of the run to checkpoint_path as gzipped JSON"""
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "conversation_history": self.conversation_history,
+            "num_function_calls": self.num_function_calls,
+            "num_steps": self.num_steps,
+            "complete": self.complete,
+            "final_response": self.final_response,
+            "saved_at": time.time(),
+        }
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        temporary_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with gzip.open(temporary_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"), default=str)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def load_checkpoint(self, max_age=CHECKPOINT_MAX_AGE):
+        """
+        Restores the state of the run from checkpoint_path. Returns False if there is none, or if
+        it is older than max_age seconds, in which case it is deleted.
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return False
+        try:
+            with gzip.open(self.checkpoint_path, "rt", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return False
+        if state.get("version") != CHECKPOINT_VERSION:
+            return False
+        if time.time() - state.get("saved_at", 0) > max_age:
+            print(f"Ignoring checkpoint {self.checkpoint_path} older than {max_age} seconds")
+            self.clear_checkpoint()
+            return False
+        self.conversation_history = MessageHistory(state["conversation_history"])
+        self.message_tokens = []
+        self.num_function_calls = state["num_function_calls"]
+        self.num_steps = state["num_steps"]
+        self.complete = state["complete"]
+        self.final_response = state["final_response"]
+        return True
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def count_history_tokens(self):
+        # Messages can be added without add_message (e.g. restored histories), so count any missing
+        for message in self.conversation_history[len(self.message_tokens) :]:
+            self.message_tokens.append(count_message_tokens(message))
+        return sum(self.message_tokens)
+
+    def compact_history(self):
+        """
+        Once the conversation exceeds the token budget, replaces every function result except the
+        most recent ones with a short digest. The digest keeps the start of the result and tells
+        the model to call the function again if it needs the full content.
+        """
+        if self.count_history_tokens() <= self.token_budget:
+            return
+        function_indices = [
+            index
+            for index, message in enumerate(self.conversation_history)
+            if message["role"] == "function"
+            and isinstance(message.get("content"), str)
+            and not message["content"].startswith(COMPACTED_PREFIX)
+        ]
+        if self.keep_recent_results:
+            function_indices = function_indices[: -self.keep_recent_results]
+        for index in function_indices:
+            message = self.conversation_history[index]
+            content = message["content"]
+            if len(content) <= DIGEST_CHARS:
+                continue
+            digest = (
+                f"{COMPACTED_PREFIX}{message['name']} result, {self.message_tokens[index]} tokens. "
+                f"Call {message['name']} again with the same arguments for the full content]\n"
+                f"{content[:DIGEST_CHARS]}..."
+            )
+            compacted = dict(message, content=digest)
+            self.conversation_history[index] = compacted
+            self.message_tokens[index] = count_message_tokens(compacted)
+
     def display_conversation(self, since_index=0):
         role_to_color = {
             "system": Fore.CYAN,
@@ -68,19 +241,89 @@ class AgentRunner:
             else:
                 content = f"{role}:\n{content}"
             color = role_to_color.get(role, Fore.BLACK)
-            # Use colorama's init function to enable colored output on Windows
-            colorama.init()
             print(color + content + Fore.RESET)
             print("\n")
 
-    def chat_completion_with_function_execution(self, force_complete=False):
+    def request_completion(self, function_call=None, on_delta=None):
+        """
+        Requests the next completion. In stream mode a function call is started on a worker
+        thread as soon as its arguments are complete, and the returned future resolves to its
+        result.
+        """
+        if not self.stream:
+            response = chat_completion_request(
+                self.conversation_history,
+                self.functions,
+                model=self.model,
+                function_call=function_call,
+            )
+            return response, None
+
+        early_execution = {}
+
+        def on_function_call(name, arguments):
+            if name not in self.function_map:
+                return
+            # A second call means the stream was retried, which may have changed the call
+            if "future" in early_execution:
+                if _same_call(early_execution, name, arguments):
+                    return
+                early_execution["future"].cancel()
+            early_execution.update(name=name, arguments=arguments)
+            early_execution["future"] = _tool_executor.submit(
+                contextvars.copy_context().run, self.execute_function, name, arguments
+            )
+
+        response = stream_chat_completion_request(
+            self.conversation_history,
+            self.functions,
+            model=self.model,
+            function_call=function_call,
+            on_delta=on_delta,
+            on_function_call=on_function_call,
+        )
+        return response, early_execution
+
+    def execute_function(self, name, arguments):
+        token = self.prefetcher.serve() if self.prefetcher is not None else None
+        try:
+            function_instance = self.function_map[name].parse_raw(arguments)
+            with profiling.span("tool", function=name):
+                return function_instance.execute()
+        except Exception as e:
+            print(e)
+            print(name)
+            print(arguments)
+            return arguments
+        finally:
+            if token is not None:
+                self.prefetcher.stop_serving(token)
+
+    def _function_result(self, function, early_execution):
+        if early_execution and _same_call(early_execution, function.name, function.arguments):
+            return early_execution["future"].result()
+        _cancel_early_execution(early_execution)
+        return self.execute_function(function.name, function.arguments)
+
+    def chat_completion_with_function_execution(self, force_complete=False, on_delta=None):
         """This function makes a ChatCompletion API call with the option of adding functions
         It updates the conversation history with the response from the API call as well
         if it is a function call, it executes the function, appends the function call and response to the history and returns the function call with response
         else it appends the response to the history and returns the response
+        on_delta(message) is called with the partial assistant message while streaming
+        With a checkpoint_path, the state of the run is saved after every step
         """
-        response = chat_completion_request(
-            self.conversation_history, self.functions, model=self.model
+        with profiling.span("step", step=self.num_steps, model=self.model):
+            result = self._chat_completion_step(force_complete=force_complete, on_delta=on_delta)
+        self.num_steps += 1
+        if self.checkpoint_path is not None:
+            self.save_checkpoint()
+        return result
+
+    def _chat_completion_step(self, force_complete=False, on_delta=None):
+        self.compact_history()
+        response, early_execution = self.request_completion(
+            function_call=self.complete_function if force_complete else None, on_delta=on_delta
         )
         # Check for InvalidRequestError
         if isinstance(response, dict) and "error" in response:
@@ -88,47 +331,35 @@ class AgentRunner:
             return
         full_message = response["choices"][0]
         if force_complete:
-            response = chat_completion_request(
-                self.conversation_history,
-                self.functions,
-                model=self.model,
-                function_call=self.complete_function,
-            )
-            full_message = response["choices"][0]
             function = full_message["message"]["function_call"]
-            full_message = response["choices"][0]
             self.complete = True
-            try:
-                function_instance = self.function_map[function.name].parse_raw(function.arguments)
-                function_response = function_instance.execute()
-            except Exception as e:
-                function_response = function.arguments
-                print(e)
-                print(function.name)
-                print(function.arguments)
+            function_response = self._function_result(function, early_execution)
             self.final_response = function_response
+            if self.prefetcher is not None:
+                self.prefetcher.clear()
             self.add_message("assistant", None, function_call=function)
             self.add_message("function", function_response, name=function.name)
             return function, function_response
         if full_message["finish_reason"] == "function_call":
             function = full_message["message"]["function_call"]
             assert function.name in [f["name"] for f in self.functions]
-            try:
-                function_instance = self.function_map[function.name].parse_raw(function.arguments)
-                function_response = function_instance.execute()
-            except Exception as e:
-                print(e)
-                function_response = function.arguments
-                print(function.arguments)
+            function_response = self._function_result(function, early_execution)
             self.add_message("assistant", None, function_call=function)
             self.add_message("function", function_response, name=function.name)
             if function.name == self.complete_function:
                 self.complete = True
                 self.final_response = function_response
+                if self.prefetcher is not None:
+                    self.prefetcher.clear()
                 return function, function_response
+            if self.prefetcher is not None:
+                self.prefetcher.schedule_from_result(
+                    function.name, function.arguments, function_response
+                )
             self.num_function_calls += 1
             return function, function_response
         else:
+            _cancel_early_execution(early_execution)
             full_message = full_message["message"]
             self.add_message(full_message["role"], full_message["content"])
             return full_message
@@ -0,0 +1,112 @@
+import gzip
+import os
+import pickle
+import threading
+
+CASSETTE_VERSION = 2
+
+# "record" or "replay" while a cassette is in use
+_mode = None
+_path = None
+# kind -> key -> list of recorded outcomes, each ("result", value) or ("error", exception)
+_interactions = {}
+# (kind, key) -> number of outcomes replayed so far
+_replayed = {}
+_lock = threading.Lock()
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for an interaction that isn't in the cassette"""
+
+
+def start_recording(path):
+    """Records every external interaction (LLM, fetch, search, transcript) until stop()"""
+    global _mode, _path, _interactions, _replayed
+    with _lock:
+        _mode, _path, _interactions, _replayed = "record", path, {}, {}
+
+
+def start_replay(path):
+    """Serves every external interaction from the cassette at path, without any network"""
+    global _mode, _path, _interactions, _replayed
+    with gzip.open(path, "rb") as f:
+        cassette = pickle.load(f)
+    if cassette.get("version") != CASSETTE_VERSION:
+        raise ValueError(f"Unsupported cassette version {cassette.get('version')} in {path}")
+    with _lock:
+        _mode, _path, _interactions, _replayed = "replay", path, cassette["interactions"], {}
+
+
+def stop():
+    """Ends recording or replay. A recording is written to its path as gzipped pickle."""
+    global _mode
+    with _lock:
+        mode, _mode = _mode, None
+        if mode != "record":
+            return
+        os.makedirs(os.path.dirname(_path) or ".", exist_ok=True)
+        temporary_path = f"{_path}.{os.getpid()}.tmp"
+        with gzip.open(temporary_path, "wb") as f:
+            pickle.dump({"version": CASSETTE_VERSION, "interactions": _interactions}, f)
+        os.replace(temporary_path, _path)
+        count = sum(len(outcomes) for keys in _interactions.values() for outcomes in keys.values())
+    print(f"Recorded {count} interactions to {_path}")
+
+
+def is_replaying():
+    return _mode == "replay"
+
+
+def is_active():
+    """
+    True while recording or replaying. Local caches in front of recorded interactions (e.g. of
+    cleaned markdown) must be bypassed then, or a cassette recorded on a warm cache would miss
+    the interactions they saved
+    """
+    return _mode is not None
+
+
+def record(kind, key, outcome, value):
+    if outcome == "error":
+        try:
+            pickle.dumps(value)
+        except Exception:
+            value = Exception(repr(value))
+    with _lock:
+        if _mode == "record":
+            _interactions.setdefault(kind, {}).setdefault(key, []).append((outcome, value))
+
+
+def replay(kind, key):
+    """
+    Returns the next recorded result of an interaction, raising its recorded exception if it
+    failed. Once the recorded outcomes run out, the last one is repeated.
+    """
+    with _lock:
+        outcomes = _interactions.get(kind, {}).get(key)
+        if not outcomes:
+            raise CassetteMiss(f"No {kind} interaction for {key!r} in cassette {_path}")
+        index = _replayed.get((kind, key), 0)
+        _replayed[(kind, key)] = index + 1
+        outcome, value = outcomes[min(index, len(outcomes) - 1)]
+    if outcome == "error":
+        raise value
+    return value
+
+
+def replay_or_record(kind, key, func):
+    """
+    Calls func for an external interaction identified by kind and key. In replay mode the
+    recorded outcome is returned instead, and in record mode the outcome of func is recorded.
+    """
+    if _mode is None:
+        return func()
+    if _mode == "replay":
+        return replay(kind, key)
+    try:
+        result = func()
+    except Exception as e:
+        record(kind, key, "error", e)
+        raise
+    record(kind, key, "result", result)
+    return result
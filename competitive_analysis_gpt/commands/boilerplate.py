@@ -0,0 +1,144 @@
+import re
+
+# Elements that are boilerplate by tag or ARIA role
+BOILERPLATE_TAGS = {"nav", "footer", "aside"}
+BOILERPLATE_ROLES = {"navigation", "contentinfo", "complementary"}
+# Containers that are boilerplate when their id or class matches BOILERPLATE_PATTERN
+CONTAINER_TAGS = {"div", "section", "ul", "ol", "dialog", "nav", "footer", "aside"}
+BOILERPLATE_PATTERN = re.compile(
+    r"cookie|consent|gdpr|newsletter|popup|modal|advert|sponsor|share-?buttons|social-share",
+    re.IGNORECASE,
+)
+
+# Max number of links of pruned regions listed at the end of a page
+MAX_SITE_LINKS = 40
+# Regions with more markdown than this are kept, a matched class is not worth losing that much
+REGION_MAX_CHARS = 5000
+
+# Stand in for the start and end of a region during conversion. Only regions with both are pruned,
+# so a region left unclosed by malformed HTML doesn't take the rest of the page with it.
+REGION_START = "BOILERPLATESTART{}END"
+REGION_END = "BOILERPLATEEND{}END"
+REGION_PATTERN = re.compile(r"BOILERPLATESTART(\d+)END(.*?)BOILERPLATEEND\1END", re.DOTALL)
+REGION_MARKER_PATTERN = re.compile(r"BOILERPLATE(?:START|END)\d+END")
+MARKDOWN_LINK_URL_PATTERN = re.compile(r"\]\(([^)\s]+)\)")
+
+MARKDOWN_LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# A block is a link list when it has at least this many links...
+LINK_LIST_MIN_LINKS = 4
+# ...and this fraction of its text or more is inside links
+LINK_LIST_MIN_DENSITY = 0.7
+# Repeated blocks are removed only when they have at least this many characters of text, or are
+# link lists. Shorter ones, like the "per user / month" of each tier of a pricing table, are kept.
+REPEATED_BLOCK_MIN_CHARS = 80
+COOKIE_NOTICE_PATTERN = re.compile(r"\bcookies?\b", re.IGNORECASE)
+COOKIE_NOTICE_ACTION_PATTERN = re.compile(r"\b(accept|consent|agree|preferences)\b", re.IGNORECASE)
+COOKIE_NOTICE_MAX_CHARS = 800
+
+
+class RegionPruner:
+    """
+    html2text tag callback helper that marks navbars, footers, sidebars, cookie banners and
+    similar regions while the page is converted, so prune() can remove them afterwards. The hrefs
+    of the links inside pruned regions are kept in `links` so the site's navigation can still be
+    listed compactly.
+    """
+
+    def __init__(self):
+        self.region = None
+        self.depth = 0
+        self.count = 0
+        self.links = []
+
+    def is_boilerplate(self, tag, attrs):
+        if tag in BOILERPLATE_TAGS or attrs.get("role") in BOILERPLATE_ROLES:
+            return True
+        if tag not in CONTAINER_TAGS:
+            return False
+        identity = f"{attrs.get('id') or ''} {attrs.get('class') or ''}"
+        return BOILERPLATE_PATTERN.search(identity) is not None
+
+    def handle_tag(self, converter, tag, attrs, start):
+        """Marks the start and end of boilerplate regions in the converter output"""
+        if self.region is None:
+            if start and self.is_boilerplate(tag, attrs):
+                self.region = tag
+                self.depth = 1
+                converter.o(REGION_START.format(self.count))
+            return
+        if tag == self.region:
+            self.depth += 1 if start else -1
+            if self.depth == 0:
+                converter.o(REGION_END.format(self.count))
+                self.region = None
+                self.count += 1
+
+    def prune(self, markdown):
+        """Removes the closed regions of a converted page, and the markers of unclosed ones"""
+
+        def remove_region(match):
+            region = match.group(2)
+            if len(region) > REGION_MAX_CHARS:
+                return region
+            self.links.extend(MARKDOWN_LINK_URL_PATTERN.findall(region))
+            return ""
+
+        markdown = REGION_PATTERN.sub(remove_region, markdown)
+        return REGION_MARKER_PATTERN.sub("", markdown)
+
+    def site_links(self):
+        links = []
+        for href in self.links:
+            if href.startswith(("#", "javascript:", "mailto:", "tel:")) or href in links:
+                continue
+            links.append(href)
+        return links[:MAX_SITE_LINKS]
+
+
+def normalize_text(block):
+    return re.sub(r"\W+", " ", block.lower()).strip()
+
+
+def _link_density(block):
+    links = MARKDOWN_LINK_PATTERN.findall(block)
+    if len(links) < LINK_LIST_MIN_LINKS:
+        return 0
+    text = MARKDOWN_LINK_PATTERN.sub("", block)
+    text_length = len(normalize_text(text))
+    link_length = sum(len(normalize_text(label)) for label in links)
+    return link_length / max(link_length + text_length, 1)
+
+
+def _is_cookie_notice(block):
+    return (
+        len(block) <= COOKIE_NOTICE_MAX_CHARS
+        and COOKIE_NOTICE_PATTERN.search(block) is not None
+        and COOKIE_NOTICE_ACTION_PATTERN.search(block) is not None
+    )
+
+
+def strip_boilerplate(markdown):
+    """
+    Removes boilerplate from converted markdown without an LLM:
+    - long blocks and link lists repeated anywhere earlier on the page (menus, repeated cards)
+    - cookie and consent notices
+    - the formatting of link lists, which are reduced to their links
+    """
+    kept = []
+    seen = set()
+    for block in re.split(r"\n\s*\n", markdown):
+        block = block.strip()
+        key = normalize_text(block)
+        if not key:
+            continue
+        is_link_list = _link_density(block) >= LINK_LIST_MIN_DENSITY
+        if is_link_list or len(key) >= REPEATED_BLOCK_MIN_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        if _is_cookie_notice(block):
+            continue
+        if is_link_list:
+            block = ", ".join(link.group(0) for link in MARKDOWN_LINK_PATTERN.finditer(block))
+        kept.append(block)
+    return "\n\n".join(kept) + "\n"
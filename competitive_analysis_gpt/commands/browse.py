@@ -1,14 +1,65 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor, wait
+import contextvars
+import diskcache as dc
+import hashlib
+import importlib.util
+import os
+import re
+import threading
 import requests
 import html2text
-from duckduckgo_search import DDGS
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api.formatters import TextFormatter
 
 from urllib.parse import urlparse
-from competitive_analysis_gpt.llm_util import chat_completion_request, GPT35
+from competitive_analysis_gpt.llm_util import chat_completion_request, count_tokens, GPT35
+from competitive_analysis_gpt import cassette, profiling
+from competitive_analysis_gpt.commands import boilerplate, search, youtube
+from competitive_analysis_gpt.concurrency import map_with_deadline
+from competitive_analysis_gpt.commands.fetch import fetch
+from competitive_analysis_gpt.commands.urls import canonicalize_url
+from competitive_analysis_gpt.llm_cache import CacheStats
 from bs4 import NavigableString
 
+# lxml's C parser is much faster than the pure Python html.parser when it is installed
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Stands in for an iframe during conversion until its description is resolved
+IFRAME_PLACEHOLDER = "IFRAMEPLACEHOLDER{}END"
+IFRAME_PLACEHOLDER_PATTERN = re.compile(r"IFRAMEPLACEHOLDER(\d+)END")
+
+# In smart mode, pages with fewer tokens than this after boilerplate stripping skip the LLM cleanup
+SMART_MODE_MIN_TOKENS = 1500
+
+# Pages longer than this are cleaned in chunks of this many tokens, in parallel
+CLEAN_CHUNK_TOKENS = 4000
+CLEAN_MAX_PARALLEL_CHUNKS = 8
+# Max seconds to wait for all chunks of a page to be cleaned
+CLEAN_TIMEOUT = 120
+HEADING_PATTERN = re.compile(r"^(?=#{1,6} )", re.MULTILINE)
+
+# Cleaned markdown keyed by the content it was cleaned from, see cleaned_markdown_key
+CLEANED_CACHE_DIRECTORY = os.environ.get("CLEANED_CACHE_DIRECTORY", "cache/cleaned")
+_cleaned_cache = None
+_cleaned_cache_lock = threading.Lock()
+cleaned_cache_stats = CacheStats()
+CLEANED_CACHE_TTL = 30 * 24 * 60 * 60
+MARKDOWN_URL_PATTERN = re.compile(r"\]\(([^)\s]+)\)")
+
+# Prefetcher of the running agent, which may have fetched and converted a page before it is asked
+# for, see prefetch.Prefetcher
+prefetched_pages = contextvars.ContextVar("prefetched_pages", default=None)
+
+# Max seconds a page waits for its iframe descriptions before falling back to bare links
+IFRAME_RESOLUTION_TIMEOUT = 10
+IFRAME_MAX_WORKERS = 8
+# Max number of iframe srcs remembered for the lifetime of the process
+IFRAME_CACHE_SIZE = 1024
+
+_iframe_executor = ThreadPoolExecutor(max_workers=IFRAME_MAX_WORKERS, thread_name_prefix="iframe")
+# iframe src -> Future resolving to its description, shared across pages and threads
+_iframe_descriptions = {}
+_iframe_descriptions_lock = threading.Lock()
+
 
 def get_domain(url):
     result = urlparse(url)
@@ -20,13 +71,24 @@ def get_domain(url):
 
 
 def get_description_from_iframe_url(iframe_url):
+    # Transcripts of embedded videos are fetched concurrently with the other iframes of the page
+    if youtube.get_video_id(iframe_url):
+        description = youtube.describe_video(iframe_url)
+        if description:
+            return description
+
     print(f"Fetching URL for Iframe {iframe_url}")
-    response = requests.get(iframe_url)
+    try:
+        response = fetch(iframe_url, source="iframe")
+    except requests.RequestException as e:
+        print(f"Failed to fetch URL for Iframe {iframe_url}: {e}")
+        return None
     if response.status_code != 200:
         print(f"Failed to fetch URL for Iframe {iframe_url}")
         return None
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    # Only the meta tags are needed, so skip building the rest of the tree
+    soup = BeautifulSoup(response.text, HTML_PARSER, parse_only=SoupStrainer("meta"))
 
     # Locate the description or other content you want to extract
     # (this will depend on the specific structure of the target page)
@@ -38,8 +100,134 @@ def get_description_from_iframe_url(iframe_url):
     return get_domain(iframe_url)
 
 
+def _forget_failed_iframe(src, future):
+    if future.exception() is not None or future.result() is None:
+        with _iframe_descriptions_lock:
+            if _iframe_descriptions.get(src) is future:
+                del _iframe_descriptions[src]
+
+
+def resolve_iframe_descriptions(srcs, timeout=IFRAME_RESOLUTION_TIMEOUT):
+    """
+    Fetches the descriptions of all iframe srcs concurrently and returns a dict of src ->
+    description. Youtube videos are described by the start of their transcript, which is cached
+    for later. Each src is resolved at most once per process, so shared widgets (YouTube,
+    Calendly, HubSpot...) are only fetched the first time they're seen. Srcs that fail or don't
+    resolve before the timeout map to None.
+    """
+    futures = {}
+    submitted = {}
+    with _iframe_descriptions_lock:
+        for src in srcs:
+            if src in futures:
+                continue
+            future = _iframe_descriptions.get(src)
+            if future is None:
+                if len(_iframe_descriptions) >= IFRAME_CACHE_SIZE:
+                    del _iframe_descriptions[next(iter(_iframe_descriptions))]
+                future = _iframe_executor.submit(
+                    contextvars.copy_context().run, get_description_from_iframe_url, src
+                )
+                _iframe_descriptions[src] = future
+                submitted[src] = future
+            futures[src] = future
+    # Registered outside the lock since callbacks of already finished futures run immediately
+    for src, future in submitted.items():
+        future.add_done_callback(lambda f, src=src: _forget_failed_iframe(src, f))
+
+    with profiling.span("iframes", count=len(futures), fetched=len(submitted)):
+        wait(futures.values(), timeout=timeout)
+    descriptions = {}
+    for src, future in futures.items():
+        if future.done() and future.exception() is None:
+            descriptions[src] = future.result()
+        else:
+            descriptions[src] = None
+    return descriptions
+
+
+def split_markdown(content, max_tokens=None):
+    """
+    Splits markdown into chunks of at most max_tokens (default CLEAN_CHUNK_TOKENS), breaking on
+    headings where possible. Sections that are too long on their own are split on paragraphs,
+    and paragraphs on characters.
+    """
+    max_tokens = max_tokens or CLEAN_CHUNK_TOKENS
+    sections = [section for section in HEADING_PATTERN.split(content) if section.strip()]
+    pieces = []
+    for section in sections:
+        if count_tokens(section) <= max_tokens:
+            pieces.append(section)
+            continue
+        for paragraph in re.split(r"\n\s*\n", section):
+            if count_tokens(paragraph) <= max_tokens:
+                pieces.append(paragraph + "\n\n")
+                continue
+            # Roughly max_tokens worth of characters at a time
+            step = max_tokens * 3
+            pieces.extend(paragraph[i : i + step] for i in range(0, len(paragraph), step))
+
+    chunks = []
+    chunk = ""
+    chunk_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if chunk and chunk_tokens + piece_tokens > max_tokens:
+            chunks.append(chunk)
+            chunk = ""
+            chunk_tokens = 0
+        chunk += piece
+        chunk_tokens += piece_tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def merge_cleaned_chunks(chunks):
+    """
+    Joins cleaned chunks, dropping headings and paragraphs that already appeared in an earlier
+    chunk, such as a page summary the model repeats at the top of every chunk
+    """
+    merged = []
+    seen = set()
+    for chunk in chunks:
+        for block in re.split(r"\n\s*\n", chunk):
+            key = boilerplate.normalize_text(block)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            merged.append(block.strip())
+    return "\n\n".join(merged)
+
+
 def clean_markdown(content):
-    system_prompt = """
+    """
+    Cleans markdown with GPT-3.5. Content over CLEAN_CHUNK_TOKENS is split on headings and the
+    chunks are cleaned concurrently, so latency is bounded by the slowest chunk instead of the
+    length of the page. A chunk that fails or misses the deadline is kept as is.
+    """
+    tokens = count_tokens(content)
+    with profiling.span("clean_markdown", tokens=tokens) as span:
+        if tokens <= CLEAN_CHUNK_TOKENS:
+            return clean_markdown_chunk(content)
+        chunks = split_markdown(content)
+        span.set(chunks=len(chunks))
+        print(f"Cleaning markdown in {len(chunks)} chunks")
+        cleaned = map_with_deadline(
+            clean_markdown_chunk,
+            chunks,
+            max_workers=CLEAN_MAX_PARALLEL_CHUNKS,
+            timeout=CLEAN_TIMEOUT,
+        )
+        return merge_cleaned_chunks(
+            [
+                chunk if isinstance(result, Exception) else result
+                for chunk, result in zip(chunks, cleaned)
+            ]
+        )
+
+
+CLEAN_MARKDOWN_PROMPT = """
     # HTMLMarkdownGPT
     
     # Role 
@@ -53,105 +241,154 @@ def clean_markdown(content):
     5. Add header sections and lists and bolding whenever appropriate to make it easier to read
     6. Return the cleaned markdown content
     """
+
+
+def _markdown_url(match):
+    return (
+        f"]({canonicalize_url(match.group(1))})"
+        if match.group(1).startswith("http")
+        else match.group(0)
+    )
+
+
+def cleaned_markdown_key(content):
+    """
+    Content address of markdown to clean: a hash of the cleanup prompt and the markdown with
+    canonical link urls and collapsed whitespace, so copies of a page under different urls or with
+    different tracking parameters share one cleaned version
+    """
+    normalized = MARKDOWN_URL_PATTERN.sub(_markdown_url, content)
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return hashlib.sha256((CLEAN_MARKDOWN_PROMPT + normalized).encode()).hexdigest()
+
+
+def get_cleaned_cache():
+    """The cleaned markdown cache, opened on first use so that importing doesn't create it"""
+    global _cleaned_cache
+    if _cleaned_cache is None:
+        with _cleaned_cache_lock:
+            if _cleaned_cache is None:
+                _cleaned_cache = dc.Cache(CLEANED_CACHE_DIRECTORY)
+    return _cleaned_cache
+
+
+def get_cleaned_cache_stats():
+    """Hits, misses and hit rate of the cleaned markdown cache in this process"""
+    return cleaned_cache_stats.as_dict()
+
+
+def clean_markdown_chunk(content):
+    with profiling.span("clean_markdown_chunk", cache_hit=True):
+        return _clean_markdown_chunk(content)
+
+
+def _clean_markdown_chunk(content):
+    key = cleaned_markdown_key(content)
+    cleaned = None if cassette.is_active() else get_cleaned_cache().get(key)
+    if cleaned is not None:
+        cleaned_cache_stats.record_hit(len(cleaned))
+        return cleaned
+    cleaned_cache_stats.record_miss()
+    profiling.annotate(cache_hit=False)
+
     params = {
         "messages": [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": CLEAN_MARKDOWN_PROMPT},
             {"role": "user", "content": content},
         ],
         "model": GPT35,
     }
     response = chat_completion_request(**params)
     full_message = response["choices"][0]["message"]["content"]
+    get_cleaned_cache().set(key, full_message, expire=CLEANED_CACHE_TTL)
+    cleaned_cache_stats.record_write(len(full_message))
     return full_message
 
 
-def collapse_single_child_divs(tag):
-    # List to hold div tags to be replaced
-    to_replace = []
-
-    # Collect div tags with a single div child
-    for div_tag in tag.find_all("div", recursive=True):
-        if div_tag.div and len(list(div_tag.children)) == 1:
-            to_replace.append(div_tag)
-
-    # Replace collected div tags with their single div child
-    for div_tag in to_replace:
-        div_tag.replace_with(div_tag.div)
+def html_to_markdown(html, resolve_iframes=True, strip_boilerplate=True):
+    """
+    Converts a page to markdown in a single html2text pass, without building a soup first.
+    Scripts, styles and head are skipped by html2text and images are ignored. Each iframe is
+    emitted as a placeholder, and once the pass is done the placeholders are replaced with links
+    and the descriptions of all iframes, resolved concurrently.
+    With strip_boilerplate, navigation, footers, sidebars and banners are marked during the pass
+    and removed after it, along with repeated blocks, and link lists are compacted. The links of
+    the pruned navigation are listed at the end.
+    """
+    iframe_srcs = []
+    pruner = boilerplate.RegionPruner()
 
+    def handle_tag(converter, tag, attrs, start):
+        if strip_boilerplate:
+            pruner.handle_tag(converter, tag, attrs, start)
+        if tag != "iframe":
+            return None
+        if start and attrs.get("src"):
+            converter.o(IFRAME_PLACEHOLDER.format(len(iframe_srcs)))
+            iframe_srcs.append(attrs["src"])
+        return True
 
-def scrape_and_convert_to_markdown(url, smart_mode=False):
-    # make url whole
-    if not url.startswith("http"):
-        url = "http://" + url
-    response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-    if response.status_code != 200:
-        print(f"Failed to fetch URL {url}")
-        return f"Failed to fetch URL {url}"
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = True
+    converter.tag_callback = handle_tag
+    with profiling.span("html2text", bytes=len(html)):
+        markdown = converter.handle(html)
+        if strip_boilerplate:
+            markdown = boilerplate.strip_boilerplate(pruner.prune(markdown))
+            site_links = pruner.site_links()
+            if site_links:
+                markdown += "\nSite links: " + ", ".join(site_links) + "\n"
+    if not iframe_srcs:
+        return markdown
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    descriptions = resolve_iframe_descriptions(iframe_srcs) if resolve_iframes else {}
 
-    for tag in soup.find_all(["style", "script"]):
-        tag.decompose()
+    def iframe_link(match):
+        index = int(match.group(1))
+        if index >= len(iframe_srcs):
+            return match.group(0)
+        src = iframe_srcs[index]
+        link = f"[Iframe Link: {src}]({src})"
+        if descriptions.get(src):
+            link += f" - Description: {descriptions[src]}"
+        return link
 
-    # Remove all image tags or links
-    for img_tag in soup.find_all("img"):
-        img_tag.decompose()
+    return IFRAME_PLACEHOLDER_PATTERN.sub(iframe_link, markdown)
 
-    iframes = soup.find_all("iframe")
 
-    for iframe in iframes:
-        # Get the src attribute from the iframe tag
-        src = iframe.get("src")
+def fetch_and_convert(url, strip_boilerplate=True):
+    """Fetches a page and converts it to markdown without the LLM cleanup. None on failure"""
+    try:
+        response = fetch(url)
+    except requests.RequestException as e:
+        print(f"Failed to fetch URL {url}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch URL {url}")
+        return None
+    return html_to_markdown(response.text, strip_boilerplate=strip_boilerplate)
 
-        # Replace the iframe tag with a Markdown link to the URL
-        if src:
-            description = get_description_from_iframe_url(src)
-            iframe_link = f"[Iframe Link: {src}]({src})"
-            if description:
-                iframe_link += f" - Description: {description}"
-            iframe.replace_with(iframe_link)
 
-    # Using html2text to convert HTML to Markdown
-    converter = html2text.HTML2Text()
-    converter.ignore_links = False
-    markdown = converter.handle(str(soup.body))
+def scrape_and_convert_to_markdown(url, smart_mode=False):
+    # make url whole
+    if not url.startswith("http"):
+        url = "http://" + url
+    # Prefetched pages are stripped of boilerplate, which only smart mode does
+    prefetcher = prefetched_pages.get() if smart_mode else None
+    markdown = prefetcher.get(url) if prefetcher is not None else None
+    if markdown is None:
+        markdown = fetch_and_convert(url, strip_boilerplate=smart_mode)
+    if markdown is None:
+        return f"Failed to fetch URL {url}"
 
     if smart_mode:
+        if count_tokens(markdown) < SMART_MODE_MIN_TOKENS:
+            return markdown
         print("Cleaning markdown")
         return clean_markdown(markdown)
     return markdown
 
 
-def get_youtube_transcript(url):
-    """
-    First retrive the youtube id and then use the youtube transcript api.
-    Example urls:
-    https://www.youtube.com/embed/ET822mQtO0I?rel=0&controls=1&autoplay=1&mute=1&start=0
-    https://www.youtube.com/watch?v=0WGNnd3oe3Q
-    """
-    if "youtube.com/embed/" in url:
-        youtube_id = url.split("youtube.com/embed/")[1].split("?")[0]
-    elif "youtube.com/watch?v=" in url:
-        youtube_id = url.split("youtube.com/watch?v=")[1].split("&")[0]
-    else:
-        print("Could not find youtube id in url")
-        return
-
-    try:
-        transcript = YouTubeTranscriptApi.get_transcript(youtube_id)
-    except Exception as e:
-        print("Could not get transcript for youtube id", youtube_id)
-        print(e)
-        return
-    text = TextFormatter().format_transcript(transcript)
-    return text
-
-
 def search_urls_and_preview(keywords, limit=None):
-    num_results = 0
-    with DDGS(timeout=20) as ddgs:
-        for r in ddgs.text(keywords):
-            yield r
-            num_results += 1
-            if limit and num_results >= limit:
-                break
+    yield from search.search(keywords, limit)
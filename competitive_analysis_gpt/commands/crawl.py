@@ -0,0 +1,221 @@
+import re
+import xml.etree.ElementTree as ET
+from urllib import robotparser
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+from competitive_analysis_gpt.commands import browse
+from competitive_analysis_gpt.commands.fetch import fetch
+from competitive_analysis_gpt.commands.urls import canonicalize_url
+from competitive_analysis_gpt.concurrency import map_with_deadline
+from competitive_analysis_gpt.llm_util import count_tokens
+
+# Crawl budget: pages fetched besides the home page, tokens of the digest and seconds for the crawl
+CRAWL_MAX_PAGES = 8
+CRAWL_TOKEN_BUDGET = 12000
+CRAWL_TIMEOUT = 120
+CRAWL_MAX_WORKERS = 4
+# Max number of sitemap files read, including those listed by a sitemap index
+MAX_SITEMAPS = 5
+# Max number of candidate urls ranked per site
+MAX_CANDIDATES = 2000
+
+# Path keywords of the pages most likely to fill in each CompanyProfile field
+FIELD_KEYWORDS = {
+    "pricing_details": ["pricing", "plans", "plan", "price", "buy"],
+    "integrations": [
+        "integrations",
+        "integration",
+        "apps",
+        "marketplace",
+        "connectors",
+        "partners",
+    ],
+    "features": ["features", "product", "products", "platform", "capabilities", "how-it-works"],
+    "use_cases": ["use-cases", "usecases", "solutions", "customers", "case-studies"],
+    "target_persona": ["teams", "roles", "for", "industries", "enterprise"],
+    "one_liner": ["about", "about-us", "company", "why"],
+    "founding_date": ["about", "about-us", "company", "story", "history"],
+    "investor_vcs": ["investors", "funding", "press", "news", "newsroom"],
+    "security": ["security", "trust", "compliance"],
+}
+# Paths of pages that never help a company profile. Whole segments only, so that
+# /integrations/postgres or /tagging-platform are kept
+EXCLUDED_PATH_PATTERN = re.compile(
+    r"/(blog|posts?|articles?|tag|tags|category|author|careers?|jobs|legal|privacy|terms|"
+    r"cookies?|login|signin|sign-in|signup|sign-up|register|cart|checkout|search)(/|$)"
+    r"|/wp-|\.(pdf|jpe?g|png|gif|svg|zip|xml|css|js)$",
+    re.IGNORECASE,
+)
+# Language codes of locale prefixes such as /de/ or /fr-fr/, whose pages duplicate the default
+# locale. English is left out, some sites only have /en/ pages. Other two letter segments (/ai/,
+# /go/, /hr/...) are kept since they are often products or teams.
+LOCALE_CODES = "ar|cs|da|de|el|es|fi|fr|he|hu|it|ja|ko|nb|nl|no|pl|pt|ro|ru|sv|th|tr|uk|vi|zh"
+LOCALE_PATH_PATTERN = re.compile(rf"^/({LOCALE_CODES})([-_][a-z]{{2,4}})?(/|$)", re.IGNORECASE)
+
+SITEMAP_NAMESPACE_PATTERN = re.compile(r"^\{[^}]*\}")
+DOCTYPE_PATTERN = re.compile(r"<!DOCTYPE", re.IGNORECASE)
+
+
+def _get_text(url):
+    try:
+        response = fetch(url)
+    except requests.RequestException as e:
+        print(f"Failed to fetch {url}: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    return response.text
+
+
+def _same_site(url, root):
+    host = urlsplit(url).netloc.lower()
+    root_host = urlsplit(root).netloc.lower()
+    return host.removeprefix("www.") == root_host.removeprefix("www.")
+
+
+def read_robots(root):
+    """Returns the robots.txt rules of a site and the sitemaps it lists"""
+    rules = robotparser.RobotFileParser()
+    text = _get_text(urljoin(root, "/robots.txt")) or ""
+    rules.parse(text.splitlines())
+    return rules, rules.site_maps() or []
+
+
+def read_sitemaps(sitemap_urls):
+    """Returns the page urls of sitemaps, following sitemap indexes up to MAX_SITEMAPS files"""
+    pending = list(sitemap_urls)
+    urls = []
+    for _ in range(MAX_SITEMAPS):
+        if not pending or len(urls) >= MAX_CANDIDATES:
+            break
+        text = _get_text(pending.pop(0))
+        # Sitemaps have no DOCTYPE, and the stdlib parser would expand the entities it declares
+        if not text or DOCTYPE_PATTERN.search(text):
+            continue
+        try:
+            root = ET.fromstring(text.encode())
+        except ET.ParseError:
+            continue
+        kind = SITEMAP_NAMESPACE_PATTERN.sub("", root.tag)
+        for element in root.iter():
+            if SITEMAP_NAMESPACE_PATTERN.sub("", element.tag) == "loc" and element.text:
+                if kind == "sitemapindex":
+                    pending.append(element.text.strip())
+                else:
+                    urls.append(element.text.strip())
+    return urls[:MAX_CANDIDATES]
+
+
+def read_nav_links(root, html):
+    """Returns the links of the nav and header of a page, or all its links if it has neither"""
+    soup = BeautifulSoup(html, browse.HTML_PARSER, parse_only=SoupStrainer(["nav", "header", "a"]))
+    anchors = [a for region in soup.find_all(["nav", "header"]) for a in region.find_all("a")]
+    if not anchors:
+        anchors = soup.find_all("a")
+    return [urljoin(root, a["href"]) for a in anchors if a.get("href")]
+
+
+def score_page(url):
+    """
+    Returns the CompanyProfile fields a page is likely to cover and a relevance score, higher for
+    more fields and for shallower paths
+    """
+    path = urlsplit(url).path.lower().rstrip("/")
+    if EXCLUDED_PATH_PATTERN.search(path) or LOCALE_PATH_PATTERN.match(path):
+        return [], 0
+    segments = [segment for segment in path.split("/") if segment]
+    words = set(segments) | set(re.split(r"[-_]", "-".join(segments)))
+    fields = [
+        field
+        for field, keywords in FIELD_KEYWORDS.items()
+        if any(keyword in words or keyword in segments for keyword in keywords)
+    ]
+    if not fields:
+        return [], 0
+    return fields, len(fields) / len(segments)
+
+
+def rank_pages(urls, root, max_pages=CRAWL_MAX_PAGES):
+    """
+    Picks up to max_pages pages of a site, preferring pages that cover CompanyProfile fields no
+    picked page covers yet
+    """
+    # canonical url -> (url, fields, score), the first of the variants of a page is kept
+    candidates = {}
+    for url in urls:
+        if not _same_site(url, root):
+            continue
+        key = canonicalize_url(url)
+        if key in candidates:
+            continue
+        fields, score = score_page(key)
+        if score > 0:
+            candidates[key] = (url, fields, score)
+
+    picked = []
+    covered = set()
+    while candidates and len(picked) < max_pages:
+        key = max(
+            candidates,
+            key=lambda k: (len(set(candidates[k][1]) - covered), candidates[k][2], -len(k)),
+        )
+        url, fields, _ = candidates.pop(key)
+        picked.append(url)
+        covered.update(fields)
+    return picked
+
+
+def discover_pages(root, home_html=None):
+    """
+    Candidate pages of a site from its sitemaps (listed in robots.txt, or /sitemap.xml), falling
+    back to the navigation links of the home page. Pages disallowed by robots.txt are left out.
+    """
+    rules, sitemaps = read_robots(root)
+    urls = read_sitemaps(sitemaps or [urljoin(root, "/sitemap.xml")])
+    if not urls and home_html:
+        urls = read_nav_links(root, home_html)
+    return [url for url in urls if rules.can_fetch("*", url)]
+
+
+def truncate_to_tokens(markdown, max_tokens):
+    if count_tokens(markdown) <= max_tokens:
+        return markdown
+    chunks = browse.split_markdown(markdown, max_tokens)
+    if not chunks:
+        return ""
+    return chunks[0].rstrip() + "\n\n[truncated]"
+
+
+def crawl_site(url, max_pages=CRAWL_MAX_PAGES, max_tokens=CRAWL_TOKEN_BUDGET):
+    """
+    Crawls the pages of a company website most relevant to a company profile (pricing,
+    integrations, features, about...) in parallel and returns a digest of all of them, with each
+    page truncated to an equal share of max_tokens
+    """
+    if not url.startswith("http"):
+        url = "http://" + url
+    root = url
+    home_html = _get_text(root)
+    pages = [root] + [
+        page
+        for page in rank_pages(discover_pages(root, home_html), root, max_pages)
+        if canonicalize_url(page) != canonicalize_url(root)
+    ]
+    print(f"Crawling {len(pages)} pages of {root}")
+
+    results = map_with_deadline(
+        lambda page: browse.scrape_and_convert_to_markdown(page, smart_mode=True),
+        pages,
+        max_workers=CRAWL_MAX_WORKERS,
+        timeout=CRAWL_TIMEOUT,
+    )
+    page_tokens = max_tokens // len(pages)
+    sections = []
+    for page, result in zip(pages, results):
+        if isinstance(result, Exception):
+            result = f"Failed to scrape URL {page}: {result}"
+        sections.append(f"## {page}\n\n" + truncate_to_tokens(result, page_tokens))
+    return "\n\n".join(sections)
@@ -1,46 +1,172 @@
-from . import browse
+import re
+from urllib.parse import urlparse
 
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+from competitive_analysis_gpt import cassette
+from competitive_analysis_gpt.concurrency import map_with_deadline
+from . import browse, search
+from .fetch import fetch
+from .http_cache import cached_call
+
+CRUNCHBASE_ORGANIZATION_URL = "https://www.crunchbase.com/organization/{}/company_financials"
+MAX_PARALLEL_LOOKUPS = 4
+CRUNCHBASE_TIMEOUT = 120
+
+# Tables of the financials page, recognized by their column headers
+FUNDING_ROUNDS_COLUMNS = {"Announced Date", "Transaction Name"}
+INVESTORS_COLUMNS = {"Investor Name"}
+# Headline numbers of the financials page, found by their label
+SUMMARY_LABELS = [
+    "Number of Funding Rounds",
+    "Total Funding Amount",
+    "Number of Lead Investors",
+    "Number of Investors",
+    "Number of Acquisitions",
+]
+# Icons inside labels and headers (info tooltips, sort arrows) whose ligature names are text
+ICON_TAGS = ["mat-icon", "svg"]
+
+
+def get_organization_slug(url):
+    """Organization slug of a crunchbase url, e.g. https://www.crunchbase.com/organization/openai"""
+    match = re.search(r"/organization/([^/?#]+)", urlparse(url).path)
+    return match.group(1).lower() if match else None
+
+
+def _field_name(header):
+    return re.sub(r"\W+", "_", header.strip().lower()).strip("_")
+
+
+def _cell_value(cell):
+    # Cells listing several organizations or people (e.g. lead investors) have a link for each
+    links = [link.get_text(" ", strip=True) for link in cell.find_all("a")]
+    links = [link for link in links if link]
+    if len(links) > 1:
+        return links
+    return cell.get_text(" ", strip=True)
 
-def search_and_get_crunchbase_financials(company_name: str, keywords: str = None):
-    search_terms = company_name + " crunchbase"
-    if keywords:
-        search_terms += " " + keywords
-    results = browse.search_urls_and_preview(search_terms, 3)
-    url = None
-    for result in results:
-        if "crunchbase.com" in result["href"]:
-            url = result["href"]
-            break
 
-    url += "/company_financials"
-    result = browse.scrape_and_convert_to_markdown(url)
+def _parse_table(table):
+    rows = table.find_all("tr")
+    if not rows:
+        return [], []
+    headers = [cell.get_text(" ", strip=True) for cell in rows[0].find_all(["th", "td"])]
+    fields = [_field_name(header) for header in headers]
+    records = []
+    for row in rows[1:]:
+        cells = row.find_all(["td", "th"])
+        if len(cells) != len(fields):
+            continue
+        record = {field: _cell_value(cell) for field, cell in zip(fields, cells) if field}
+        if any(record.values()):
+            records.append(record)
+    return headers, records
 
-    # Trim out the first part of the markdown and last part, start at \nOrganization\n and end at "Unlock even more features"
-    # TODO: This is brittle, find a better way to do this
 
-    result = result.split("\nOrganization\n")[1]
-    result = result.split("Unlock even more features")[0]
-    return result
+def _parse_summary(soup):
+    summary = {}
+    # Column headers of the tables share some labels with the headline numbers
+    strings = [
+        string.strip()
+        for string in soup.find_all(string=True)
+        if string.strip() and string.find_parent("table") is None
+    ]
+    for index, string in enumerate(strings[:-1]):
+        if string in SUMMARY_LABELS and _field_name(string) not in summary:
+            summary[_field_name(string)] = strings[index + 1]
+    return summary
+
+
+def parse_financials(html):
+    """
+    Extracts the funding rounds, investors and headline numbers of a crunchbase financials page
+    from its tables, without converting the page. Returns None if the page has none of them.
+    """
+    soup = BeautifulSoup(html, browse.HTML_PARSER, parse_only=SoupStrainer("body"))
+    for icon in soup.find_all(ICON_TAGS):
+        icon.decompose()
+    financials = {"summary": _parse_summary(soup), "funding_rounds": [], "investors": []}
+    for table in soup.find_all("table"):
+        headers, records = _parse_table(table)
+        if FUNDING_ROUNDS_COLUMNS <= set(headers):
+            financials["funding_rounds"].extend(records)
+        elif INVESTORS_COLUMNS <= set(headers):
+            financials["investors"].extend(records)
+    if not any(financials.values()):
+        return None
+    return financials
+
+
+def _fetch_financials(slug):
+    url = CRUNCHBASE_ORGANIZATION_URL.format(slug)
+    try:
+        response = fetch(url, source="crunchbase")
+    except requests.RequestException as e:
+        print(f"Failed to fetch crunchbase financials {url}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch crunchbase financials {url}: {response.status_code}")
+        return None
+    financials = parse_financials(response.text)
+    if financials is None:
+        print(f"No financials found on {url}")
+    return financials
 
 
 def get_crunchbase_financials(url: str):
-    url += "/company_financials"
-    result = browse.scrape_and_convert_to_markdown(url)
+    """
+    Funding rounds, investors and headline numbers of an organization, from its crunchbase url.
+    Results are cached per organization slug, and recorded to the cassette so that replays don't
+    depend on the cache. Returns a dict with an "error" if none are found.
+    """
+    slug = get_organization_slug(url)
+    if slug is None:
+        return {"error": f"Not a crunchbase organization url: {url}"}
+    financials = cassette.replay_or_record(
+        "crunchbase", slug, lambda: cached_call("crunchbase", slug, lambda: _fetch_financials(slug))
+    )
+    if financials is None:
+        return {"organization": slug, "error": "Could not get financials from crunchbase"}
+    return dict(financials, organization=slug)
+
+
+def search_crunchbase_url(company_name: str, keywords: str = None):
+    search_terms = company_name + " crunchbase"
+    if keywords:
+        search_terms += " " + keywords
+    for result in search.search(search_terms, 3):
+        if get_organization_slug(result["href"]) and "crunchbase.com" in result["href"]:
+            return result["href"]
+    return None
 
-    # Trim out the first part of the markdown and last part, start at \nOrganization\n and end at "Unlock even more features"
-    # TODO: This is brittle, find a better way to do this
 
-    result = result.split("\nOrganization\n")[1]
-    result = result.split("Unlock even more features")[0]
-    return result
+def search_and_get_crunchbase_financials(company_name: str, keywords: str = None):
+    url = search_crunchbase_url(company_name, keywords)
+    if url is None:
+        return {"error": f"Could not find {company_name} on crunchbase"}
+    return get_crunchbase_financials(url)
 
 
 def get_crunchbase_financials_for_companies(company_names, keywords=None):
-    results = []
-    for company_name in company_names:
-        result = get_crunchbase_financials(company_name, keywords)
-        results.append(result)
-    return results
+    """
+    Financials of many companies, given by name or crunchbase url, looked up concurrently.
+    Results are in input order, with an "error" for companies that failed or timed out.
+    """
+
+    def lookup(company):
+        if "crunchbase.com" in company:
+            return get_crunchbase_financials(company)
+        return search_and_get_crunchbase_financials(company, keywords)
+
+    results = map_with_deadline(
+        lookup, company_names, max_workers=MAX_PARALLEL_LOOKUPS, timeout=CRUNCHBASE_TIMEOUT
+    )
+    return [
+        {"error": f"{company}: {result}"} if isinstance(result, Exception) else result
+        for company, result in zip(company_names, results)
+    ]
 
 
 def resolve_company_urls(company_names):
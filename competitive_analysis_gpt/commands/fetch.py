@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from competitive_analysis_gpt import cassette, profiling
+from competitive_analysis_gpt.commands import http_cache
+from competitive_analysis_gpt.commands.urls import canonicalize_url, url_cache_key
+from competitive_analysis_gpt.ratelimit import rate_limiter
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 20)
+# Max simultaneous requests to a single host, shared by every caller in the process
+MAX_CONNECTIONS_PER_HOST = 4
+# Number of per-host connection pools kept alive by the shared session
+MAX_POOLED_HOSTS = 64
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide requests session. Connections are pooled per host and kept alive,
+    so repeated fetches against the same site reuse the TCP/TLS connection.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=MAX_POOLED_HOSTS, pool_maxsize=MAX_CONNECTIONS_PER_HOST
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                _session = session
+    return _session
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def _host_semaphore(url):
+    host = get_host(url)
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _get(url, headers=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+    rate_limiter.wait_for_domain(url)
+    with _host_semaphore(url):
+        try:
+            return get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+        except requests.ConnectionError:
+            # Nothing reached the site, e.g. its name didn't resolve
+            rate_limiter.refund_domain(url)
+            raise
+
+
+def fetch(url, headers=None, timeout=DEFAULT_TIMEOUT, source="page", use_cache=True, **kwargs):
+    """
+    GET a url through the shared session, waiting for a free slot if MAX_CONNECTIONS_PER_HOST
+    requests to the same host are already in flight. Raises requests.RequestException on failure.
+
+    The url is fetched as is, and canonicalized only to key the cache, so variants with tracking
+    parameters share an entry. Successful responses are kept in the on-disk http cache. Within the
+    TTL of `source` they are served without a request, after it they are revalidated with ETag /
+    Last-Modified. Responses served from the cache have `from_cache` set to True.
+    """
+    with profiling.span("fetch", source=source) as span:
+        # from_cache is recorded alongside the response since pickling a response drops it
+        response, from_cache = cassette.replay_or_record(
+            "fetch",
+            canonicalize_url(url),
+            lambda: _fetch_with_cache_flag(url, headers, timeout, source, use_cache, **kwargs),
+        )
+        response.from_cache = from_cache
+        span.set(
+            status=response.status_code,
+            bytes=len(response.content),
+            cache_hit=from_cache,
+        )
+        return response
+
+
+def _fetch_with_cache_flag(url, headers, timeout, source, use_cache, **kwargs):
+    response = _fetch(url, headers, timeout, source, use_cache, **kwargs)
+    return response, getattr(response, "from_cache", False)
+
+
+def _fetch(url, headers, timeout, source, use_cache, **kwargs):
+    if not use_cache or kwargs:
+        return _get(url, headers=headers, timeout=timeout, **kwargs)
+
+    cache_key = url_cache_key(url)
+    entry = http_cache.get_entry(cache_key)
+    if entry is not None and http_cache.is_fresh(entry, source):
+        return http_cache.to_response(entry)
+
+    request_headers = dict(headers or {})
+    if entry is not None:
+        request_headers.update(http_cache.revalidation_headers(entry))
+    response = _get(url, headers=request_headers, timeout=timeout)
+
+    if response.status_code == 304 and entry is not None:
+        return http_cache.to_response(http_cache.touch_entry(cache_key, entry))
+    response.from_cache = False
+    if response.status_code == 200:
+        http_cache.store_response(cache_key, response)
+    return response
+
+
+async def async_fetch(url, headers=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """asyncio version of fetch, run on a worker thread with the same pool, cache and host limits"""
+    return await asyncio.to_thread(fetch, url, headers=headers, timeout=timeout, **kwargs)
+
+
+async def async_fetch_many(urls, headers=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """
+    Fetches all urls concurrently and returns responses in input order.
+    A failed fetch is returned as its exception instead of raising.
+    """
+    return await asyncio.gather(
+        *[async_fetch(url, headers=headers, timeout=timeout, **kwargs) for url in urls],
+        return_exceptions=True,
+    )
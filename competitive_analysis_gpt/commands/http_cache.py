@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import diskcache as dc
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIRECTORY = os.environ.get("HTTP_CACHE_DIRECTORY", "cache/http")
+
+# Seconds an entry is served straight from disk before the server is asked again
+SOURCE_TTLS = {
+    "page": 6 * 60 * 60,
+    "iframe": 7 * 24 * 60 * 60,
+    "search": 24 * 60 * 60,
+    "youtube": 30 * 24 * 60 * 60,
+    "crunchbase": 7 * 24 * 60 * 60,
+}
+DEFAULT_TTL = 60 * 60
+# Entries are dropped from disk after this many seconds, even if they could still be revalidated
+MAX_AGE = 30 * 24 * 60 * 60
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the on-disk http cache, opened on first use so that importing doesn't create it"""
+    global _http_cache
+    if _http_cache is None:
+        with _http_cache_lock:
+            if _http_cache is None:
+                _http_cache = dc.Cache(CACHE_DIRECTORY)
+    return _http_cache
+
+
+def get_ttl(source):
+    return SOURCE_TTLS.get(source, DEFAULT_TTL)
+
+
+def is_fresh(entry, source):
+    return time.time() - entry["fetched_at"] < get_ttl(source)
+
+
+def get_entry(key):
+    return get_cache().get(f"http:{key}")
+
+
+def store_response(key, response):
+    entry = {
+        "url": response.url,
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "content": response.content,
+        "encoding": response.encoding,
+        "fetched_at": time.time(),
+    }
+    get_cache().set(f"http:{key}", entry, expire=MAX_AGE)
+    return entry
+
+
+def touch_entry(key, entry):
+    """Marks an entry as fetched now, after the server confirmed it is unchanged with a 304"""
+    entry = dict(entry, fetched_at=time.time())
+    get_cache().set(f"http:{key}", entry, expire=MAX_AGE)
+    return entry
+
+
+def revalidation_headers(entry):
+    """Conditional request headers that let the server answer 304 Not Modified for an entry"""
+    headers = {}
+    entry_headers = CaseInsensitiveDict(entry["headers"])
+    if entry_headers.get("ETag"):
+        headers["If-None-Match"] = entry_headers["ETag"]
+    if entry_headers.get("Last-Modified"):
+        headers["If-Modified-Since"] = entry_headers["Last-Modified"]
+    return headers
+
+
+def to_response(entry):
+    response = requests.Response()
+    response.url = entry["url"]
+    response.status_code = entry["status_code"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = entry["content"]
+    response.encoding = entry["encoding"]
+    response.from_cache = True
+    return response
+
+
+def cached_call(source, key, func):
+    """
+    Caches the result of a non-HTTP lookup (search results, transcripts) for the TTL of its source.
+    None results are not cached so that failures are retried.
+    """
+    cache_key = f"{source}:{key}"
+    entry = get_cache().get(cache_key)
+    if entry is not None and is_fresh(entry, source):
+        return entry["value"]
+    value = func()
+    if value is not None:
+        get_cache().set(cache_key, {"value": value, "fetched_at": time.time()}, expire=MAX_AGE)
+    return value
@@ -0,0 +1,117 @@
+import re
+import threading
+from concurrent.futures import Future
+
+from duckduckgo_search import DDGS
+
+from competitive_analysis_gpt import cassette
+from competitive_analysis_gpt.commands.http_cache import cached_call
+from competitive_analysis_gpt.concurrency import map_with_deadline
+from competitive_analysis_gpt.ratelimit import rate_limiter
+
+SEARCH_TIMEOUT = 20
+# Every search asks for at least this many results, so a later search of the same query with a
+# smaller or equal limit is served from the cache
+SEARCH_MIN_RESULTS = 10
+MAX_PARALLEL_SEARCHES = 4
+# Max number of idle DuckDuckGo sessions kept for reuse
+MAX_IDLE_SESSIONS = 8
+
+# Idle DuckDuckGo sessions. Sessions are not thread-safe, so each is used by one search at a time.
+# They are pooled rather than kept per thread so that they outlive the threads of search_many.
+_idle_sessions = []
+_idle_sessions_lock = threading.Lock()
+# normalized query and limit -> Future of the search in flight, shared by concurrent callers
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def normalize_query(keywords):
+    """
+    Lowercases a query and collapses its whitespace, which don't change its results. Quotes are
+    kept since they make DuckDuckGo search for the exact phrase.
+    """
+    return re.sub(r"\s+", " ", keywords).strip().lower()
+
+
+def _acquire_session():
+    with _idle_sessions_lock:
+        if _idle_sessions:
+            return _idle_sessions.pop()
+    return DDGS(timeout=SEARCH_TIMEOUT)
+
+
+def _release_session(session):
+    with _idle_sessions_lock:
+        if len(_idle_sessions) < MAX_IDLE_SESSIONS:
+            _idle_sessions.append(session)
+
+
+def _search(query, limit):
+    results = []
+    rate_limiter.wait_for_search("duckduckgo")
+    # A session that raised is dropped in case it is broken, the next search starts a new one
+    session = _acquire_session()
+    for r in session.text(query):
+        results.append(r)
+        if limit and len(results) >= limit:
+            break
+    _release_session(session)
+    return results
+
+
+def _coalesced_search(query, limit):
+    key = (query, limit)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        # Empty results are often DuckDuckGo throttling, so they are not cached
+        results = cached_call("search", f"{limit}:{query}", lambda: _search(query, limit) or None)
+        future.set_result(results or [])
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+    return future.result()
+
+
+def search(keywords, limit=None):
+    """
+    Returns up to `limit` DuckDuckGo results ({"title", "href", "body"}) for a query.
+    Results are cached on disk by normalized query for the TTL of the "search" source, and
+    concurrent searches of the same query share a single request.
+    """
+    query = normalize_query(keywords)
+    fetch_limit = max(limit, SEARCH_MIN_RESULTS) if limit else None
+    results = cassette.replay_or_record(
+        "search", f"{fetch_limit}:{query}", lambda: _coalesced_search(query, fetch_limit)
+    )
+    return results[:limit] if limit else results
+
+
+def search_many(keywords, limit=None, timeout=None):
+    """
+    Runs several searches concurrently and returns their results in input order. A search that
+    fails or misses the deadline gets its exception in place of results. Duplicate queries are
+    searched once.
+    """
+    queries = list(dict.fromkeys(normalize_query(k) for k in keywords))
+    results = dict(
+        zip(
+            queries,
+            map_with_deadline(
+                lambda query: search(query, limit),
+                queries,
+                max_workers=MAX_PARALLEL_SEARCHES,
+                timeout=timeout,
+            ),
+        )
+    )
+    return [results[normalize_query(k)] for k in keywords]
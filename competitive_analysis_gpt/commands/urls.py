@@ -0,0 +1,48 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a visit came from and never change the page
+TRACKING_PARAMETER_PATTERN = re.compile(
+    r"^(utm_.*|gclid|dclid|fbclid|msclkid|yclid|igshid|mc_cid|mc_eid|_hsenc|_hsmi|hsa_.*|"
+    r"ref_src|trk|trkCampaign|__hstc|__hssc|__hsfp|_ga|_gl)$",
+    re.IGNORECASE,
+)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Fragments that are routes of single page apps, and so select the page
+HASH_ROUTE_PREFIXES = ("/", "!/")
+
+
+def canonicalize_url(url):
+    """
+    Canonical form of a url, to compare and cache pages by: lowercase scheme and host, no default
+    port, no tracking parameters, the remaining query parameters sorted and no fragment, except
+    for the routes of hash-routed apps (#/pricing, #!/pricing). Pages are fetched by their
+    original url, since servers can depend on the exact query.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        # IPv6 address
+        host = f"[{host}]"
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host += f":{parts.port}"
+    if parts.username:
+        host = f"{parts.username}{':' + parts.password if parts.password else ''}@{host}"
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not TRACKING_PARAMETER_PATTERN.match(key)
+    )
+    fragment = parts.fragment if parts.fragment.startswith(HASH_ROUTE_PREFIXES) else ""
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), fragment))
+
+
+def url_cache_key(url):
+    """
+    Key under which a page is cached, shared by its http / https and www / bare domain variants,
+    which almost always serve the same content
+    """
+    parts = urlsplit(canonicalize_url(url))
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return urlunsplit(("", host, parts.path, parts.query, parts.fragment)).lstrip("/")
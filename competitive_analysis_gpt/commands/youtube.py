@@ -0,0 +1,172 @@
+import re
+
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from competitive_analysis_gpt import cassette
+from competitive_analysis_gpt.commands.http_cache import cached_call
+from competitive_analysis_gpt.concurrency import map_with_deadline
+from competitive_analysis_gpt.llm_util import count_tokens
+
+# Max tokens of transcript returned to the agent at once, longer transcripts are split in parts
+TRANSCRIPT_TOKEN_BUDGET = 4000
+# Consecutive captions are merged into paragraphs of about this many seconds
+PARAGRAPH_SECONDS = 60
+MAX_PARALLEL_TRANSCRIPTS = 4
+# Max seconds to wait for all transcripts of a batch
+TRANSCRIPTS_TIMEOUT = 60
+# Characters of transcript shown for a video embedded in a scraped page
+EMBED_PREVIEW_CHARS = 300
+
+# watch?v=, embed/, shorts/, live/ and v/ urls of youtube.com and youtube-nocookie.com, and youtu.be
+VIDEO_ID_PATTERN = re.compile(
+    r"(?:youtube(?:-nocookie)?\.com/(?:(?:embed|shorts|live|v)/|watch\?(?:[^#]*&)?v=)"
+    r"|youtu\.be/)([\w-]+)"
+)
+# Filler words of spoken captions, dropped to condense transcripts
+FILLER_PATTERN = re.compile(r"\b(?:um+|uh+|erm)\b,?\s*|\[(?:music|applause)\]\s*", re.I)
+
+
+def get_video_id(url):
+    """
+    Video id of a youtube url, e.g.
+    https://www.youtube.com/embed/ET822mQtO0I?rel=0&controls=1&autoplay=1&mute=1&start=0
+    https://www.youtube.com/watch?v=0WGNnd3oe3Q
+    https://youtu.be/0WGNnd3oe3Q?t=42
+    https://www.youtube.com/shorts/0WGNnd3oe3Q
+    """
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def fetch_transcript(video_id):
+    """Captions of a video as a list of {"text", "start", "duration"}, cached by video id"""
+    return cassette.replay_or_record(
+        "youtube",
+        video_id,
+        lambda: cached_call(
+            "youtube", video_id, lambda: YouTubeTranscriptApi.get_transcript(video_id)
+        ),
+    )
+
+
+def _timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def condense_transcript(transcript):
+    """
+    Merges captions into timestamped paragraphs, dropping filler words and captions repeated
+    verbatim, which auto-generated transcripts have plenty of
+    """
+    paragraphs = []
+    words = []
+    start = None
+    previous = None
+    for caption in transcript:
+        text = FILLER_PATTERN.sub("", caption["text"].replace("\n", " ")).strip()
+        if not text or text == previous:
+            continue
+        previous = text
+        if start is None:
+            start = caption["start"]
+        elif caption["start"] - start >= PARAGRAPH_SECONDS:
+            paragraphs.append(f"[{_timestamp(start)}] " + " ".join(words))
+            words = []
+            start = caption["start"]
+        words.append(text)
+    if words:
+        paragraphs.append(f"[{_timestamp(start)}] " + " ".join(words))
+    return paragraphs
+
+
+def split_transcript(paragraphs, max_tokens):
+    """Groups paragraphs into parts of at most max_tokens (a longer paragraph is a part alone)"""
+    parts = []
+    part = []
+    part_tokens = 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph)
+        if part and part_tokens + tokens > max_tokens:
+            parts.append("\n\n".join(part))
+            part = []
+            part_tokens = 0
+        part.append(paragraph)
+        part_tokens += tokens
+    if part:
+        parts.append("\n\n".join(part))
+    return parts
+
+
+def get_transcript(url, part=1, max_tokens=TRANSCRIPT_TOKEN_BUDGET):
+    """
+    Condensed transcript of a youtube video. Transcripts longer than max_tokens are split in parts
+    and only the requested one (1-based) is returned, with a note on how to get the next.
+    """
+    video_id = get_video_id(url)
+    if video_id is None:
+        return f"Could not find a youtube video id in url {url}"
+
+    try:
+        transcript = fetch_transcript(video_id)
+    except Exception as e:
+        print("Could not get transcript for youtube id", video_id)
+        print(e)
+        return f"Could not get a transcript for youtube video {video_id}"
+
+    parts = split_transcript(condense_transcript(transcript), max_tokens)
+    if not parts:
+        return f"Youtube video {video_id} has an empty transcript"
+    if len(parts) == 1:
+        return parts[0]
+    if not 1 <= part <= len(parts):
+        return f"Youtube video {video_id} has a transcript of {len(parts)} parts, not {part}"
+    header = f"Transcript part {part} of {len(parts)}"
+    if part < len(parts):
+        header += f", get part {part + 1} for more"
+    return header + "\n\n" + parts[part - 1]
+
+
+def describe_video(url):
+    """
+    Description of a video embedded in a page: the start of its transcript. Fetching it also
+    caches the transcript for GetYoutubeTranscript. Returns None if it has no transcript.
+    """
+    video_id = get_video_id(url)
+    if video_id is None:
+        return None
+    try:
+        paragraphs = condense_transcript(fetch_transcript(video_id))
+    except Exception as e:
+        print(f"Could not get transcript for youtube id {video_id}: {e}")
+        return None
+    if not paragraphs:
+        return None
+    preview = paragraphs[0]
+    if len(preview) > EMBED_PREVIEW_CHARS:
+        preview = preview[:EMBED_PREVIEW_CHARS].rsplit(" ", 1)[0] + "..."
+    return f"Youtube video, transcript starts with: {preview}"
+
+
+def get_transcripts(urls, max_tokens=TRANSCRIPT_TOKEN_BUDGET):
+    """
+    First part of the transcripts of several videos, fetched in parallel, with max_tokens shared
+    equally among them. Returns one result per url in input order.
+    """
+    if not urls:
+        return []
+    results = map_with_deadline(
+        lambda url: get_transcript(url, max_tokens=max_tokens // len(urls)),
+        urls,
+        max_workers=MAX_PARALLEL_TRANSCRIPTS,
+        timeout=TRANSCRIPTS_TIMEOUT,
+    )
+    return [
+        (
+            f"Could not get a transcript for {url}: {result}"
+            if isinstance(result, Exception)
+            else result
+        )
+        for url, result in zip(urls, results)
+    ]
@@ -0,0 +1,39 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class TimedOut(Exception):
+    pass
+
+
+def map_with_deadline(func, items, max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+    """
+    Calls func on every item on a pool of at most max_workers threads and returns the results in
+    input order. Items that raise, or haven't finished when the timeout (in seconds) runs out,
+    get their exception (TimedOut for the latter) in place of a result, so partial results are
+    always returned. Context variables of the caller are visible inside func.
+    """
+    items = list(items)
+    if not items:
+        return []
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        wait(futures, timeout=timeout)
+    finally:
+        # Don't wait for stragglers past the deadline, they finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for future in futures:
+        if not future.done():
+            results.append(TimedOut(f"Timed out after {timeout} seconds"))
+        elif future.cancelled():
+            results.append(TimedOut("Cancelled"))
+        elif future.exception() is not None:
+            results.append(future.exception())
+        else:
+            results.append(future.result())
+    return results
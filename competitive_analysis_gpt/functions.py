@@ -1,4 +1,5 @@
-from competitive_analysis_gpt.commands import browse, crunchbase
+from competitive_analysis_gpt.commands import browse, crawl, crunchbase, search, youtube
+from competitive_analysis_gpt.concurrency import map_with_deadline
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
 import json
@@ -7,6 +8,11 @@ import json
 GPT4 = "gpt-4-32k-0613"
 GPT35 = "gpt-3.5-turbo-16k-0613"
 
+# Concurrency and deadline (in seconds) of the batch functions
+MAX_PARALLEL_SCRAPES = 4
+SCRAPE_URLS_TIMEOUT = 180
+GOOGLE_SEARCHES_TIMEOUT = 60
+
 
 class ScrapeURL(BaseModel):
     """
@@ -28,12 +34,31 @@ class ScrapeURLs(BaseModel):
     urls: List[str] = Field(..., description="the urls to scrape")
 
     def execute(self):
-        result_string = ""
-        for url in self.urls:
-            result_string += url + "\n\n"
-            result = browse.scrape_and_convert_to_markdown(url, smart_mode=True)
-            result_string += result + "\n\n"
-        return result_string
+        results = map_with_deadline(
+            lambda url: browse.scrape_and_convert_to_markdown(url, smart_mode=True),
+            self.urls,
+            max_workers=MAX_PARALLEL_SCRAPES,
+            timeout=SCRAPE_URLS_TIMEOUT,
+        )
+        sections = []
+        for url, result in zip(self.urls, results):
+            if isinstance(result, Exception):
+                result = f"Failed to scrape URL {url}: {result}"
+            sections.append(url + "\n\n" + result)
+        return "\n\n".join(sections)
+
+
+class CrawlWebsite(BaseModel):
+    """
+    Use this function to get the pages of a company website most relevant to its profile (pricing,
+    features, integrations, use cases, about, investors) in markdown format in a single step
+    """
+
+    url: str = Field(..., description="the url of the company website")
+
+    def execute(self):
+        result = crawl.crawl_site(self.url)
+        return result
 
 
 class GetCrunchbaseFinancials(BaseModel):
@@ -46,8 +71,22 @@ class GetCrunchbaseFinancials(BaseModel):
 
     def execute(self):
         result = crunchbase.get_crunchbase_financials(self.url)
-        result = "\n\n".join(result)
-        return result
+        return json.dumps(result)
+
+
+class GetCrunchbaseFinancialsForCompanies(BaseModel):
+    """
+    Use this function to get the financials of several companies from crunchbase at once,
+    e.g. to compare a company with its competitors.
+    """
+
+    companies: List[str] = Field(
+        ..., description="the names or crunchbase urls of the companies to search for"
+    )
+
+    def execute(self):
+        result = crunchbase.get_crunchbase_financials_for_companies(self.companies)
+        return json.dumps(result)
 
 
 class GoogleSearch(BaseModel):
@@ -60,8 +99,8 @@ class GoogleSearch(BaseModel):
 
     def execute(self):
         keywords = self.company_name + " " + self.keywords
-        result = browse.search_urls_and_preview(keywords, 5)
-        return json.dumps(list(result), indent=2)
+        result = search.search(keywords, 5)
+        return json.dumps(result, indent=2)
 
 
 class GoogleSearches(BaseModel):
@@ -69,25 +108,41 @@ class GoogleSearches(BaseModel):
     searches: List[GoogleSearch] = Field(..., description="a list of google searches to execute")
 
     def execute(self):
+        keywords = [s.company_name + " " + s.keywords for s in self.searches]
+        results = search.search_many(keywords, 4, timeout=GOOGLE_SEARCHES_TIMEOUT)
         all_search_results = []
-        for search in self.searches:
-            keywords = search.company_name + " " + search.keywords
-            results = list(browse.search_urls_and_preview(keywords, 4))
-            response = {"keywords_searched": keywords, "results": results}
+        for keywords_searched, result in zip(keywords, results):
+            response = {"keywords_searched": keywords_searched}
+            if isinstance(result, Exception):
+                response["error"] = str(result)
+            else:
+                response["results"] = result
             all_search_results.append(response)
         return json.dumps(all_search_results, indent=2)
 
 
 class GetYoutubeTranscript(BaseModel):
     """
-    Use this function to get the markdownified transcript of a URL from youtube
+    Use this function to get the transcript of a youtube video, long transcripts come in parts
     """
 
-    url: str = Field(..., description="the url to scrape")
+    url: str = Field(..., description="the url of the youtube video")
+    part: int = Field(1, description="the part of the transcript to get, starting at 1")
 
     def execute(self):
-        result = browse.get_youtube_transcript(self.url)
-        return result
+        return youtube.get_transcript(self.url, self.part)
+
+
+class GetYoutubeTranscripts(BaseModel):
+    """
+    Use this function to get the transcripts of multiple youtube videos, e.g. all videos of a page
+    """
+
+    urls: List[str] = Field(..., description="the urls of the youtube videos")
+
+    def execute(self):
+        results = youtube.get_transcripts(self.urls)
+        return "\n\n".join(url + "\n\n" + result for url, result in zip(self.urls, results))
 
 
 class CompanyProfile(BaseModel):
@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "cache/jobs.db")
+# Seconds a worker owns a job without a heartbeat before another worker may take it over
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+# Seconds before a failed job is retried, multiplied by its number of attempts
+RETRY_DELAY = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL,
+    finalized INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT,
+    concurrency_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    available_at REAL NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id);
+"""
+
+TERMINAL_STATUSES = ("done", "failed")
+# Error of jobs failed because their last worker died holding them
+LEASE_EXPIRED_ERROR = "lease expired"
+
+
+class JobQueue:
+    """
+    Persistent job queue on SQLite, shared by any number of worker processes on one machine.
+    Workers lease a job for LEASE_SECONDS and keep it with heartbeats. If a worker dies, its job
+    becomes available again once the lease runs out. Failed jobs are retried up to max_attempts.
+    Jobs can be grouped in a batch, whose metadata is kept until the batch is finalized, and
+    share a concurrency key (e.g. a Slack channel) that caps how many of them run at once.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Queues created before concurrency keys
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "concurrency_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN concurrency_key TEXT")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_batch(self, metadata):
+        batch_id = uuid.uuid4().hex
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "INSERT INTO batches (id, metadata, created_at) VALUES (?, ?, ?)",
+                (batch_id, json.dumps(metadata), time.time()),
+            )
+        return batch_id
+
+    def get_batch(self, batch_id):
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return {"id": row["id"], "metadata": json.loads(row["metadata"])} if row else None
+
+    def enqueue(self, payload, batch_id=None, max_attempts=MAX_ATTEMPTS, concurrency_key=None):
+        now = time.time()
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (batch_id, concurrency_key, payload, max_attempts, available_at,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, concurrency_key, json.dumps(payload), max_attempts, now, now, now),
+            )
+        return cursor.lastrowid
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS, max_running_per_key=None):
+        """
+        Takes the oldest available job, or one whose lease expired, and returns it as a dict.
+        With max_running_per_key, jobs whose concurrency key already has that many jobs running
+        are skipped, so that a large batch doesn't hold every worker. Returns None if there is
+        nothing to do.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE ((status = 'queued' AND available_at <= ?)"
+                    " OR (status = 'running' AND lease_expires_at < ?))"
+                    " AND (? IS NULL OR concurrency_key IS NULL OR ("
+                    "SELECT COUNT(*) FROM jobs AS running WHERE running.status = 'running'"
+                    " AND running.concurrency_key = jobs.concurrency_key"
+                    " AND running.lease_expires_at >= ?) < ?)"
+                    " ORDER BY id LIMIT 1",
+                    (now, now, max_running_per_key, now, max_running_per_key),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= row["max_attempts"]:
+                    # Its last worker died holding it
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                        (LEASE_EXPIRED_ERROR, now, row["id"]),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, lease_expires_at = ?,"
+                    " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                job = self._to_dict(row)
+                job["attempts"] += 1
+                return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id, worker_id, progress=None, lease_seconds=LEASE_SECONDS):
+        """Extends the lease of a job, optionally recording its progress"""
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, progress = COALESCE(?, progress),"
+                " updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (
+                    now + lease_seconds,
+                    json.dumps(progress) if progress else None,
+                    now,
+                    job_id,
+                    worker_id,
+                ),
+            )
+
+    def complete(self, job_id, worker_id, result):
+        """
+        Marks a job done with its result. Returns False if the worker no longer holds the job,
+        e.g. because its lease expired and another worker took it over.
+        """
+        now = time.time()
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_expires_at = NULL,"
+                " updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (json.dumps(result), now, job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error, retry_delay=RETRY_DELAY):
+        """
+        Requeues the job if it has attempts left, otherwise marks it failed. Returns the new
+        status, or None if the worker no longer holds the job.
+        """
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            status = "queued" if row["attempts"] < row["max_attempts"] else "failed"
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires_at = NULL, available_at = ?,"
+                " updated_at = ? WHERE id = ?",
+                (status, str(error), now + retry_delay * row["attempts"], now, job_id),
+            )
+            conn.execute("COMMIT")
+        return status
+
+    def batch_jobs(self, batch_id):
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY id", (batch_id,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def finalize_batch(self, batch_id):
+        """
+        Returns the jobs of a batch once all of them are done or failed, to exactly one caller.
+        Returns None to every other caller and while jobs are still pending.
+        """
+        jobs = self.batch_jobs(batch_id)
+        if any(job["status"] not in TERMINAL_STATUSES for job in jobs):
+            return None
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE batches SET finalized = 1 WHERE id = ? AND finalized = 0", (batch_id,)
+            )
+        return jobs if cursor.rowcount == 1 else None
+
+    def finished_batches(self):
+        """
+        Ids of the batches whose jobs are all done or failed but that aren't finalized yet, e.g.
+        because their last job failed when its lease expired rather than in a worker
+        """
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT id FROM batches WHERE finalized = 0"
+                " AND EXISTS (SELECT 1 FROM jobs WHERE batch_id = batches.id)"
+                " AND NOT EXISTS (SELECT 1 FROM jobs WHERE batch_id = batches.id"
+                " AND status NOT IN ('done', 'failed'))"
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def _to_dict(self, row):
+        job = dict(row)
+        for key in ("payload", "progress", "result"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
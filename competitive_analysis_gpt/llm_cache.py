@@ -0,0 +1,328 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import re
+import threading
+from functools import wraps
+
+import diskcache as dc
+
+CACHE_DIRECTORY = os.environ.get("LLM_CACHE_DIRECTORY", "cache")
+# Max size of the cache on disk in bytes, entries are evicted by EVICTION_POLICY past it
+SIZE_LIMIT = int(os.environ.get("LLM_CACHE_SIZE_LIMIT", 2**30))
+# One of diskcache's policies: least-recently-stored, least-recently-used, least-frequently-used
+EVICTION_POLICY = os.environ.get("LLM_CACHE_EVICTION_POLICY", "least-recently-used")
+# Seconds until an entry expires, unset means entries only leave the cache through eviction
+DEFAULT_TTL = float(os.environ["LLM_CACHE_TTL"]) if os.environ.get("LLM_CACHE_TTL") else None
+# Per-model TTL overrides, e.g. {"gpt-3.5-turbo-16k": 7 * 24 * 60 * 60}
+MODEL_TTLS = {}
+
+cache = dc.Cache(
+    CACHE_DIRECTORY,
+    size_limit=SIZE_LIMIT,
+    eviction_policy=EVICTION_POLICY,
+    tag_index=True,
+    statistics=True,
+)
+# (namespace, key) -> size in bytes of each entry, so namespaces can be listed without reading the
+# entries. Kept apart from the cache since culling it could drop the index before the entries.
+namespace_index = dc.Cache(os.path.join(CACHE_DIRECTORY, "namespaces"), eviction_policy="none")
+
+
+def _hash_value(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _chain_digest(previous_digest, message):
+    return hashlib.sha256((previous_digest + _hash_value(message)).encode()).hexdigest()
+
+
+class MessageHistory(list):
+    """
+    A list of chat messages that keeps a chained digest of its contents, where the digest of
+    the first n messages is hash(digest of the first n - 1 messages + hash(message n)).
+    Appending only hashes the new messages, so keying every request of a growing conversation
+    stays linear over a run. Replacing or removing messages recomputes the chain from that index,
+    but mutating a message dict in place is not detected.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._digests = []
+
+    def _invalidate(self, index=0):
+        if isinstance(index, slice):
+            index = index.start or 0
+        if index < 0:
+            index = max(len(self) + index, 0)
+        del self._digests[index:]
+
+    def __setitem__(self, index, value):
+        self._invalidate(index)
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self._invalidate(index)
+        super().__delitem__(index)
+
+    def __imul__(self, value):
+        self._invalidate()
+        return super().__imul__(value)
+
+    def insert(self, index, value):
+        self._invalidate(index)
+        super().insert(index, value)
+
+    def pop(self, index=-1):
+        self._invalidate(index)
+        return super().pop(index)
+
+    def remove(self, value):
+        self._invalidate()
+        super().remove(value)
+
+    def clear(self):
+        self._invalidate()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._invalidate()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._invalidate()
+        super().reverse()
+
+    def digest(self):
+        for message in self[len(self._digests) :]:
+            previous_digest = self._digests[-1] if self._digests else ""
+            self._digests.append(_chain_digest(previous_digest, message))
+        return self._digests[-1] if self._digests else ""
+
+
+def messages_digest(messages):
+    if isinstance(messages, MessageHistory):
+        return messages.digest()
+    digest = ""
+    for message in messages:
+        digest = _chain_digest(digest, message)
+    return digest
+
+
+def cache_key(*args, **kwargs):
+    """
+    Fixed size key for a call. A `messages` argument is hashed with the chained message digest,
+    so a MessageHistory only hashes the messages appended since its last key.
+    """
+    parts = [_hash_value(arg) for arg in args]
+    for name, value in sorted(kwargs.items()):
+        if name == "messages" and value is not None:
+            parts.append(f"{name}={messages_digest(value)}")
+        else:
+            parts.append(f"{name}={_hash_value(value)}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+class CacheStats:
+    """Hit / miss / byte counters for the calls made through cache_disk in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def record_hit(self, size):
+        with self.lock:
+            self.hits += 1
+            self.bytes_read += size
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def record_write(self, size):
+        with self.lock:
+            self.bytes_written += size
+
+    def as_dict(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+
+stats = CacheStats()
+
+
+def get_stats():
+    """Counters of this process, plus the size and lifetime hit / miss counts of the disk cache"""
+    disk_hits, disk_misses = cache.stats()
+    result = stats.as_dict()
+    result.update(
+        {
+            "entries": len(cache),
+            "volume_bytes": cache.volume(),
+            "size_limit_bytes": SIZE_LIMIT,
+            "eviction_policy": EVICTION_POLICY,
+            "lifetime_hits": disk_hits,
+            "lifetime_misses": disk_misses,
+        }
+    )
+    return result
+
+
+def prompt_version(messages):
+    """
+    Version of the system prompt of a conversation: the `Version:` it declares if any,
+    plus a short hash of its content so edits without a version bump get their own namespace.
+    """
+    if not messages or messages[0].get("role") != "system":
+        return "none"
+    content = messages[0].get("content") or ""
+    content_hash = hashlib.sha256(content.encode()).hexdigest()[:8]
+    match = re.search(r"Version:\s*(\S+)", content)
+    if match:
+        return f"{match.group(1)}-{content_hash}"
+    return content_hash
+
+
+def get_namespace(arguments):
+    return f"{arguments.get('model')}/{prompt_version(arguments.get('messages'))}"
+
+
+def get_ttl(arguments):
+    return MODEL_TTLS.get(arguments.get("model"), DEFAULT_TTL)
+
+
+def is_error(result):
+    return isinstance(result, Exception) or (isinstance(result, dict) and "error" in result)
+
+
+def cache_get(arguments):
+    """
+    Returns the cached result of a call with the given (bound) arguments, or None. An entry that
+    can't be read counts as a miss, the call is made again and its result replaces the entry.
+    """
+    key = cache_key(**arguments)
+    try:
+        value = cache.get(key)
+        result = None if value is None else pickle.loads(value)
+    except Exception as e:
+        print(f"Failed to read LLM cache entry {key}: {e!r}")
+        result = None
+    if result is None:
+        stats.record_miss()
+        return None
+    stats.record_hit(len(value))
+    return result
+
+
+def cache_set(arguments, result):
+    """Stores the result of a call with the given (bound) arguments unless it is an error"""
+    if is_error(result):
+        return
+    value = pickle.dumps(result)
+    key = cache_key(**arguments)
+    namespace = get_namespace(arguments)
+    cache.set(key, value, expire=get_ttl(arguments), tag=namespace)
+    namespace_index.set((namespace, key), len(value), expire=get_ttl(arguments))
+    stats.record_write(len(value))
+
+
+def cache_disk(func):
+    """
+    Caches results in the LLM cache, tagged with a namespace of the model and prompt version
+    so they can be inspected and pruned per namespace. Error results are never stored.
+    """
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # Bind to the signature so positional and keyword calls share the same key
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        result = cache_get(bound.arguments)
+        if result is None:
+            result = func(*args, **kwargs)
+            cache_set(bound.arguments, result)
+        return result
+
+    return wrapper
+
+
+def list_namespaces():
+    """
+    Number of live entries and bytes per namespace. Read from the namespace index, since reading
+    the entries would load them all and count as hits that change the eviction order. Index
+    records of entries that were evicted or expired are dropped along the way.
+    """
+    namespaces = {}
+    for index_key in list(namespace_index.iterkeys()):
+        namespace, key = index_key
+        size = namespace_index.get(index_key)
+        if size is None:
+            continue
+        # Membership checks neither read the value nor count as a hit
+        if key not in cache:
+            namespace_index.delete(index_key)
+            continue
+        counts = namespaces.setdefault(namespace, {"entries": 0, "bytes": 0})
+        counts["entries"] += 1
+        counts["bytes"] += size
+    return namespaces
+
+
+def prune(namespace=None, model=None):
+    """
+    Removes expired entries and enforces the size limit. If given, also drops every entry of
+    `namespace` or of any namespace of `model`. Returns the number of entries removed.
+    """
+    removed = cache.expire()
+    if namespace is not None:
+        removed += cache.evict(namespace)
+    if model is not None:
+        for name in list_namespaces():
+            if name is not None and name.startswith(f"{model}/"):
+                removed += cache.evict(name)
+    removed += cache.cull()
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the LLM response cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="show size, hit / miss counts and namespaces")
+    prune_parser = subparsers.add_parser(
+        "prune", help="drop expired entries, enforce the size limit and optionally drop namespaces"
+    )
+    prune_parser.add_argument("--namespace", help="drop all entries of this namespace")
+    prune_parser.add_argument("--model", help="drop all entries of this model")
+    subparsers.add_parser("clear", help="drop every entry")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        result = get_stats()
+        result["namespaces"] = list_namespaces()
+        print(json.dumps(result, indent=2))
+    elif args.command == "prune":
+        print(f"Removed {prune(namespace=args.namespace, model=args.model)} entries")
+    elif args.command == "clear":
+        namespace_index.clear()
+        print(f"Removed {cache.clear()} entries")
+
+
+if __name__ == "__main__":
+    main()
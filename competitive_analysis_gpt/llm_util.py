@@ -1,36 +1,68 @@
 import backoff
+import json
+import math
 import openai
+import re
 
-import diskcache as dc
-from functools import wraps
-import json
+from competitive_analysis_gpt.llm_cache import (
+    cache,
+    cache_disk,
+    cache_get,
+    cache_set,
+    cache_key,
+    messages_digest,
+    MessageHistory,
+)
+from competitive_analysis_gpt import cassette, profiling
+from competitive_analysis_gpt.ratelimit import rate_limiter
 
-cache = dc.Cache("cache")
+GPT4 = "gpt-4-32k"
+GPT35 = "gpt-3.5-turbo-16k"
 
+MODEL_CONTEXT_WINDOWS = {GPT4: 32768, GPT35: 16384}
+DEFAULT_CONTEXT_WINDOW = 8192
+# Tokens of formatting overhead the API adds per message
+TOKENS_PER_MESSAGE = 4
+# Completion tokens assumed when reserving rate limit for a request, corrected once it is done
+EXPECTED_COMPLETION_TOKENS = 500
 
-def cache_key(*args, **kwargs):
-    return json.dumps((args, kwargs), sort_keys=True, default=str)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
 
 
-def cache_disk(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        key = cache_key(*args, **kwargs)
-        result = cache.get(key)
-        # if result is none or error
-        if result is None or isinstance(result, Exception):
-            result = func(*args, **kwargs)
-            cache.set(key, result)
-        else:
-            print(type(result))
-            print("Cache hit")
-        return result
+def count_tokens(text):
+    """
+    Offline estimate of the number of tokens in a text. BPE tokenizers produce roughly one token
+    per word or punctuation mark, and at least one per 4 characters for long words and urls.
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, default=str)
+    return max(len(TOKEN_PATTERN.findall(text)), math.ceil(len(text) / 4))
 
-    return wrapper
 
+def count_message_tokens(message):
+    tokens = TOKENS_PER_MESSAGE + count_tokens(message.get("content"))
+    function_call = message.get("function_call")
+    if function_call:
+        tokens += count_tokens(function_call.get("name")) + count_tokens(
+            function_call.get("arguments")
+        )
+    return tokens
 
-GPT4 = "gpt-4-32k"
-GPT35 = "gpt-3.5-turbo-16k"
+
+def wait_for_rate_limit(messages, functions, model):
+    """
+    Waits until the model's request and token rate limits allow a request. Returns the number
+    of tokens reserved, to be corrected with rate_limiter.record_openai_usage.
+    """
+    tokens = (
+        sum(count_message_tokens(message) for message in messages)
+        + count_tokens(functions)
+        + EXPECTED_COMPLETION_TOKENS
+    )
+    rate_limiter.wait_for_openai(model, tokens)
+    return tokens
 
 
 @backoff.on_exception(
@@ -46,7 +78,7 @@ GPT35 = "gpt-3.5-turbo-16k"
     factor=1.5,
 )
 @cache_disk
-def chat_completion_request(
+def _chat_completion_request(
     messages, functions=None, model=GPT35, function_call=None, temperature=0
 ):
     json_data = {"model": model, "messages": messages, "temperature": temperature}
@@ -54,4 +86,186 @@ def chat_completion_request(
         json_data.update({"functions": functions})
     if function_call is not None:
         json_data.update({"function_call": {"name": function_call}})
-    return openai.ChatCompletion.create(**json_data)
+    reserved_tokens = wait_for_rate_limit(messages, functions, model)
+    try:
+        response = openai.ChatCompletion.create(**json_data)
+    except Exception:
+        # Retries would otherwise wait for the reservations of the attempts that failed
+        rate_limiter.refund_openai(model, reserved_tokens)
+        raise
+    profiling.annotate(cache_hit=False)
+    if response.get("usage"):
+        rate_limiter.record_openai_usage(model, reserved_tokens, response["usage"]["total_tokens"])
+        profiling.annotate(
+            prompt_tokens=response["usage"]["prompt_tokens"],
+            completion_tokens=response["usage"]["completion_tokens"],
+        )
+    return response
+
+
+def chat_completion_request(
+    messages, functions=None, model=GPT35, function_call=None, temperature=0
+):
+    key = cache_key(
+        messages=messages,
+        functions=functions,
+        model=model,
+        function_call=function_call,
+        temperature=temperature,
+    )
+    with profiling.span("llm", model=model, stream=False, cache_hit=True):
+        return cassette.replay_or_record(
+            "llm",
+            key,
+            lambda: _chat_completion_request(
+                messages, functions, model, function_call, temperature
+            ),
+        )
+
+
+def _is_complete_json(text):
+    # Only try to parse once the arguments could be a complete object
+    if not text.rstrip().endswith("}"):
+        return False
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def stream_chat_completion_request(
+    messages,
+    functions=None,
+    model=GPT35,
+    function_call=None,
+    temperature=0,
+    on_delta=None,
+    on_function_call=None,
+):
+    """
+    Streaming version of chat_completion_request that returns the same assembled response and
+    shares its cache entries.
+    on_delta(message) is called with the partially assembled message after every chunk.
+    on_function_call(name, arguments) is called once, as soon as the arguments of a function call
+    are complete JSON, which can be before the stream has finished.
+    """
+    key = cache_key(
+        messages=messages,
+        functions=functions,
+        model=model,
+        function_call=function_call,
+        temperature=temperature,
+    )
+    with profiling.span("llm", model=model, stream=True, cache_hit=True):
+        if cassette.is_replaying():
+            response = cassette.replay("llm", key)
+            _replay_stream(response, on_delta, on_function_call)
+            return response
+        return cassette.replay_or_record(
+            "llm",
+            key,
+            lambda: _stream_chat_completion_request(
+                messages, functions, model, function_call, temperature, on_delta, on_function_call
+            ),
+        )
+
+
+def _replay_stream(response, on_delta, on_function_call):
+    """Calls the streaming callbacks of a response that was not streamed, e.g. from the cache"""
+    message = response["choices"][0]["message"]
+    if on_delta is not None:
+        on_delta(message)
+    if on_function_call is not None and message.get("function_call"):
+        on_function_call(message["function_call"]["name"], message["function_call"]["arguments"])
+
+
+@backoff.on_exception(
+    wait_gen=backoff.expo,
+    exception=(
+        openai.error.ServiceUnavailableError,
+        openai.error.APIError,
+        openai.error.RateLimitError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+    ),
+    max_value=60,
+    factor=1.5,
+)
+def _stream_chat_completion_request(
+    messages, functions, model, function_call, temperature, on_delta, on_function_call
+):
+    arguments = {
+        "messages": messages,
+        "functions": functions,
+        "model": model,
+        "function_call": function_call,
+        "temperature": temperature,
+    }
+    response = cache_get(arguments)
+    if response is not None:
+        _replay_stream(response, on_delta, on_function_call)
+        return response
+
+    json_data = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+    if functions is not None:
+        json_data.update({"functions": functions})
+    if function_call is not None:
+        json_data.update({"function_call": {"name": function_call}})
+
+    reserved_tokens = wait_for_rate_limit(messages, functions, model)
+    try:
+        stream = openai.ChatCompletion.create(**json_data)
+    except Exception:
+        rate_limiter.refund_openai(model, reserved_tokens)
+        raise
+    message = {"role": "assistant", "content": None}
+    finish_reason = None
+    function_call_announced = False
+    chunk = {}
+    for chunk in stream:
+        choice = chunk["choices"][0]
+        delta = choice.get("delta", {})
+        if delta.get("content"):
+            message["content"] = (message["content"] or "") + delta["content"]
+        if delta.get("function_call"):
+            partial = message.setdefault("function_call", {"name": "", "arguments": ""})
+            partial["name"] += delta["function_call"].get("name") or ""
+            partial["arguments"] += delta["function_call"].get("arguments") or ""
+            if (
+                on_function_call is not None
+                and not function_call_announced
+                and _is_complete_json(partial["arguments"])
+            ):
+                function_call_announced = True
+                on_function_call(partial["name"], partial["arguments"])
+        if choice.get("finish_reason"):
+            finish_reason = choice["finish_reason"]
+        if on_delta is not None:
+            on_delta(message)
+
+    if (
+        on_function_call is not None
+        and not function_call_announced
+        and message.get("function_call")
+    ):
+        on_function_call(message["function_call"]["name"], message["function_call"]["arguments"])
+
+    # Streamed responses have no usage, so the completion is estimated
+    prompt_tokens = reserved_tokens - EXPECTED_COMPLETION_TOKENS
+    completion_tokens = count_message_tokens(message)
+    rate_limiter.record_openai_usage(model, reserved_tokens, prompt_tokens + completion_tokens)
+    profiling.annotate(
+        cache_hit=False, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+    )
+    response = openai.util.convert_to_openai_object(
+        {
+            "id": chunk.get("id"),
+            "object": "chat.completion",
+            "created": chunk.get("created"),
+            "model": chunk.get("model", model),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        }
+    )
+    cache_set(arguments, response)
+    return response
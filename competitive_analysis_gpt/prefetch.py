@@ -0,0 +1,175 @@
+import contextvars
+import json
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from urllib.parse import urljoin
+
+from competitive_analysis_gpt.commands import browse, crawl
+from competitive_analysis_gpt.commands.urls import canonicalize_url
+
+# Max pages prefetched after each function result
+PREFETCH_MAX_CANDIDATES = 3
+# Bounds of the buffer of prefetched pages of one agent, oldest pages are dropped first
+PREFETCH_MAX_ENTRIES = 12
+PREFETCH_MAX_BYTES = 2 * 2**20
+# Max seconds a scrape waits for a prefetch of its page that is still in flight
+PREFETCH_WAIT_TIMEOUT = 30
+
+MARKDOWN_LINK_URL_PATTERN = re.compile(r"\]\(([^)\s]+)\)")
+SITE_LINKS_PATTERN = re.compile(r"^Site links: (.*)$", re.MULTILINE)
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+def scrape_candidates(url, markdown, max_candidates=PREFETCH_MAX_CANDIDATES):
+    """Same-site links of a scraped page most likely to be scraped next (pricing, about...)"""
+    links = [urljoin(url, link) for link in MARKDOWN_LINK_URL_PATTERN.findall(markdown)]
+    for site_links in SITE_LINKS_PATTERN.findall(markdown):
+        links.extend(urljoin(url, link.strip()) for link in site_links.split(","))
+    scraped = canonicalize_url(url)
+    return [
+        page
+        for page in crawl.rank_pages(links, url, max_candidates + 1)
+        if canonicalize_url(page) != scraped
+    ][:max_candidates]
+
+
+def search_candidates(results, max_candidates=PREFETCH_MAX_CANDIDATES):
+    """Top hits of GoogleSearch results, or the top hit of each search of GoogleSearches"""
+    if isinstance(results, dict):
+        results = [results]
+    hrefs = []
+    for result in results:
+        if "results" in result:
+            hrefs.extend(hit["href"] for hit in result["results"][:1] if hit.get("href"))
+        elif result.get("href"):
+            hrefs.append(result["href"])
+    return hrefs[:max_candidates]
+
+
+def candidate_urls(name, arguments, result, max_candidates=PREFETCH_MAX_CANDIDATES):
+    """Urls the agent is likely to scrape after getting `result` from function `name`"""
+    if not isinstance(result, str):
+        return []
+    try:
+        if name == "ScrapeURL":
+            url = json.loads(arguments)["url"]
+            if not url.startswith("http"):
+                url = "http://" + url
+            return scrape_candidates(url, result, max_candidates)
+        if name in ("GoogleSearch", "GoogleSearches"):
+            return search_candidates(json.loads(result), max_candidates)
+    except (ValueError, KeyError, TypeError):
+        pass
+    return []
+
+
+def _cancel(futures):
+    for future in futures:
+        future.cancel()
+
+
+class Prefetcher:
+    """
+    Fetches and converts the pages an agent is likely to scrape next in the background, while its
+    next completion is in flight. Scrapes of a prefetched page are served from the buffer, which
+    is bounded by number of pages and bytes of markdown. Pages are not cleaned by the LLM ahead
+    of time, so a wrong guess only costs a fetch.
+    """
+
+    def __init__(
+        self,
+        max_candidates=PREFETCH_MAX_CANDIDATES,
+        max_entries=PREFETCH_MAX_ENTRIES,
+        max_bytes=PREFETCH_MAX_BYTES,
+    ):
+        self.max_candidates = max_candidates
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # canonical url -> Future resolving to its markdown, oldest first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self, urls):
+        futures = []
+        with self.lock:
+            for url in urls:
+                key = canonicalize_url(url)
+                if key in self.entries:
+                    continue
+                print(f"Prefetching {url}")
+                # Keeps the profiling labels of the agent
+                self.entries[key] = _prefetch_executor.submit(
+                    contextvars.copy_context().run, browse.fetch_and_convert, url
+                )
+                futures.append(self.entries[key])
+            evicted = self._trim()
+        # Cancelled and registered outside the lock, since cancelling a queued future and
+        # registering a callback on a finished one run the callback right away on this thread
+        _cancel(evicted)
+        for future in futures:
+            future.add_done_callback(lambda _: self.trim())
+
+    def schedule_from_result(self, name, arguments, result):
+        self.schedule(candidate_urls(name, arguments, result, self.max_candidates))
+
+    def size(self):
+        return sum(
+            len(future.result())
+            for future in self.entries.values()
+            if future.done()
+            and not future.cancelled()
+            and future.exception() is None
+            and future.result() is not None
+        )
+
+    def trim(self):
+        with self.lock:
+            evicted = self._trim()
+        _cancel(evicted)
+
+    def _trim(self):
+        """Drops the oldest entries past the bounds and returns their futures, to be cancelled"""
+        evicted = []
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.size() > self.max_bytes
+        ):
+            _, future = self.entries.popitem(last=False)
+            evicted.append(future)
+        return evicted
+
+    def get(self, url, timeout=PREFETCH_WAIT_TIMEOUT):
+        """Returns the prefetched markdown of a page, or None if it wasn't prefetched or failed"""
+        with self.lock:
+            future = self.entries.pop(canonicalize_url(url), None)
+        markdown = None
+        if future is not None and not future.cancelled():
+            try:
+                markdown = future.result(timeout=timeout)
+            except TimeoutError:
+                print(f"Prefetch of {url} is too slow, fetching it again")
+            except Exception as e:
+                print(f"Prefetch of {url} failed: {e}")
+        with self.lock:
+            if markdown is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return markdown
+
+    def serve(self):
+        """Makes scrapes in the current context use this prefetcher. Returns a token to reset"""
+        return browse.prefetched_pages.set(self)
+
+    def stop_serving(self, token):
+        browse.prefetched_pages.reset(token)
+
+    def clear(self):
+        with self.lock:
+            evicted = list(self.entries.values())
+            self.entries.clear()
+        _cancel(evicted)
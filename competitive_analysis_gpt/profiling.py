@@ -0,0 +1,194 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Company being researched by the current context, recorded on every span
+current_company = contextvars.ContextVar("profile_company", default=None)
+_current_span = contextvars.ContextVar("profile_span", default=None)
+
+_output = None
+_output_lock = threading.Lock()
+_span_ids = itertools.count(1)
+
+
+def enable(path):
+    """Starts writing spans to path as JSON lines"""
+    global _output
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _output_lock:
+        if _output is not None:
+            _output.close()
+        _output = open(path, "a", encoding="utf-8")
+
+
+def disable():
+    global _output
+    with _output_lock:
+        if _output is not None:
+            _output.close()
+        _output = None
+
+
+class Span:
+    def __init__(self, stage, attributes):
+        self.id = next(_span_ids)
+        self.stage = stage
+        self.attributes = attributes
+        self.parent = _current_span.get()
+        self.company = current_company.get()
+        self.start = time.time()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self, duration, error):
+        record = {
+            "id": self.id,
+            "parent": self.parent.id if self.parent is not None else None,
+            "stage": self.stage,
+            "company": self.company,
+            "thread": threading.current_thread().name,
+            "start": self.start,
+            "duration": duration,
+        }
+        if error is not None:
+            record["error"] = repr(error)
+        record.update(self.attributes)
+        return record
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Times the enclosed block as a span of `stage`, written out when the block exits. Attributes
+    (token counts, bytes, cache hits...) can be given up front or added with annotate().
+    Does nothing but yield a throwaway span while profiling is disabled.
+    """
+    current = Span(stage, attributes)
+    if _output is None:
+        yield current
+        return
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        line = json.dumps(current.to_dict(duration, error), default=str)
+        with _output_lock:
+            if _output is not None:
+                _output.write(line + "\n")
+                _output.flush()
+
+
+def annotate(**attributes):
+    """Sets attributes on the innermost span of the current context, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+@contextmanager
+def company(name):
+    """Labels the spans of the enclosed block, and of the threads it starts, with a company"""
+    token = current_company.set(name)
+    try:
+        yield
+    finally:
+        current_company.reset(token)
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def summarize(records):
+    """Per-stage and per-company totals of a list of span records"""
+    stages = defaultdict(list)
+    companies = defaultdict(list)
+    for record in records:
+        stages[record["stage"]].append(record)
+        companies[record.get("company") or "-"].append(record)
+
+    stage_summary = {}
+    for stage, spans in stages.items():
+        durations = [s["duration"] for s in spans]
+        lookups = [s["cache_hit"] for s in spans if "cache_hit" in s]
+        stage_summary[stage] = {
+            "count": len(spans),
+            "total_seconds": sum(durations),
+            "p50_seconds": _percentile(durations, 0.5),
+            "p95_seconds": _percentile(durations, 0.95),
+            "errors": sum(1 for s in spans if "error" in s),
+            "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in spans),
+            "completion_tokens": sum(s.get("completion_tokens", 0) for s in spans),
+            "bytes": sum(s.get("bytes", 0) for s in spans),
+            "cache_hit_rate": sum(lookups) / len(lookups) if lookups else None,
+        }
+
+    company_summary = {}
+    for name, spans in companies.items():
+        stage_seconds = defaultdict(float)
+        for s in spans:
+            stage_seconds[s["stage"]] += s["duration"]
+        company_summary[name] = {
+            "wall_seconds": max(s["start"] + s["duration"] for s in spans)
+            - min(s["start"] for s in spans),
+            "steps": sum(1 for s in spans if s["stage"] == "step"),
+            "tokens": sum(s.get("prompt_tokens", 0) + s.get("completion_tokens", 0) for s in spans),
+            "stage_seconds": dict(stage_seconds),
+        }
+    return {"stages": stage_summary, "companies": company_summary}
+
+
+def print_summary(summary, rate_limit_waits=None):
+    """Prints a summary, and the waits for rate limits by kind of limit (see RateLimiter.stats)"""
+    print("Stages (time of nested stages is included in their parents, e.g. fetch in tool)")
+    print(
+        f"{'stage':<16} {'count':>6} {'total s':>9} {'p50 s':>8} {'p95 s':>8} {'errors':>6}"
+        f" {'tokens':>9} {'MB':>7} {'cache hit':>9}"
+    )
+    for stage, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+        hit_rate = f"{s['cache_hit_rate']:.0%}" if s["cache_hit_rate"] is not None else "-"
+        print(
+            f"{stage:<16} {s['count']:>6} {s['total_seconds']:>9.2f} {s['p50_seconds']:>8.2f}"
+            f" {s['p95_seconds']:>8.2f} {s['errors']:>6}"
+            f" {s['prompt_tokens'] + s['completion_tokens']:>9} {s['bytes'] / 2**20:>7.2f}"
+            f" {hit_rate:>9}"
+        )
+    print()
+    print("Companies")
+    print(f"{'company':<30} {'wall s':>8} {'steps':>6} {'tokens':>9}  seconds per stage")
+    for name, c in summary["companies"].items():
+        stages = ", ".join(
+            f"{stage} {seconds:.1f}"
+            for stage, seconds in sorted(c["stage_seconds"].items(), key=lambda item: -item[1])
+        )
+        print(
+            f"{name[:30]:<30} {c['wall_seconds']:>8.1f} {c['steps']:>6} {c['tokens']:>9}  {stages}"
+        )
+    if rate_limit_waits:
+        print()
+        print("Rate limit waits")
+        print(f"{'limit':<30} {'waits':>6} {'total s':>9} {'max s':>8}")
+        for kind, w in sorted(rate_limit_waits.items(), key=lambda item: -item[1]["wait_seconds"]):
+            print(
+                f"{kind[:30]:<30} {w['waits']:>6} {w['wait_seconds']:>9.2f}"
+                f" {w['max_wait_seconds']:>8.2f}"
+            )
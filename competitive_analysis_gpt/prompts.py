@@ -1,10 +1,13 @@
 from competitive_analysis_gpt.functions import (
     ScrapeURL,
     ScrapeURLs,
+    CrawlWebsite,
     GetCrunchbaseFinancials,
+    GetCrunchbaseFinancialsForCompanies,
     GoogleSearch,
     GoogleSearches,
     GetYoutubeTranscript,
+    GetYoutubeTranscripts,
     ResearchComplete,
 )
 
@@ -45,7 +48,7 @@ Interaction{{
  Search and scrape information about a company to do competitive analysis
 }}
 Functions {{
-    {[f.schema() ['title'] for f in [ScrapeURL, GoogleSearch, GetYoutubeTranscript, ResearchComplete]]}
+    {[f.schema() ['title'] for f in [ScrapeURL, ScrapeURLs, CrawlWebsite, GetCrunchbaseFinancials, GetCrunchbaseFinancialsForCompanies, GoogleSearch, GoogleSearches, GetYoutubeTranscript, GetYoutubeTranscripts, ResearchComplete]]}
 }}
 Constraints {{
     Always call one of the provided functions
@@ -53,7 +56,7 @@ Constraints {{
     Try to fill out everything in research complete, but add remaining tasks if you cannot
     Use crunchbase for fundraising details if you cannot find it on the company website
     Search ycombinator.com/launches if you dont find the right crunchbase 
-    Scrape the company website for other info
+    Crawl the company website with CrawlWebsite first, then scrape individual pages for other info
     Search more if the answer is not complete
     Leave strings empty if you cannot find the answer
     If the company looks like a URL, try scraping it first
@@ -75,11 +78,12 @@ Interaction{{
  Search and scrape information about a company to do competitive analysis
 }}
 Functions {{
-    {[f.schema() ['title'] for f in [ScrapeURL, GoogleSearch, GetYoutubeTranscript, ResearchComplete]]}
+    {[f.schema() ['title'] for f in [ScrapeURL, ScrapeURLs, CrawlWebsite, GetCrunchbaseFinancials, GetCrunchbaseFinancialsForCompanies, GoogleSearch, GoogleSearches, GetYoutubeTranscript, GetYoutubeTranscripts, ResearchComplete]]}
 }}
 Constraints {{
     Always call one of the provided functions, aim the step that maximizes the amount of information gathered
     Trust the company's website for all product related information, navigate deeper into the website for detailed context
+    Crawl the company website with CrawlWebsite before scraping its pages one by one
     When navigating nested urls, keep the the case of the url intact (e.g. ./About-Us/ should be domain.com/About-Us/)
     Try to fill out everything in research complete, but add remaining tasks if you cannot
     Use crunchbase for fundraising details if you cannot find it on the company website
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Requests and tokens per minute allowed for each OpenAI model. Override with OPENAI_RATE_LIMITS,
+# e.g. OPENAI_RATE_LIMITS="gpt-4-32k=400:150000,gpt-3.5-turbo-16k=3500:180000"
+MODEL_RATE_LIMITS = {
+    "gpt-4-32k": (200, 80000),
+    "gpt-3.5-turbo-16k": (3500, 180000),
+}
+DEFAULT_MODEL_RATE_LIMIT = (200, 40000)
+# Searches per minute allowed for each search engine
+SEARCH_RATE_LIMITS = {"duckduckgo": int(os.environ.get("SEARCH_RATE_LIMIT", 30))}
+# Requests per minute allowed to a single domain, and how many of them may be sent at once
+FETCH_DOMAIN_RATE_LIMIT = int(os.environ.get("FETCH_DOMAIN_RATE_LIMIT", 60))
+FETCH_DOMAIN_BURST = 5
+
+
+def _parse_model_rate_limits(value):
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            model, limit = item.strip().split("=")
+            requests, tokens = limit.split(":")
+            limits[model] = (int(requests), int(tokens))
+    return limits
+
+
+MODEL_RATE_LIMITS.update(_parse_model_rate_limits(os.environ.get("OPENAI_RATE_LIMITS", "")))
+
+
+def _domain_key(url):
+    return "fetch:" + urlparse(url).netloc.lower().removeprefix("www.")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute up to capacity. Callers reserve tokens up front and
+    sleep for the returned delay, so waiters are served in order instead of all retrying at once.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount=1):
+        """Takes amount tokens, going into debt if needed. Returns the seconds to wait first"""
+        with self.lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        """Takes (or with a negative amount, gives back) tokens once the real cost is known"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    Process-wide rate limits, consulted before sending a request to OpenAI, a search engine or a
+    website. Each limit is a token bucket under a key like "openai:gpt-4-32k:tokens",
+    "search:duckduckgo" or "fetch:example.com". Waits are counted per kind of limit.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        # key of a limit ("fetch" for all domains) -> {"waits", "wait_seconds", "max_wait_seconds"}
+        self.stats = {}
+
+    def bucket(self, key, rate_per_minute, capacity=None):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate_per_minute, capacity)
+            return bucket
+
+    def wait(self, key, rate_per_minute, amount=1, capacity=None, kind=None):
+        """Sleeps until the limit under key allows amount more. Returns the seconds waited"""
+        delay = self.bucket(key, rate_per_minute, capacity).reserve(amount)
+        if delay > 0:
+            self.record_wait(kind or key, delay)
+            time.sleep(delay)
+        return delay
+
+    def refund(self, key, amount=1):
+        """Gives back a reservation under key, for a request that raised instead of being sent"""
+        with self.lock:
+            bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.adjust(-min(amount, bucket.capacity))
+
+    def record_wait(self, kind, delay):
+        with self.lock:
+            stats = self.stats.setdefault(
+                kind, {"waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            )
+            stats["waits"] += 1
+            stats["wait_seconds"] += delay
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], delay)
+
+    def wait_for_openai(self, model, tokens):
+        """Waits until a request of about `tokens` prompt and completion tokens may be sent"""
+        requests_per_minute, tokens_per_minute = MODEL_RATE_LIMITS.get(
+            model, DEFAULT_MODEL_RATE_LIMIT
+        )
+        return self.wait(f"openai:{model}:requests", requests_per_minute) + self.wait(
+            f"openai:{model}:tokens", tokens_per_minute, amount=tokens
+        )
+
+    def record_openai_usage(self, model, estimated_tokens, used_tokens):
+        """Corrects the token bucket of a model once the real usage of a request is known"""
+        _, tokens_per_minute = MODEL_RATE_LIMITS.get(model, DEFAULT_MODEL_RATE_LIMIT)
+        self.bucket(f"openai:{model}:tokens", tokens_per_minute).adjust(
+            used_tokens - estimated_tokens
+        )
+
+    def refund_openai(self, model, tokens):
+        """Gives back the request and `tokens` reserved by wait_for_openai for a failed request"""
+        self.refund(f"openai:{model}:requests")
+        self.refund(f"openai:{model}:tokens", tokens)
+
+    def wait_for_search(self, engine="duckduckgo"):
+        return self.wait(f"search:{engine}", SEARCH_RATE_LIMITS.get(engine, 30))
+
+    def wait_for_domain(self, url):
+        return self.wait(
+            _domain_key(url), FETCH_DOMAIN_RATE_LIMIT, capacity=FETCH_DOMAIN_BURST, kind="fetch"
+        )
+
+    def refund_domain(self, url):
+        self.refund(_domain_key(url))
+
+    def get_stats(self):
+        with self.lock:
+            return {kind: dict(stats) for kind, stats in self.stats.items()}
+
+
+rate_limiter = RateLimiter()
@@ -1,45 +1,114 @@
 from competitive_analysis_gpt.functions import (
     ScrapeURL,
     ScrapeURLs,
+    CrawlWebsite,
     GetCrunchbaseFinancials,
+    GetCrunchbaseFinancialsForCompanies,
     GoogleSearch,
     GoogleSearches,
     GetYoutubeTranscript,
+    GetYoutubeTranscripts,
     ResearchComplete,
 )
 from competitive_analysis_gpt.prompts import SYSTEM_PROMPT_V1, SYSTEM_PROMPT_V2, SYSTEM_PROMPT_V3
-from competitive_analysis_gpt.agent_runner import AgentRunner
+from competitive_analysis_gpt.agent_runner import AgentRunner, get_checkpoint_path
 from competitive_analysis_gpt.llm_util import GPT4, GPT35
+from competitive_analysis_gpt import cassette, profiling
+from competitive_analysis_gpt.ratelimit import rate_limiter
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextvars
+import io
 import json
+import os
+import sys
+import threading
 import pandas as pd
 
 
 MAX_NUM_STEPS = 20
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PROFILE_PATH = "cache/profile.jsonl"
 
 
-def run(query, model):
+class ContextLocalStdout(io.TextIOBase):
+    """
+    Prefixes every line written to sys.stdout with the label of the context writing it, e.g. the
+    company being researched, so that the live output of concurrent companies can be told apart.
+    Lines are written whole so they don't interleave. Helper threads that run with a copy of the
+    company's context (map_with_deadline, tool calls, prefetches) get the company's label.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        # {"prefix", "partial": text of the current line not yet written} of the context
+        self.line = contextvars.ContextVar("stdout_line", default=None)
+        self.lock = threading.Lock()
+
+    def capture(self, label):
+        self.line.set({"prefix": f"[{label}] ", "partial": ""})
+
+    def release(self):
+        line = self.line.get()
+        self.line.set(None)
+        if line is not None and line["partial"]:
+            with self.lock:
+                self.stream.write(line["prefix"] + line["partial"] + "\n")
+
+    def write(self, text):
+        line = self.line.get()
+        if line is None:
+            return self.stream.write(text)
+        with self.lock:
+            lines = (line["partial"] + text).split("\n")
+            line["partial"] = lines.pop()
+            for complete_line in lines:
+                self.stream.write(line["prefix"] + complete_line + "\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+
+def run(query, model, resume=True, run_id=""):
+    """
+    Runs the agent until it completes. Progress is checkpointed after every step, and with resume
+    an interrupted run of the same query, model and run_id continues from its last completed step.
+    """
     c = AgentRunner(
         functions=[
             ScrapeURL,
+            ScrapeURLs,
+            CrawlWebsite,
+            GetCrunchbaseFinancials,
+            GetCrunchbaseFinancialsForCompanies,
             GoogleSearch,
+            GoogleSearches,
             GetYoutubeTranscript,
+            GetYoutubeTranscripts,
             ResearchComplete,
         ],
         model=model,
+        checkpoint_path=get_checkpoint_path(f"{model}:{run_id}:{query}"),
+        prefetch=True,
     )
-    c.add_message("system", SYSTEM_PROMPT_V3)
-    c.add_message("user", query)
-    complete = False
-    num_steps = 0
+    if resume and c.load_checkpoint():
+        print(f"Resuming from step {c.num_steps}")
+    else:
+        c.add_message("system", SYSTEM_PROMPT_V3)
+        c.add_message("user", query)
     conversation_index = 0
     while not c.complete:
-        c.chat_completion_with_function_execution(force_complete=num_steps >= MAX_NUM_STEPS)
-        num_steps += 1
+        c.chat_completion_with_function_execution(force_complete=c.num_steps >= MAX_NUM_STEPS)
         c.display_conversation(conversation_index)
         conversation_index = len(c.conversation_history)
 
+    c.clear_checkpoint()
     return c
 
 
@@ -60,21 +129,118 @@ def get_input():
     return names, guidance_keywords
 
 
+def run_company(company, guidance_keywords, model, resume=True, run_id=""):
+    company_user_prompt = json.dumps({"company_name": company, "keywords": guidance_keywords})
+    with profiling.company(company):
+        c = run(company_user_prompt, model, resume=resume, run_id=run_id)
+    final_response = c.final_response
+    result = final_response["company_profile"]
+    result["company_name"] = company
+    result["remaining_tasks"] = final_response["remaining_tasks"]
+    return result
+
+
+def run_companies(
+    company_names, guidance_keywords, model, concurrency=DEFAULT_CONCURRENCY, resume=True
+):
+    """
+    Runs one AgentRunner per company on a pool of at most `concurrency` workers.
+    Progress output is printed live. When several companies run at once, each line is prefixed
+    with its company. Results are returned in input order. A company that fails is reported and
+    gets a result with its error, so the other companies' results are kept. A company's position
+    in the list identifies its checkpoint, so the same list resumes where it left off and a name
+    listed twice runs twice.
+    """
+    company_names = [company for company in company_names if company.strip()]
+    concurrency = max(1, concurrency)
+    prefix_output = concurrency > 1 and len(company_names) > 1
+    if isinstance(sys.stdout, ContextLocalStdout):
+        stdout = sys.stdout
+    else:
+        stdout = ContextLocalStdout(sys.stdout)
+
+    def worker(index, company):
+        if prefix_output:
+            stdout.capture(company)
+        try:
+            return run_company(company, guidance_keywords, model, resume=resume, run_id=str(index))
+        except Exception as e:
+            print(f"Failed competitive analysis for {company}: {e!r}")
+            return {"company_name": company, "error": repr(e)}
+        finally:
+            stdout.release()
+            stdout.flush()
+
+    original_stdout = sys.stdout
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(worker, range(len(company_names)), company_names))
+    finally:
+        sys.stdout = original_stdout
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Competitive analysis for a list of companies")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="number of companies to research at the same time",
+    )
+    parser.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="start over instead of resuming interrupted runs from their checkpoint",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=DEFAULT_PROFILE_PATH,
+        metavar="PATH",
+        help=f"record timing spans as JSON lines (default {DEFAULT_PROFILE_PATH}) and print a"
+        " per-company and per-stage summary at the end",
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="record every LLM call, fetch, search and transcript of the run to a cassette file",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="replay a recorded run from its cassette file, without any network",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     company_names, guidance_keywords = get_input()
-    results = []
-    for company in company_names:
-        if not company.strip():
-            continue
-        company_user_prompt = json.dumps({"company_name": company, "keywords": guidance_keywords})
-        print("=" * 100)
-        print(company)
-        c = run(company_user_prompt, GPT4)
-        final_response = c.final_response
-        results.append(final_response["company_profile"])
-        results[-1]["company_name"] = company
-        results[-1]["remaining_tasks"] = final_response["remaining_tasks"]
-        print("=" * 100)
+    if args.profile:
+        if os.path.exists(args.profile):
+            os.remove(args.profile)
+        profiling.enable(args.profile)
+    if args.record:
+        cassette.start_recording(args.record)
+    elif args.replay:
+        cassette.start_replay(args.replay)
+    # A recorded or replayed run starts from scratch, since a resumed one would skip interactions
+    resume = args.resume and not (args.record or args.replay)
+    try:
+        results = run_companies(
+            company_names, guidance_keywords, GPT4, args.concurrency, resume=resume
+        )
+    finally:
+        cassette.stop()
+    if args.profile:
+        profiling.disable()
+        profiling.print_summary(
+            profiling.summarize(profiling.load(args.profile)), rate_limiter.get_stats()
+        )
+        print(f"Spans written to {args.profile}")
 
     df = pd.DataFrame(results)
     df.to_csv("results.csv", index=False)
@@ -0,0 +1,423 @@
+"""
+Benchmarks full company analyses offline, against local stand-ins for OpenAI, search and websites.
+
+    python scripts/bench_end_to_end.py
+    python scripts/bench_end_to_end.py --flows main --concurrency 1 8 16 --companies 16
+
+Each run analyzes fresh companies in a subprocess with empty caches, through `main.run_companies`
+(the CLI) or `slack.analyze_company` (the Slack bot, with a fake Slack client):
+- OpenAI is a local chat completions server that replays a scripted research plan (search, scrape
+  the home page, scrape the pricing page, get a YouTube transcript, complete) with a fixed latency,
+  streaming or not, and echoes markdown cleanup requests.
+- DuckDuckGo is replaced by a fake DDGS whose results point to the company websites.
+- Company websites are served by a local HTTP server, with navigation, footers, iframes and
+  YouTube embeds. YouTubeTranscriptApi is replaced by a fake transcript.
+Rate limits are lifted so that only the pipeline itself is measured.
+
+Reports companies per minute, p50 / p95 agent step latency and peak RSS per flow and concurrency.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+FEATURES = [
+    "Realtime dashboards",
+    "Workflow automation",
+    "Role based access control",
+    "Audit logs",
+    "Single sign-on",
+    "Custom reports",
+    "Scheduled exports",
+    "Mobile apps",
+]
+
+
+def company_name(index):
+    return f"company{index}"
+
+
+# Fixture websites
+
+
+def home_page(name, base_url):
+    features = "\n".join(
+        f"<h2>{feature}</h2><p>{name} {feature.lower()} "
+        + "helps teams move faster. " * 12
+        + "</p>"
+        for feature in FEATURES
+    )
+    return f"""<html><head><title>{name}</title><script>var tracking = 1;</script></head><body>
+<nav><a href="/{name}/">Home</a> <a href="/{name}/pricing/">Pricing</a>
+<a href="/{name}/about-us/">About</a> <a href="/{name}/integrations/">Integrations</a></nav>
+<div class="cookie-banner">We use cookies. <a href="#">Accept</a></div>
+<h1>{name}: the operating system for modern teams</h1>
+<p>{name} was founded in 2019 to help product managers and engineers ship together.</p>
+{features}
+<iframe src="{base_url}/widget/{name}"></iframe>
+<iframe src="{base_url}/youtube.com/embed/{name}demo?rel=0"></iframe>
+<footer><a href="/{name}/privacy/">Privacy</a> <a href="/{name}/terms/">Terms</a>
+Copyright {name}</footer>
+</body></html>"""
+
+
+def pricing_page(name):
+    plans = "".join(
+        f"<li><strong>{plan}</strong>: ${price} per user per month</li>"
+        for plan, price in [("Free", 0), ("Team", 12), ("Business", 29), ("Enterprise", 99)]
+    )
+    return f"""<html><body><nav><a href="/{name}/">Home</a></nav>
+<h1>{name} pricing</h1><ul>{plans}</ul><p>All plans include unlimited projects.</p>
+</body></html>"""
+
+
+def about_page(name):
+    return f"""<html><body><nav><a href="/{name}/">Home</a></nav>
+<h1>About {name}</h1><p>{name} was founded in 2019 and is backed by Example Ventures.</p>
+</body></html>"""
+
+
+def meta_page(title, description):
+    return f"""<html><head><meta property="og:title" content="{title}">
+<meta name="description" content="{description}"></head><body></body></html>"""
+
+
+def make_site_handler(latency):
+    class SiteHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            base_url = f"http://{self.headers['Host']}"
+            parts = [part for part in self.path.split("?")[0].split("/") if part]
+            body = None
+            if len(parts) == 1 and parts[0].startswith("company"):
+                body = home_page(parts[0], base_url)
+            elif len(parts) == 2 and parts[1] == "pricing":
+                body = pricing_page(parts[0])
+            elif len(parts) == 2 and parts[1] == "about-us":
+                body = about_page(parts[0])
+            elif len(parts) == 2 and parts[0] == "widget":
+                body = meta_page(f"{parts[1]} signup", "Book a demo with our team")
+            elif len(parts) == 3 and parts[0] == "youtube.com":
+                body = meta_page("Product demo - YouTube", "A five minute product tour")
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    return SiteHandler
+
+
+# Fake OpenAI
+
+
+def research_plan(name, site_url):
+    """Function calls of the scripted agent, in order"""
+    return [
+        ("GoogleSearch", {"company_name": name, "keywords": "pricing"}),
+        ("ScrapeURL", {"url": f"{site_url}/{name}/"}),
+        ("ScrapeURL", {"url": f"{site_url}/{name}/pricing/"}),
+        ("GetYoutubeTranscript", {"url": f"{site_url}/youtube.com/embed/{name}demo"}),
+        ("ResearchComplete", research_complete(name, site_url)),
+    ]
+
+
+def research_complete(name, site_url):
+    return {
+        "company_profile": {
+            "one_liner": f"{name} is the operating system for modern teams",
+            "founding_date": "2019",
+            "use_cases": ["Project tracking"],
+            "target_persona": "Product Manager",
+            "features": FEATURES,
+            "integrations": [],
+            "pricing_details": ["Free", "Team $12", "Business $29", "Enterprise $99"],
+            "investor_vcs": ["Example Ventures"],
+            "investor_leads": [],
+            "relevant_urls": [f"{site_url}/{name}/"],
+        },
+        "remaining_tasks": [],
+    }
+
+
+def next_message(request, site_url):
+    messages = request["messages"]
+    if not request.get("functions"):
+        # Markdown cleanup, answered with the markdown it was given
+        return {"role": "assistant", "content": messages[-1]["content"]}, "stop"
+    user_message = next(message for message in messages if message["role"] == "user")
+    name = json.loads(user_message["content"])["company_name"]
+    plan = research_plan(name, site_url)
+    step = sum(1 for message in messages if message.get("function_call"))
+    function, arguments = plan[min(step, len(plan) - 1)]
+    if request.get("function_call"):
+        function, arguments = plan[-1]
+    message = {
+        "role": "assistant",
+        "content": None,
+        "function_call": {"name": function, "arguments": json.dumps(arguments)},
+    }
+    return message, "function_call"
+
+
+def make_openai_handler(latency, site_url):
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            message, finish_reason = next_message(request, site_url)
+            completion = {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "created": int(time.time()),
+                "model": request["model"],
+            }
+            self.send_response(200)
+            if request.get("stream"):
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for delta, reason in stream_deltas(message, finish_reason):
+                    chunk = dict(
+                        completion,
+                        object="chat.completion.chunk",
+                        choices=[{"index": 0, "delta": delta, "finish_reason": reason}],
+                    )
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+            prompt_tokens = sum(len(str(m.get("content") or "")) // 4 for m in request["messages"])
+            completion_tokens = len(json.dumps(message)) // 4
+            completion.update(
+                object="chat.completion",
+                choices=[{"index": 0, "message": message, "finish_reason": finish_reason}],
+                usage={
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            )
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(completion).encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    return OpenAIHandler
+
+
+def stream_deltas(message, finish_reason, chunk_chars=40):
+    if message.get("function_call"):
+        function_call = message["function_call"]
+        yield {"role": "assistant", "function_call": {"name": function_call["name"]}}, None
+        arguments = function_call["arguments"]
+        for i in range(0, len(arguments), chunk_chars):
+            yield {"function_call": {"arguments": arguments[i : i + chunk_chars]}}, None
+    else:
+        content = message["content"]
+        for i in range(0, len(content), chunk_chars):
+            yield {"content": content[i : i + chunk_chars]}, None
+    yield {}, finish_reason
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Fake search and transcripts
+
+
+def make_fake_ddgs(site_url, latency):
+    class FakeDDGS:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def text(self, keywords):
+            time.sleep(latency)
+            name = keywords.split()[0]
+            for path, title in [("", name), ("pricing/", f"{name} pricing")]:
+                yield {"title": title, "href": f"{site_url}/{name}/{path}", "body": f"{title}..."}
+
+    return FakeDDGS
+
+
+def fake_transcript(latency):
+    def get_transcript(video_id, *args, **kwargs):
+        time.sleep(latency)
+        return [
+            {"text": f"Welcome to the {video_id} product tour", "start": 0.0, "duration": 3.0},
+            {"text": "Here is how teams plan their work", "start": 3.0, "duration": 4.0},
+        ]
+
+    return get_transcript
+
+
+# Flows
+
+
+class FakeSlackClient:
+    def __init__(self):
+        self.messages = 0
+
+    async def chat_postMessage(self, **kwargs):
+        self.messages += 1
+        return {"ts": f"{time.time():.6f}", "ok": True}
+
+    async def chat_update(self, **kwargs):
+        return {"ok": True}
+
+
+def run_main_flow(names, concurrency):
+    import main
+    from competitive_analysis_gpt.llm_util import GPT4
+
+    main.run_companies(names, [], GPT4, concurrency=concurrency, resume=False)
+
+
+def run_slack_flow(names, concurrency):
+    import slack
+    from collections import defaultdict
+
+    slack.analysis_semaphore = asyncio.Semaphore(concurrency)
+    slack.channel_semaphores = defaultdict(lambda: asyncio.Semaphore(concurrency))
+    client = FakeSlackClient()
+
+    async def analyze_all():
+        return await asyncio.gather(
+            *[slack.analyze_company(client, "C0", "0", name, []) for name in names]
+        )
+
+    asyncio.run(analyze_all())
+
+
+FLOWS = {"main": run_main_flow, "slack": run_slack_flow}
+
+
+def run_child(args):
+    """Runs one flow at one concurrency level, with caches in a fresh directory"""
+    os.chdir(tempfile.mkdtemp(prefix="bench_end_to_end_"))
+    os.environ.update(
+        {
+            "LLM_CACHE_DIRECTORY": "cache",
+            "JOB_WORKERS": "0",
+            "OPENAI_API_KEY": "sk-bench",
+            "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_SIGNING_SECRET": "bench",
+            "OPENAI_RATE_LIMITS": "gpt-4-32k=1000000:1000000000,"
+            "gpt-3.5-turbo-16k=1000000:1000000000",
+            "SEARCH_RATE_LIMIT": "1000000",
+            "FETCH_DOMAIN_RATE_LIMIT": "1000000",
+        }
+    )
+    sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+    import openai
+    from youtube_transcript_api import YouTubeTranscriptApi
+    from competitive_analysis_gpt import profiling
+    from competitive_analysis_gpt.commands import search
+
+    _, site_url = start_server(make_site_handler(args.fetch_latency))
+    _, openai_url = start_server(make_openai_handler(args.llm_latency, site_url))
+    openai.api_base = f"{openai_url}/v1"
+    openai.api_key = "sk-bench"
+    search.DDGS = make_fake_ddgs(site_url, args.search_latency)
+    YouTubeTranscriptApi.get_transcript = staticmethod(fake_transcript(args.search_latency))
+
+    profile_path = os.path.abspath("profile.jsonl")
+    profiling.enable(profile_path)
+    names = [company_name(i) for i in range(args.companies)]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    try:
+        FLOWS[args.flow](names, args.level)
+    finally:
+        elapsed = time.perf_counter() - start
+        sys.stdout = stdout
+    profiling.disable()
+
+    summary = profiling.summarize(profiling.load(profile_path))
+    steps = summary["stages"]["step"]
+    result = {
+        "flow": args.flow,
+        "concurrency": args.level,
+        "companies": args.companies,
+        "seconds": elapsed,
+        "companies_per_minute": args.companies / elapsed * 60,
+        "step_p50_seconds": steps["p50_seconds"],
+        "step_p95_seconds": steps["p95_seconds"],
+        "steps": steps["count"],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--flows", nargs="+", choices=list(FLOWS), default=list(FLOWS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--companies", type=int, default=8, help="companies per run")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="seconds per search")
+    parser.add_argument("--fetch-latency", type=float, default=0.05, help="seconds per page")
+    parser.add_argument("--flow", choices=list(FLOWS), help=argparse.SUPPRESS)
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.flow:
+        run_child(args)
+        return
+
+    print(
+        f"{args.companies} companies per run, LLM latency {args.llm_latency}s,"
+        f" search latency {args.search_latency}s, fetch latency {args.fetch_latency}s"
+    )
+    print(
+        f"{'flow':<6} {'concurrency':>11} {'companies/min':>14} {'step p50 s':>11}"
+        f" {'step p95 s':>11} {'peak RSS MB':>12}"
+    )
+    for flow in args.flows:
+        for level in args.concurrency:
+            command = [
+                sys.executable,
+                os.path.abspath(__file__),
+                f"--flow={flow}",
+                f"--level={level}",
+                f"--companies={args.companies}",
+                f"--llm-latency={args.llm_latency}",
+                f"--search-latency={args.search_latency}",
+                f"--fetch-latency={args.fetch_latency}",
+            ]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{flow:<6} {level:>11} failed:\n{completed.stderr}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(
+                f"{flow:<6} {level:>11} {result['companies_per_minute']:>14.1f}"
+                f" {result['step_p50_seconds']:>11.2f} {result['step_p95_seconds']:>11.2f}"
+                f" {result['peak_rss_mb']:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmarks the HTML to markdown conversion of scraped pages over a corpus of saved pages.
+
+Save some real pages first, then run the benchmark over them:
+
+    python scripts/bench_html_to_markdown.py --record https://www.example.com https://www.python.org
+    python scripts/bench_html_to_markdown.py
+
+Iframe descriptions are not resolved, so only conversion is measured. The pipeline from before the
+single-pass conversion is included for comparison.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import html2text
+import requests
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from competitive_analysis_gpt.commands import browse
+
+DEFAULT_CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def legacy_html_to_markdown(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.find_all(["style", "script"]):
+        tag.decompose()
+    for img_tag in soup.find_all("img"):
+        img_tag.decompose()
+    for iframe in soup.find_all("iframe"):
+        src = iframe.get("src")
+        if src:
+            iframe.replace_with(f"[Iframe Link: {src}]({src})")
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    return converter.handle(str(soup.body))
+
+
+def single_pass_html_to_markdown(html):
+    return browse.html_to_markdown(html, resolve_iframes=False)
+
+
+PIPELINES = {
+    "legacy": legacy_html_to_markdown,
+    "single-pass": single_pass_html_to_markdown,
+}
+
+
+def record(urls, corpus_directory):
+    os.makedirs(corpus_directory, exist_ok=True)
+    for url in urls:
+        response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=20)
+        response.raise_for_status()
+        name = re.sub(r"[^A-Za-z0-9]+", "_", url.split("://")[-1]).strip("_") + ".html"
+        with open(os.path.join(corpus_directory, name), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"Saved {url} to {name}")
+
+
+def load_corpus(corpus_directory):
+    pages = []
+    for name in sorted(os.listdir(corpus_directory)):
+        if name.endswith(".html"):
+            with open(os.path.join(corpus_directory, name), encoding="utf-8") as f:
+                pages.append(f.read())
+    return pages
+
+
+def benchmark(pipeline, pages, repeat):
+    total_bytes = sum(len(page.encode()) for page in pages) * repeat
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            pipeline(page)
+    elapsed = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "pages_per_second": len(pages) * repeat / elapsed,
+        "mb_per_second": total_bytes / elapsed / 2**20,
+        "peak_memory_mb": peak_memory / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--corpus", default=DEFAULT_CORPUS_DIRECTORY, help="directory of .html pages"
+    )
+    parser.add_argument("--record", nargs="+", metavar="URL", help="save these pages to the corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.corpus)
+        return
+
+    pages = load_corpus(args.corpus) if os.path.isdir(args.corpus) else []
+    if not pages:
+        print(f"No pages in {args.corpus}, save some with --record first")
+        return
+
+    size_mb = sum(len(page.encode()) for page in pages) / 2**20
+    print(f"{len(pages)} pages, {size_mb:.1f}MB, {args.repeat} passes")
+    print(f"{'pipeline':<12} {'pages/s':>10} {'MB/s':>10} {'peak MB':>10}")
+    for name, pipeline in PIPELINES.items():
+        result = benchmark(pipeline, pages, args.repeat)
+        print(
+            f"{name:<12} {result['pages_per_second']:>10.1f} {result['mb_per_second']:>10.2f}"
+            f" {result['peak_memory_mb']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,94 @@
+import asyncio
+import itertools
 import json
+import multiprocessing
 import os
+import socket
+import sys
+import time
+import uuid
+from collections import defaultdict
 import pandas as pd
 from slack_bolt.async_app import AsyncApp
 from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 from competitive_analysis_gpt.prompts import SYSTEM_PROMPT_V1, SYSTEM_PROMPT_V2
-from competitive_analysis_gpt.agent_runner import AgentRunner
+from competitive_analysis_gpt.agent_runner import AgentRunner, get_checkpoint_path
 from competitive_analysis_gpt.llm_util import GPT4, GPT35
 from slack_sdk.errors import SlackApiError
 from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+from competitive_analysis_gpt.jobs import JobQueue, LEASE_EXPIRED_ERROR
+from competitive_analysis_gpt import cassette, profiling
 from competitive_analysis_gpt.functions import (
     ScrapeURL,
+    ScrapeURLs,
+    CrawlWebsite,
     GetCrunchbaseFinancials,
+    GetCrunchbaseFinancialsForCompanies,
     GoogleSearch,
+    GoogleSearches,
     GetYoutubeTranscript,
+    GetYoutubeTranscripts,
     ResearchComplete,
 )
 from typing import List, Optional, Dict
 
 MAX_NUM_STEPS = 20
+# Max companies analyzed at once by the bot, and within a single channel
+MAX_CONCURRENT_ANALYSES = int(os.environ.get("MAX_CONCURRENT_ANALYSES", 4))
+MAX_CONCURRENT_ANALYSES_PER_CHANNEL = int(os.environ.get("MAX_CONCURRENT_ANALYSES_PER_CHANNEL", 2))
+# Min seconds between updates of a streaming `Thinking...` message
+PROGRESS_UPDATE_INTERVAL = 1.5
+PROGRESS_PREVIEW_CHARS = 300
+# Cassette files to record every LLM call, fetch, search and transcript of the bot to, or to
+# replay them from, without any network
+RECORD_CASSETTE = os.environ.get("RECORD_CASSETTE")
+REPLAY_CASSETTE = os.environ.get("REPLAY_CASSETTE")
+# Number of worker processes started with the bot that analyze queued companies.
+# With 0, submissions are analyzed inside the bot process instead of going through the job queue.
+# A cassette is used by a single process, so recording or replaying analyzes in the bot process.
+JOB_WORKERS = 0 if RECORD_CASSETTE or REPLAY_CASSETTE else int(os.environ.get("JOB_WORKERS", 2))
+# Seconds an idle worker waits before checking the job queue again
+JOB_POLL_INTERVAL = 2
 
+_job_queue = None
 
-def build_agent(query, model):
+analysis_semaphore = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+channel_semaphores = defaultdict(lambda: asyncio.Semaphore(MAX_CONCURRENT_ANALYSES_PER_CHANNEL))
+
+
+def get_job_queue():
+    """The job queue, created on first use so that importing this module doesn't create it"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
+
+
+def build_agent(query, model, run_id):
     runner = AgentRunner(
         functions=[
             ScrapeURL,
+            ScrapeURLs,
+            CrawlWebsite,
+            GetCrunchbaseFinancials,
+            GetCrunchbaseFinancialsForCompanies,
             GoogleSearch,
+            GoogleSearches,
             GetYoutubeTranscript,
+            GetYoutubeTranscripts,
             ResearchComplete,
         ],
         model=model,
+        stream=True,
+        checkpoint_path=get_checkpoint_path(f"{model}:{run_id}:{query}"),
+        prefetch=True,
     )
-    runner.add_message("system", SYSTEM_PROMPT_V2)
-    runner.add_message("user", query)
+    # Continue an analysis interrupted by a restart from its last completed step. A recorded or
+    # replayed analysis starts from scratch, since a resumed one would skip interactions.
+    if cassette.is_active() or not runner.load_checkpoint():
+        runner.add_message("system", SYSTEM_PROMPT_V2)
+        runner.add_message("user", query)
     return runner
 
 
@@ -144,6 +201,121 @@ async def handle_start_competitive_analysis(ack, body, client):
     )
 
 
+def make_progress_updater(client, channel_id, ts, loop):
+    """
+    Returns an on_delta callback for AgentRunner that shows the partial assistant message in the
+    `Thinking...` message. It runs on a worker thread, so updates are scheduled onto the event loop
+    and throttled to stay within Slack's rate limits. Scheduled updates are collected in
+    `on_delta.pending` so they can be awaited before the message is finalized.
+    """
+    last_update = 0
+
+    def on_delta(message):
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update < PROGRESS_UPDATE_INTERVAL:
+            return
+        last_update = now
+        function_call = message.get("function_call")
+        if function_call:
+            partial = (
+                f"{function_call['name']}({function_call['arguments'][-PROGRESS_PREVIEW_CHARS:]}"
+            )
+        else:
+            partial = (message.get("content") or "")[-PROGRESS_PREVIEW_CHARS:]
+        future = asyncio.run_coroutine_threadsafe(
+            client.chat_update(text=f"`Thinking...`\n```{partial}```", channel=channel_id, ts=ts),
+            loop,
+        )
+        on_delta.pending.append(future)
+
+    on_delta.pending = []
+    return on_delta
+
+
+async def analyze_company(
+    client,
+    channel_id,
+    thread_ts,
+    company,
+    guidance_keywords,
+    on_step=None,
+    run_id=None,
+    clear_checkpoint_on_failure=True,
+):
+    """
+    Runs the agent for one company, posting progress in the thread. Agent steps run on worker
+    threads so the event loop stays responsive, limited per channel and across the bot.
+    on_step(num_steps) is called after every step.
+    The checkpoint of the analysis is identified by run_id (e.g. its job), a new one by default.
+    It is deleted once the analysis completes, and when it fails unless it is retried later.
+    """
+    async with channel_semaphores[channel_id], analysis_semaphore:
+        loop = asyncio.get_running_loop()
+        await client.chat_postMessage(
+            text=f"Getting information for company: {company} with guidance keywords: {guidance_keywords}",
+            channel=channel_id,
+            thread_ts=thread_ts,
+        )
+        company_user_prompt = json.dumps({"company_name": company, "keywords": guidance_keywords})
+        runner = build_agent(company_user_prompt, GPT4, run_id or uuid.uuid4().hex)
+        # Steps run through asyncio.to_thread, which carries the label to the worker thread
+        profiling.current_company.set(company)
+        try:
+            while not runner.complete:
+                thread_response = await client.chat_postMessage(
+                    text="`Thinking...`",
+                    channel=channel_id,
+                    thread_ts=thread_ts,
+                )
+                on_delta = make_progress_updater(client, channel_id, thread_response["ts"], loop)
+                step = await asyncio.to_thread(
+                    runner.chat_completion_with_function_execution,
+                    force_complete=runner.num_steps >= MAX_NUM_STEPS,
+                    on_delta=on_delta,
+                )
+                if on_step is not None:
+                    on_step(runner.num_steps)
+                await asyncio.gather(
+                    *[asyncio.wrap_future(future) for future in on_delta.pending],
+                    return_exceptions=True,
+                )
+                if not isinstance(step, tuple):
+                    continue
+                function, result = step
+                print("Function:", function)
+                print("Result:", result)
+                function_copy = function.copy()
+                function_copy["arguments"] = json.loads(function_copy["arguments"])
+                if runner.complete:
+                    break
+                text = render_code(function_copy, "Ran:")
+                await client.chat_update(
+                    text=text,
+                    channel=channel_id,
+                    ts=thread_response["ts"],
+                )
+        except Exception:
+            if clear_checkpoint_on_failure:
+                runner.clear_checkpoint()
+            raise
+        runner.clear_checkpoint()
+        final_response = runner.final_response
+        result = {
+            "company_name": company,
+        }
+        result.update(final_response["company_profile"])
+        result["remaining_tasks"] = final_response["remaining_tasks"]
+
+        blocks = render_json_to_slack(final_response["company_profile"])
+        await client.chat_postMessage(
+            blocks=blocks,
+            channel=channel_id,
+            thread_ts=thread_ts,
+        )
+        return result
+
+
 @app.view("company_input_modal")
 async def handle_uml_submission(ack, body, client):
     private_metadata = json.loads(body["view"]["private_metadata"])
@@ -152,73 +324,198 @@ async def handle_uml_submission(ack, body, client):
     companies = form_values["companies"]["companies_input"]["value"].split("\n")
     companies = [company for company in companies if company.strip()]
     guidance_keywords = form_values["guidance_keywords"]["guidance_keywords"]["value"]
+    channel_id = private_metadata["channel_id"]
     response = await client.chat_postMessage(
         text="`In-progress...` Competitive analysis for the following companies: "
         + ", ".join(companies),
-        channel=private_metadata["channel_id"],
+        channel=channel_id,
     )
-    results = []
-    for company in companies:
+    if JOB_WORKERS > 0:
+        job_queue = get_job_queue()
+        batch_id = job_queue.create_batch(
+            {"channel_id": channel_id, "thread_ts": response["ts"], "companies": companies}
+        )
+        for company in companies:
+            job_queue.enqueue(
+                {
+                    "company": company,
+                    "guidance_keywords": guidance_keywords,
+                    "channel_id": channel_id,
+                    "thread_ts": response["ts"],
+                    "batch_id": batch_id,
+                },
+                batch_id=batch_id,
+                concurrency_key=channel_id,
+            )
         await client.chat_postMessage(
-            text=f"Getting information for company: {company} with guidance keywords: {guidance_keywords}",
-            channel=private_metadata["channel_id"],
+            text=f"Queued {len(companies)} companies for analysis",
+            channel=channel_id,
             thread_ts=response["ts"],
         )
-        company_user_prompt = json.dumps({"company_name": company, "keywords": guidance_keywords})
-        runner = build_agent(company_user_prompt, GPT4)
-        while not runner.complete:
-            thread_response = await client.chat_postMessage(
-                text="`Thinking...`",
-                channel=private_metadata["channel_id"],
-                thread_ts=response["ts"],
+        return
+
+    company_results = await asyncio.gather(
+        *[
+            # Identified by the submission rather than a random id so its checkpoint can be resumed
+            analyze_company(
+                client,
+                channel_id,
+                response["ts"],
+                company,
+                guidance_keywords,
+                run_id=f"{response['ts']}-{index}",
             )
-            function, result = runner.chat_completion_with_function_execution()
-            print("Function:", function)
-            print("Result:", result)
-            function_copy = function.copy()
-            function_copy["arguments"] = json.loads(function_copy["arguments"])
-            if runner.complete:
-                break
-            text = render_code(function_copy, "Ran:")
-            await client.chat_update(
-                text=text,
-                channel=private_metadata["channel_id"],
-                ts=thread_response["ts"],
+            for index, company in enumerate(companies)
+        ],
+        return_exceptions=True,
+    )
+    results = []
+    for company, result in zip(companies, company_results):
+        if isinstance(result, Exception):
+            print(f"Failed competitive analysis for {company}: {result}")
+            await client.chat_postMessage(
+                text=f"Failed to get information for company: {company}",
+                channel=channel_id,
+                thread_ts=response["ts"],
             )
-        final_response = runner.final_response
-        result = {
-            "company_name": company,
-        }
-        result.update(final_response["company_profile"])
-        result["remaining_tasks"] = final_response["remaining_tasks"]
+            continue
         results.append(result)
+    await upload_results(client, channel_id, response["ts"], companies, results)
 
-        blocks = render_json_to_slack(final_response["company_profile"])
-        await client.chat_postMessage(
-            blocks=blocks,
-            channel=private_metadata["channel_id"],
-            thread_ts=response["ts"],
-        )
+
+async def upload_results(client, channel_id, ts, companies, results):
     await client.chat_update(
         text=f"Finished competitive analysis for: {','.join(companies)}. Uploading CSV",
-        channel=private_metadata["channel_id"],
-        ts=response["ts"],
+        channel=channel_id,
+        ts=ts,
     )
     df = pd.DataFrame(results)
-    df.to_csv("slack_results.csv", index=False)
+    # Uploaded from memory since several submissions can finish at the same time
     await client.files_upload(
-        channels=private_metadata["channel_id"],
-        file="slack_results.csv",
+        channels=channel_id,
+        content=df.to_csv(index=False),
+        filename="slack_results.csv",
         initial_comment="Here are the results of your competitive analysis",
     )
 
 
+async def finish_batch(client, batch_id):
+    """Uploads the results of a batch if all its jobs are finished and no one else did"""
+    job_queue = get_job_queue()
+    jobs = job_queue.finalize_batch(batch_id)
+    if jobs is None:
+        return
+    batch = job_queue.get_batch(batch_id)["metadata"]
+    for job in jobs:
+        # Jobs whose worker died never got to post their failure
+        if job["status"] == "failed" and job["error"] == LEASE_EXPIRED_ERROR:
+            await client.chat_postMessage(
+                text=f"Failed to get information for company: {job['payload']['company']}",
+                channel=batch["channel_id"],
+                thread_ts=batch["thread_ts"],
+            )
+    results = [job["result"] for job in jobs if job["status"] == "done"]
+    await upload_results(
+        client, batch["channel_id"], batch["thread_ts"], batch["companies"], results
+    )
+
+
+async def process_job(client, job, worker_id):
+    """Analyzes the company of a job leased by worker_id, unless the lease is lost meanwhile"""
+    payload = job["payload"]
+    company = payload["company"]
+    job_queue = get_job_queue()
+
+    def on_step(num_steps):
+        job_queue.heartbeat(job["id"], worker_id, progress={"steps": num_steps})
+
+    try:
+        result = await analyze_company(
+            client,
+            payload["channel_id"],
+            payload["thread_ts"],
+            company,
+            payload["guidance_keywords"],
+            on_step=on_step,
+            run_id=f"job-{job['id']}",
+            # A retry resumes from the checkpoint
+            clear_checkpoint_on_failure=job["attempts"] >= job["max_attempts"],
+        )
+    except Exception as e:
+        print(f"Failed competitive analysis for {company}: {e}")
+        status = job_queue.fail(job["id"], worker_id, e)
+        if status is None:
+            print(f"Lost the lease of {company} to another worker, which reports it instead")
+            return
+        text = (
+            f"Failed to get information for company: {company}, retrying"
+            if status == "queued"
+            else f"Failed to get information for company: {company}"
+        )
+        await client.chat_postMessage(
+            text=text, channel=payload["channel_id"], thread_ts=payload["thread_ts"]
+        )
+    else:
+        if not job_queue.complete(job["id"], worker_id, result):
+            print(f"Lost the lease of {company} to another worker, which reports it instead")
+            return
+
+    # The worker finishing the last job of a submission uploads its results
+    await finish_batch(client, payload["batch_id"])
+
+
+async def run_worker(worker_id):
+    """
+    Processes jobs from the job queue until the process is stopped, up to MAX_CONCURRENT_ANALYSES
+    at once. Jobs of a channel are not leased while MAX_CONCURRENT_ANALYSES_PER_CHANNEL of them
+    are running in any worker, so a large submission leaves room for the other channels.
+    """
+    client = AsyncWebClient(token=os.environ.get("SLACK_BOT_TOKEN"))
+    print(f"Worker {worker_id} started")
+    job_queue = get_job_queue()
+    running = set()
+    leases = itertools.count()
+    while True:
+        job = None
+        if len(running) < MAX_CONCURRENT_ANALYSES:
+            # Each lease has its own owner, so a job taken over within this worker is told apart
+            lease_id = f"{worker_id}-{next(leases)}"
+            job = job_queue.lease(lease_id, max_running_per_key=MAX_CONCURRENT_ANALYSES_PER_CHANNEL)
+        if job is not None:
+            task = asyncio.create_task(process_job(client, job, lease_id))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            continue
+        # Batches whose last job failed by lease expiry have no worker to finish them
+        for batch_id in job_queue.finished_batches():
+            await finish_batch(client, batch_id)
+        if running:
+            await asyncio.wait(running, timeout=JOB_POLL_INTERVAL)
+        else:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+def run_worker_process():
+    asyncio.run(run_worker(f"{socket.gethostname()}-{os.getpid()}"))
+
+
 async def main():
     handler = AsyncSocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
     await handler.start_async()
 
 
 if __name__ == "__main__":
-    import asyncio
-
-    asyncio.run(main())
+    if sys.argv[1:] == ["worker"]:
+        # Standalone worker, to add capacity on top of the ones started with the bot
+        run_worker_process()
+    else:
+        for _ in range(JOB_WORKERS):
+            multiprocessing.Process(target=run_worker_process, daemon=True).start()
+        if RECORD_CASSETTE:
+            cassette.start_recording(RECORD_CASSETTE)
+        elif REPLAY_CASSETTE:
+            cassette.start_replay(REPLAY_CASSETTE)
+        try:
+            asyncio.run(main())
+        finally:
+            cassette.stop()
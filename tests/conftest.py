@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Keep the caches that modules open on disk out of the repository's cache/ while testing. Set
+# before the tests import them, since their directories are read from the environment on import.
+_cache_directory = tempfile.mkdtemp(prefix="competitive_analysis_gpt_tests_")
+os.environ["LLM_CACHE_DIRECTORY"] = _cache_directory
+os.environ["HTTP_CACHE_DIRECTORY"] = os.path.join(_cache_directory, "http")
+os.environ["CLEANED_CACHE_DIRECTORY"] = os.path.join(_cache_directory, "cleaned")
+os.environ["JOB_QUEUE_PATH"] = os.path.join(_cache_directory, "jobs.db")
@@ -0,0 +1,250 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import pytest
+from pydantic import BaseModel
+
+from competitive_analysis_gpt import agent_runner
+from competitive_analysis_gpt.agent_runner import AgentRunner
+from competitive_analysis_gpt.llm_util import MessageHistory
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    return str(tmp_path / "checkpoints" / "run.json.gz")
+
+
+def make_runner(checkpoint_path):
+    runner = AgentRunner(checkpoint_path=checkpoint_path)
+    runner.add_message("system", "You research companies")
+    runner.add_message("assistant", None, function_call={"name": "Search", "arguments": "{}"})
+    runner.add_message("function", "Acme sells anvils", name="Search")
+    runner.num_function_calls = 1
+    runner.num_steps = 2
+    return runner
+
+
+def test_checkpoint_round_trip(checkpoint_path):
+    saved = make_runner(checkpoint_path)
+    saved.save_checkpoint()
+    assert os.listdir(os.path.dirname(checkpoint_path)) == ["run.json.gz"]
+
+    restored = AgentRunner(checkpoint_path=checkpoint_path)
+    assert restored.load_checkpoint()
+    assert isinstance(restored.conversation_history, MessageHistory)
+    assert restored.conversation_history == saved.conversation_history
+    assert restored.conversation_history.digest() == saved.conversation_history.digest()
+    assert (restored.num_function_calls, restored.num_steps) == (1, 2)
+    assert not restored.complete
+    assert restored.final_response is None
+
+
+def test_missing_checkpoint_is_not_loaded(checkpoint_path):
+    assert not AgentRunner(checkpoint_path=checkpoint_path).load_checkpoint()
+    assert not AgentRunner().load_checkpoint()
+
+
+def test_expired_checkpoint_is_deleted(checkpoint_path, monkeypatch):
+    make_runner(checkpoint_path).save_checkpoint()
+    saved_at = agent_runner.time.time()
+    monkeypatch.setattr(
+        agent_runner.time, "time", lambda: saved_at + agent_runner.CHECKPOINT_MAX_AGE + 60
+    )
+
+    runner = AgentRunner(checkpoint_path=checkpoint_path)
+    assert not runner.load_checkpoint()
+    assert not os.path.exists(checkpoint_path)
+    assert len(runner.conversation_history) == 0
+
+
+def test_checkpoint_of_other_version_is_ignored(checkpoint_path, monkeypatch):
+    make_runner(checkpoint_path).save_checkpoint()
+    monkeypatch.setattr(agent_runner, "CHECKPOINT_VERSION", agent_runner.CHECKPOINT_VERSION + 1)
+
+    assert not AgentRunner(checkpoint_path=checkpoint_path).load_checkpoint()
+
+
+def test_unreadable_checkpoint_is_ignored(checkpoint_path):
+    os.makedirs(os.path.dirname(checkpoint_path))
+    with open(checkpoint_path, "wb") as f:
+        f.write(b"not gzip")
+
+    assert not AgentRunner(checkpoint_path=checkpoint_path).load_checkpoint()
+
+
+executed = []
+
+
+class Lookup(BaseModel):
+    """Looks up a company"""
+
+    company: str
+
+    def execute(self):
+        executed.append(self.company)
+        return f"{self.company} result"
+
+
+@pytest.mark.parametrize(
+    "arguments, expected",
+    [
+        ('{"company":"acme"}', True),
+        ('{\n  "company": "acme"\n}', True),
+        ('{"company": "beta"}', False),
+        ("not json", False),
+    ],
+)
+def test_same_call_ignores_json_formatting(arguments, expected):
+    early_execution = {"name": "Lookup", "arguments": '{"company": "acme"}'}
+    assert agent_runner._same_call(early_execution, "Lookup", arguments) is expected
+    assert not agent_runner._same_call(early_execution, "Other", '{"company": "acme"}')
+
+
+def function_call_response(arguments):
+    return openai.util.convert_to_openai_object(
+        {
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": None,
+                        "function_call": {"name": "Lookup", "arguments": arguments},
+                    },
+                    "finish_reason": "function_call",
+                }
+            ]
+        }
+    )
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """
+    Makes the streamed completion announce the given calls to on_function_call, as a stream
+    that was retried would, and then return the given final call
+    """
+    executed.clear()
+    completion = {}
+
+    def stream_chat_completion_request(*args, on_function_call=None, **kwargs):
+        for arguments in completion["announced"]:
+            on_function_call("Lookup", arguments)
+        return function_call_response(completion["final"])
+
+    def set_completion(announced, final):
+        completion.update(announced=announced, final=final)
+
+    monkeypatch.setattr(
+        agent_runner, "stream_chat_completion_request", stream_chat_completion_request
+    )
+    return set_completion
+
+
+def run_step():
+    runner = AgentRunner(functions=[Lookup], stream=True)
+    runner.add_message("user", "Research acme")
+    function, result = runner.chat_completion_with_function_execution()
+    assert runner.conversation_history[-1] == {
+        "role": "function",
+        "content": result,
+        "name": "Lookup",
+    }
+    return function, result
+
+
+def test_early_result_is_used_for_the_same_call(stream):
+    stream(announced=['{"company":"acme"}'], final='{"company": "acme"}')
+    function, result = run_step()
+    assert result == "acme result"
+    assert executed == ["acme"]
+
+
+def test_early_result_is_discarded_when_the_final_call_differs(stream, monkeypatch):
+    # Keep the only tool thread busy so that the early execution is still queued when discarded
+    tool_executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    tool_executor.submit(release.wait, 5)
+    monkeypatch.setattr(agent_runner, "_tool_executor", tool_executor)
+    stream(announced=['{"company": "acme"}'], final='{"company": "beta"}')
+
+    function, result = run_step()
+    release.set()
+    tool_executor.shutdown(wait=True)
+
+    assert result == "beta result"
+    assert executed == ["beta"]
+
+
+def test_retried_stream_replaces_the_early_call(stream):
+    stream(
+        announced=['{"company": "acme"}', '{"company": "beta"}', '{"company":"beta"}'],
+        final='{"company": "beta"}',
+    )
+    function, result = run_step()
+    assert result == "beta result"
+    # The call of the first attempt may have run, but only once, and its result is not used
+    assert executed.count("beta") == 1
+    assert executed.count("acme") <= 1
+
+
+def make_research_runner(token_budget, results):
+    runner = AgentRunner(token_budget=token_budget)
+    runner.add_message("system", "You research companies")
+    runner.add_message("user", "Research acme")
+    for index, result in enumerate(results):
+        arguments = f'{{"url": "https://acme.com/{index}"}}'
+        runner.add_message(
+            "assistant", None, function_call={"name": "ScrapeURL", "arguments": arguments}
+        )
+        runner.add_message("function", result, name="ScrapeURL")
+    return runner
+
+
+def page(index):
+    return f"Page {index} " + "acme sells anvils " * 500
+
+
+def test_compact_history_keeps_recent_results_and_digests_older_ones():
+    results = [page(0), "Page 1 is short", page(2), page(3), page(4)]
+    runner = make_research_runner(5000, results)
+    assert runner.count_history_tokens() > 5000
+
+    runner.compact_history()
+
+    function_messages = [m for m in runner.conversation_history if m["role"] == "function"]
+    contents = [m["content"] for m in function_messages]
+    # The last results stay verbatim, and so do older ones already shorter than a digest
+    assert contents[1:2] + contents[3:] == ["Page 1 is short", page(3), page(4)]
+    for compacted, result in [(contents[0], page(0)), (contents[2], page(2))]:
+        assert compacted.startswith(agent_runner.COMPACTED_PREFIX + "ScrapeURL result, ")
+        assert compacted.endswith(result[: agent_runner.DIGEST_CHARS] + "...")
+        assert len(compacted) < len(result) // 10
+    assert all(m["name"] == "ScrapeURL" for m in function_messages)
+    assert runner.count_history_tokens() <= 5000
+    assert runner.message_tokens == [
+        agent_runner.count_message_tokens(m) for m in runner.conversation_history
+    ]
+
+
+def test_compact_history_leaves_history_under_the_budget_alone():
+    runner = make_research_runner(100_000, [page(0), page(1), page(2)])
+    history = list(runner.conversation_history)
+
+    runner.compact_history()
+
+    assert runner.conversation_history == history
+
+
+def test_compacted_results_are_not_compacted_again():
+    runner = make_research_runner(3000, [page(0), page(1), page(2)])
+    runner.compact_history()
+    compacted = runner.conversation_history[3]["content"]
+    runner.add_message("function", page(3), name="ScrapeURL")
+
+    runner.compact_history()
+
+    assert runner.conversation_history[3]["content"] == compacted
+    assert runner.conversation_history[5]["content"].startswith(agent_runner.COMPACTED_PREFIX)
@@ -0,0 +1,84 @@
+from competitive_analysis_gpt.commands import boilerplate
+from competitive_analysis_gpt.commands.browse import html_to_markdown
+
+
+def test_repeated_blocks_are_removed():
+    card = "Acme helps teams plan their work, track progress and ship projects on time, every time."
+    markdown = f"{card}\n\nAcme plans work.\n\n{card}\n\n**{card.upper()}**\n"
+    assert boilerplate.strip_boilerplate(markdown) == f"{card}\n\nAcme plans work.\n"
+
+
+def test_repeated_link_lists_are_removed():
+    links = "[Pricing](/pricing) [Docs](/docs) [About](/about) [Blog](/blog)"
+    markdown = f"{links}\n\nAcme plans work.\n\n{links}\n"
+    assert boilerplate.strip_boilerplate(markdown) == (
+        "[Pricing](/pricing), [Docs](/docs), [About](/about), [Blog](/blog)\n\nAcme plans work.\n"
+    )
+
+
+def test_pricing_tiers_keep_their_repeated_lines():
+    markdown = (
+        "## Team\n\n$10\n\nper user / month\n\nContact sales\n\n"
+        "## Business\n\n$20\n\nper user / month\n\nContact sales\n"
+    )
+    assert boilerplate.strip_boilerplate(markdown) == markdown
+
+
+def test_cookie_notice_is_removed():
+    markdown = "We use cookies to improve your experience. Accept all\n\nAcme plans work.\n"
+    assert boilerplate.strip_boilerplate(markdown) == "Acme plans work.\n"
+
+
+def test_long_text_mentioning_cookies_is_kept():
+    text = "Our cookie recipes are loved by bakers, who accept no substitutes. " * 20
+    assert boilerplate.strip_boilerplate(text) == text.strip() + "\n"
+
+
+def test_link_lists_keep_their_urls():
+    markdown = (
+        "  * [Pricing](/pricing)\n  * [Docs](https://docs.acme.com)\n"
+        "  * [About](/about)\n  * [Blog](/blog)\n"
+    )
+    assert boilerplate.strip_boilerplate(markdown) == (
+        "[Pricing](/pricing), [Docs](https://docs.acme.com), [About](/about), [Blog](/blog)\n"
+    )
+
+
+def test_prose_with_links_is_kept():
+    markdown = "Acme integrates with [Slack](/slack) and [Jira](/jira) for teams of any size.\n"
+    assert boilerplate.strip_boilerplate(markdown) == markdown
+
+
+def test_navigation_is_pruned_and_listed_as_site_links():
+    html = (
+        '<nav><a href="/pricing">Pricing</a> <a href="/about">About</a></nav>'
+        "<h1>Acme</h1><p>Acme plans work.</p>"
+        '<div class="cookie-banner"><p>Cookies</p></div>'
+    )
+    markdown = html_to_markdown(html, resolve_iframes=False)
+    assert "Pricing" not in markdown.split("Site links")[0]
+    assert "Cookies" not in markdown
+    assert "Acme plans work." in markdown
+    assert markdown.rstrip().endswith("Site links: /pricing, /about")
+
+
+def test_unclosed_region_keeps_rest_of_page():
+    html = '<p>Intro</p><div class="sponsor"><p>Sponsored</p><p>Pricing starts at $10</p>'
+    markdown = html_to_markdown(html, resolve_iframes=False)
+    assert "Pricing starts at $10" in markdown
+    assert "BOILERPLATE" not in markdown
+
+
+def test_oversized_region_is_kept():
+    body = "".join(f"<p>Feature {i} does something useful for teams.</p>" for i in range(200))
+    html = f'<div class="modal">{body}</div>'
+    markdown = html_to_markdown(html, resolve_iframes=False)
+    assert "Feature 199" in markdown
+    assert "BOILERPLATE" not in markdown
+
+
+def test_stripping_can_be_disabled():
+    html = '<nav><a href="/pricing">Pricing</a></nav><p>Acme plans work.</p>'
+    markdown = html_to_markdown(html, resolve_iframes=False, strip_boilerplate=False)
+    assert "[Pricing](/pricing)" in markdown
+    assert "Site links" not in markdown
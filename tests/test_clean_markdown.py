@@ -0,0 +1,40 @@
+from competitive_analysis_gpt.commands.browse import (
+    count_tokens,
+    merge_cleaned_chunks,
+    split_markdown,
+)
+
+
+def section(title, words):
+    return f"# {title}\n\n" + "word " * words + "\n\n"
+
+
+def test_short_markdown_is_one_chunk():
+    content = section("Pricing", 10) + section("Features", 10)
+    assert split_markdown(content, max_tokens=1000) == [content]
+
+
+def test_chunks_break_on_headings():
+    content = section("Pricing", 100) + section("Features", 100) + section("About", 100)
+    chunks = split_markdown(content, max_tokens=150)
+    assert [chunk.split("\n")[0] for chunk in chunks] == ["# Pricing", "# Features", "# About"]
+    assert "".join(chunks) == content
+
+
+def test_long_sections_are_split_within_budget():
+    paragraphs = "\n\n".join("word " * 40 for _ in range(10))
+    content = "# Docs\n\n" + paragraphs + "\n\n" + "x" * 5000
+    chunks = split_markdown(content, max_tokens=100)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks).count("word") == 400
+
+
+def test_merge_drops_blocks_repeated_across_chunks():
+    chunks = [
+        "# Acme\n\nAcme plans work.\n\n## Pricing\n\n$10 per seat",
+        "# Acme\n\nAcme  plans work!\n\n## Features\n\nGantt charts",
+    ]
+    assert merge_cleaned_chunks(chunks) == (
+        "# Acme\n\nAcme plans work.\n\n## Pricing\n\n$10 per seat\n\n## Features\n\nGantt charts"
+    )
@@ -0,0 +1,73 @@
+import pytest
+
+from competitive_analysis_gpt.commands import crawl
+
+
+@pytest.mark.parametrize(
+    "url, fields",
+    [
+        ("https://acme.com/pricing", ["pricing_details"]),
+        ("https://acme.com/integrations/postgres", ["integrations"]),
+        ("https://acme.com/search-analytics/pricing", ["pricing_details"]),
+        ("https://acme.com/ai/features", ["features"]),
+        ("https://acme.com/en/about", ["one_liner", "founding_date"]),
+    ],
+)
+def test_score_page_fields(url, fields):
+    assert crawl.score_page(url)[0] == fields
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://acme.com/blog/pricing-update",
+        "https://acme.com/posts/features",
+        "https://acme.com/search",
+        "https://acme.com/tag/integrations",
+        "https://acme.com/cart/",
+        "https://acme.com/wp-content/pricing",
+        "https://acme.com/pricing.pdf",
+        "https://acme.com/de/preise/pricing",
+        "https://acme.com/fr-fr/pricing",
+    ],
+)
+def test_score_page_excluded(url):
+    assert crawl.score_page(url) == ([], 0)
+
+
+def test_excluded_words_only_match_whole_segments():
+    assert crawl.EXCLUDED_PATH_PATTERN.search("/integrations/postgres") is None
+    assert crawl.EXCLUDED_PATH_PATTERN.search("/search-analytics") is None
+    assert crawl.EXCLUDED_PATH_PATTERN.search("/tagging-platform") is None
+    assert crawl.EXCLUDED_PATH_PATTERN.search("/cartography-features") is None
+    assert crawl.LOCALE_PATH_PATTERN.match("/hr/benefits") is None
+    assert crawl.LOCALE_PATH_PATTERN.match("/go/features") is None
+
+
+def test_shallower_pages_score_higher():
+    assert (
+        crawl.score_page("https://acme.com/pricing")[1]
+        > crawl.score_page("https://acme.com/docs/billing/pricing")[1]
+    )
+
+
+def test_rank_pages_covers_distinct_fields_first():
+    urls = [
+        "https://acme.com/pricing",
+        "https://acme.com/pricing?utm_source=ad",
+        "https://acme.com/plans",
+        "https://acme.com/integrations",
+        "https://acme.com/about",
+        "https://acme.com/blog/pricing",
+        "https://other.com/pricing",
+    ]
+    assert crawl.rank_pages(urls, "https://acme.com", max_pages=3) == [
+        "https://acme.com/about",
+        "https://acme.com/plans",
+        "https://acme.com/integrations",
+    ]
+
+
+def test_rank_pages_keeps_the_first_variant_of_a_page():
+    urls = ["https://acme.com/pricing?utm_source=ad", "https://acme.com/pricing"]
+    assert crawl.rank_pages(urls, "https://acme.com") == ["https://acme.com/pricing?utm_source=ad"]
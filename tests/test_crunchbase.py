@@ -0,0 +1,65 @@
+import os
+
+from competitive_analysis_gpt.commands import crunchbase
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(__file__), "fixtures", "crunchbase_company_financials.html"
+)
+
+
+def load_fixture():
+    with open(FIXTURE_PATH) as f:
+        return f.read()
+
+
+def test_parse_financials_summary():
+    financials = crunchbase.parse_financials(load_fixture())
+    assert financials["summary"] == {
+        "number_of_funding_rounds": "3",
+        "total_funding_amount": "$48.5M",
+        "number_of_lead_investors": "3",
+        "number_of_investors": "5",
+    }
+
+
+def test_parse_financials_funding_rounds():
+    rounds = crunchbase.parse_financials(load_fixture())["funding_rounds"]
+    assert [r["transaction_name"] for r in rounds] == [
+        "Series B - Acme Robotics",
+        "Series A - Acme Robotics",
+        "Seed Round - Acme Robotics",
+    ]
+    assert rounds[0] == {
+        "announced_date": "Mar 14, 2023",
+        "transaction_name": "Series B - Acme Robotics",
+        "number_of_investors": "4",
+        "money_raised": "$35M",
+        "lead_investors": ["Northwind Ventures", "Tailspin Capital"],
+    }
+    assert rounds[1]["lead_investors"] == "Fabrikam Partners"
+
+
+def test_parse_financials_investors():
+    investors = crunchbase.parse_financials(load_fixture())["investors"]
+    assert [(i["investor_name"], i["lead_investor"]) for i in investors] == [
+        ("Northwind Ventures", "Yes"),
+        ("Contoso Angels", "No"),
+    ]
+
+
+def test_parse_financials_without_financials():
+    assert crunchbase.parse_financials("<html><body><p>Page not found</p></body></html>") is None
+
+
+def test_get_organization_slug():
+    assert (
+        crunchbase.get_organization_slug("https://www.crunchbase.com/organization/OpenAI")
+        == "openai"
+    )
+    assert (
+        crunchbase.get_organization_slug(
+            "https://www.crunchbase.com/organization/openai/company_financials?tab=1"
+        )
+        == "openai"
+    )
+    assert crunchbase.get_organization_slug("https://www.crunchbase.com/person/jane-doe") is None
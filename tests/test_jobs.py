@@ -0,0 +1,151 @@
+import sqlite3
+
+import pytest
+
+from competitive_analysis_gpt.jobs import LEASE_EXPIRED_ERROR, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_lease_returns_oldest_job_once(queue):
+    first = queue.enqueue({"company": "a"})
+    queue.enqueue({"company": "b"})
+
+    job = queue.lease("worker-1")
+    assert job["id"] == first
+    assert job["payload"] == {"company": "a"}
+    assert job["attempts"] == 1
+    assert queue.lease("worker-2")["payload"] == {"company": "b"}
+    assert queue.lease("worker-3") is None
+
+
+def test_expired_lease_is_taken_over(queue):
+    job_id = queue.enqueue({"company": "a"})
+    queue.lease("worker-1", lease_seconds=-1)
+
+    job = queue.lease("worker-2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_worker_that_lost_its_lease_cannot_finish_the_job(queue):
+    job_id = queue.enqueue({"company": "a"})
+    queue.lease("worker-1", lease_seconds=-1)
+    queue.lease("worker-2")
+
+    assert not queue.complete(job_id, "worker-1", {"company_name": "stale"})
+    assert queue.fail(job_id, "worker-1", "boom") is None
+    assert queue.complete(job_id, "worker-2", {"company_name": "a"})
+    assert not queue.complete(job_id, "worker-2", {"company_name": "again"})
+    assert queue.fail(job_id, "worker-2", "boom") is None
+
+
+def test_lease_caps_running_jobs_per_concurrency_key(queue):
+    for company in ["a1", "a2", "a3"]:
+        queue.enqueue({"company": company}, concurrency_key="channel-a")
+    queue.enqueue({"company": "b1"}, concurrency_key="channel-b")
+
+    leased = [queue.lease(f"worker-{i}", max_running_per_key=2) for i in range(4)]
+    assert [job["payload"]["company"] if job else None for job in leased] == [
+        "a1",
+        "a2",
+        "b1",
+        None,
+    ]
+    queue.complete(leased[0]["id"], "worker-0", {})
+    assert queue.lease("worker-4", max_running_per_key=2)["payload"] == {"company": "a3"}
+
+
+def test_expired_leases_dont_count_against_the_cap(queue):
+    first = queue.enqueue({"company": "a1"}, concurrency_key="channel-a")
+    queue.enqueue({"company": "a2"}, concurrency_key="channel-a")
+    queue.lease("worker-1", lease_seconds=-1, max_running_per_key=1)
+
+    job = queue.lease("worker-2", max_running_per_key=1)
+    assert job["id"] == first
+    assert queue.lease("worker-3", max_running_per_key=1) is None
+
+
+def test_queue_created_before_concurrency_keys_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT,"
+        " payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued',"
+        " attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, worker_id TEXT,"
+        " lease_expires_at REAL, available_at REAL NOT NULL, progress TEXT, result TEXT,"
+        " error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.close()
+    queue = JobQueue(path)
+    queue.enqueue({"company": "a"}, concurrency_key="channel-a")
+    assert queue.lease("worker-1", max_running_per_key=1)["concurrency_key"] == "channel-a"
+
+
+def test_heartbeat_keeps_lease(queue):
+    job_id = queue.enqueue({"company": "a"})
+    queue.lease("worker-1", lease_seconds=-1)
+    queue.heartbeat(job_id, "worker-1", progress={"steps": 3})
+
+    assert queue.lease("worker-2") is None
+
+
+def test_fail_retries_until_max_attempts(queue):
+    job_id = queue.enqueue({"company": "a"}, max_attempts=2)
+
+    queue.lease("worker-1")
+    assert queue.fail(job_id, "worker-1", "boom", retry_delay=0) == "queued"
+    queue.lease("worker-1")
+    assert queue.fail(job_id, "worker-1", "boom", retry_delay=0) == "failed"
+    assert queue.lease("worker-1") is None
+
+
+def test_failed_job_waits_for_retry_delay(queue):
+    job_id = queue.enqueue({"company": "a"})
+    queue.lease("worker-1")
+    queue.fail(job_id, "worker-1", "boom", retry_delay=60)
+
+    assert queue.lease("worker-1") is None
+
+
+def test_finalize_batch_once_all_jobs_finished(queue):
+    batch_id = queue.create_batch({"companies": ["a", "b"]})
+    first = queue.enqueue({"company": "a"}, batch_id=batch_id)
+    second = queue.enqueue({"company": "b"}, batch_id=batch_id, max_attempts=1)
+
+    queue.lease("worker-1")
+    assert queue.complete(first, "worker-1", {"company_name": "a"})
+    assert queue.finalize_batch(batch_id) is None
+
+    queue.lease("worker-1")
+    queue.fail(second, "worker-1", "boom")
+    jobs = queue.finalize_batch(batch_id)
+    assert [job["status"] for job in jobs] == ["done", "failed"]
+    assert jobs[0]["result"] == {"company_name": "a"}
+    # Exactly one caller finalizes a batch
+    assert queue.finalize_batch(batch_id) is None
+    assert queue.get_batch(batch_id)["metadata"] == {"companies": ["a", "b"]}
+
+
+def test_batch_of_job_failed_by_lease_expiry_is_finished(queue):
+    batch_id = queue.create_batch({"companies": ["a"]})
+    job_id = queue.enqueue({"company": "a"}, batch_id=batch_id, max_attempts=1)
+    queue.lease("worker-1", lease_seconds=-1)
+    assert queue.finished_batches() == []
+
+    # The next lease fails the job that has no attempts left instead of running it again
+    assert queue.lease("worker-2") is None
+    assert queue.finished_batches() == [batch_id]
+    (job,) = queue.finalize_batch(batch_id)
+    assert job["id"] == job_id
+    assert job["error"] == LEASE_EXPIRED_ERROR
+    assert queue.finished_batches() == []
+
+
+def test_queue_persists_across_instances(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    JobQueue(path).enqueue({"company": "a"}, max_attempts=1)
+    assert JobQueue(path).lease("worker-1")["payload"] == {"company": "a"}
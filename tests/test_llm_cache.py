@@ -0,0 +1,110 @@
+import pickle
+
+import diskcache as dc
+import pytest
+
+from competitive_analysis_gpt import llm_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = dc.Cache(str(tmp_path / "cache"), tag_index=True, statistics=True)
+    namespace_index = dc.Cache(str(tmp_path / "namespaces"), eviction_policy="none")
+    monkeypatch.setattr(llm_cache, "cache", cache)
+    monkeypatch.setattr(llm_cache, "namespace_index", namespace_index)
+    monkeypatch.setattr(llm_cache, "stats", llm_cache.CacheStats())
+    yield cache
+    cache.close()
+    namespace_index.close()
+
+
+def entry_size(answer):
+    return len(pickle.dumps({"answer": answer}))
+
+
+def arguments(model, content):
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "Version: 1"},
+            {"role": "user", "content": content},
+        ],
+    }
+
+
+def test_list_namespaces_counts_entries_without_reading_them(cache):
+    llm_cache.cache_set(arguments("gpt-4", "a"), {"answer": "x" * 100})
+    llm_cache.cache_set(arguments("gpt-4", "b"), {"answer": "y" * 100_000})
+    llm_cache.cache_set(arguments("gpt-3.5", "a"), {"answer": "z"})
+
+    namespaces = llm_cache.list_namespaces()
+    gpt4 = namespaces[llm_cache.get_namespace(arguments("gpt-4", "a"))]
+    assert gpt4["entries"] == 2
+    assert gpt4["bytes"] > 100_000
+    assert namespaces[llm_cache.get_namespace(arguments("gpt-3.5", "a"))]["entries"] == 1
+    assert cache.stats() == (0, 0)
+
+
+def test_list_namespaces_skips_removed_entries(cache):
+    llm_cache.cache_set(arguments("gpt-4", "a"), {"answer": "x"})
+    llm_cache.cache_set(arguments("gpt-4", "b"), {"answer": "y"})
+    llm_cache.cache_set(arguments("gpt-3.5", "a"), {"answer": "z"})
+    cache.delete(llm_cache.cache_key(**arguments("gpt-4", "a")))
+    llm_cache.prune(model="gpt-3.5")
+
+    namespaces = llm_cache.list_namespaces()
+    assert namespaces == {
+        llm_cache.get_namespace(arguments("gpt-4", "b")): {"entries": 1, "bytes": entry_size("y")}
+    }
+    assert len(llm_cache.namespace_index) == 1
+
+
+def test_unreadable_entry_counts_as_miss(cache):
+    cache.set(llm_cache.cache_key(**arguments("gpt-4", "a")), b"not a pickle")
+
+    assert llm_cache.cache_get(arguments("gpt-4", "a")) is None
+    assert llm_cache.cache_get(arguments("gpt-4", "b")) is None
+    llm_cache.cache_set(arguments("gpt-4", "b"), {"answer": "x"})
+    assert llm_cache.cache_get(arguments("gpt-4", "b")) == {"answer": "x"}
+    counts = llm_cache.stats.as_dict()
+    assert (counts["hits"], counts["misses"]) == (1, 2)
+
+
+def messages(*contents):
+    return [{"role": "user", "content": content} for content in contents]
+
+
+def test_message_history_digest_matches_plain_list():
+    history = llm_cache.MessageHistory(messages("a", "b"))
+    assert history.digest() == llm_cache.messages_digest(messages("a", "b"))
+    history.append({"role": "user", "content": "c"})
+    assert history.digest() == llm_cache.messages_digest(messages("a", "b", "c"))
+    assert llm_cache.messages_digest([]) == llm_cache.MessageHistory().digest() == ""
+
+
+@pytest.mark.parametrize(
+    "mutate, expected",
+    [
+        (lambda h: h.__setitem__(1, {"role": "user", "content": "x"}), ["a", "x", "c"]),
+        (lambda h: h.__setitem__(slice(1, None), messages("y")), ["a", "y"]),
+        (lambda h: h.__delitem__(-1), ["a", "b"]),
+        (lambda h: h.insert(0, {"role": "user", "content": "z"}), ["z", "a", "b", "c"]),
+        (lambda h: h.pop(), ["a", "b"]),
+        (lambda h: h.pop(0), ["b", "c"]),
+        (lambda h: h.remove({"role": "user", "content": "b"}), ["a", "c"]),
+        (lambda h: h.reverse(), ["c", "b", "a"]),
+        (lambda h: h.clear(), []),
+    ],
+)
+def test_message_history_digest_is_invalidated_by_mutations(mutate, expected):
+    history = llm_cache.MessageHistory(messages("a", "b", "c"))
+    history.digest()
+    mutate(history)
+    assert history.digest() == llm_cache.messages_digest(messages(*expected))
+
+
+def test_cache_key_is_the_same_for_message_history_and_list():
+    history = llm_cache.MessageHistory(messages("a", "b"))
+    assert llm_cache.cache_key(messages=history, model="m") == llm_cache.cache_key(
+        messages=messages("a", "b"), model="m"
+    )
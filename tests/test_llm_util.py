@@ -0,0 +1,158 @@
+import diskcache as dc
+import openai
+import pytest
+
+from competitive_analysis_gpt import llm_cache, llm_util
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    cache = dc.Cache(str(tmp_path / "cache"), tag_index=True, statistics=True)
+    namespace_index = dc.Cache(str(tmp_path / "namespaces"), eviction_policy="none")
+    monkeypatch.setattr(llm_cache, "cache", cache)
+    monkeypatch.setattr(llm_cache, "namespace_index", namespace_index)
+    yield cache
+    cache.close()
+    namespace_index.close()
+
+
+class FakeStreams:
+    """
+    Chunk lists served by ChatCompletion.create, one per request. A chunk that is an exception is
+    raised when the stream gets to it. Chunks are recorded in `consumed` as they are read.
+    """
+
+    def __init__(self):
+        self.queued = []
+        self.consumed = []
+
+    def append(self, chunks):
+        self.queued.append(chunks)
+
+    def create(self, **kwargs):
+        assert kwargs["stream"]
+        chunks = self.queued.pop(0)
+
+        def stream():
+            for chunk in chunks:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                self.consumed.append(chunk)
+                yield chunk
+
+        return stream()
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    streams = FakeStreams()
+    monkeypatch.setattr(openai.ChatCompletion, "create", streams.create)
+    return streams
+
+
+def chunk(finish_reason=None, **delta):
+    return {
+        "id": "chatcmpl-1",
+        "created": 1,
+        "model": llm_util.GPT35,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def function_chunk(name=None, arguments=None):
+    return chunk(function_call={"name": name, "arguments": arguments})
+
+
+MESSAGES = [{"role": "user", "content": "Research acme"}]
+
+
+def test_content_deltas_are_assembled(streams):
+    streams.append(
+        [
+            chunk(role="assistant", content=""),
+            chunk(content="Acme sells "),
+            chunk(content="anvils"),
+            chunk(finish_reason="stop"),
+        ]
+    )
+    partial_contents = []
+
+    response = llm_util.stream_chat_completion_request(
+        MESSAGES, on_delta=lambda message: partial_contents.append(message["content"])
+    )
+
+    assert response["choices"][0]["message"] == {
+        "role": "assistant",
+        "content": "Acme sells anvils",
+    }
+    assert response["choices"][0]["finish_reason"] == "stop"
+    assert response["id"] == "chatcmpl-1"
+    assert partial_contents == [None, "Acme sells ", "Acme sells anvils", "Acme sells anvils"]
+
+
+def test_function_call_is_announced_once_its_arguments_are_complete(streams):
+    streams.append(
+        [
+            function_chunk(name="Lookup", arguments=""),
+            function_chunk(arguments='{"company": '),
+            function_chunk(arguments='"acme"}'),
+            chunk(),
+            chunk(finish_reason="function_call"),
+        ]
+    )
+    calls = []
+
+    def on_function_call(name, arguments):
+        calls.append((name, arguments, len(streams.consumed)))
+
+    response = llm_util.stream_chat_completion_request(
+        MESSAGES, functions=[], on_function_call=on_function_call
+    )
+
+    function_call = response["choices"][0]["message"]["function_call"]
+    assert (function_call.name, function_call.arguments) == ("Lookup", '{"company": "acme"}')
+    assert response["choices"][0]["finish_reason"] == "function_call"
+    # Announced on the chunk that completed the arguments, before the rest of the stream
+    assert calls == [("Lookup", '{"company": "acme"}', 3)]
+
+
+def test_cached_response_replays_callbacks_without_a_request(streams):
+    streams.append(
+        [function_chunk(name="Lookup", arguments='{"company": "acme"}'), chunk("function_call")]
+    )
+    first = llm_util.stream_chat_completion_request(MESSAGES, functions=[])
+    calls = []
+    deltas = []
+
+    second = llm_util.stream_chat_completion_request(
+        MESSAGES,
+        functions=[],
+        on_delta=deltas.append,
+        on_function_call=lambda *call: calls.append(call),
+    )
+
+    assert second == first
+    assert streams.queued == []
+    assert calls == [("Lookup", '{"company": "acme"}')]
+    assert deltas == [first["choices"][0]["message"]]
+
+
+def test_stream_is_retried_after_a_partial_stream(streams):
+    streams.append(
+        [
+            function_chunk(name="Lookup", arguments='{"company": "acme"}'),
+            openai.error.APIConnectionError("connection reset"),
+        ]
+    )
+    streams.append(
+        [function_chunk(name="Lookup", arguments='{"company": "beta"}'), chunk("function_call")]
+    )
+    calls = []
+
+    response = llm_util.stream_chat_completion_request(
+        MESSAGES, functions=[], on_function_call=lambda *call: calls.append(call)
+    )
+
+    # Every attempt announces its own call, the caller keeps the last one
+    assert calls == [("Lookup", '{"company": "acme"}'), ("Lookup", '{"company": "beta"}')]
+    assert response["choices"][0]["message"]["function_call"]["arguments"] == '{"company": "beta"}'
@@ -0,0 +1,34 @@
+import sys
+
+import main
+
+
+def fake_run_company(company, guidance_keywords, model, resume=True, run_id=""):
+    print(f"Researching {company}")
+    print("Done", end="")
+    if company == "broken":
+        raise ValueError("boom")
+    return {"company_name": company, "run_id": run_id}
+
+
+def test_single_company_output_is_not_prefixed(monkeypatch, capsys):
+    monkeypatch.setattr(main, "run_company", fake_run_company)
+    stdout = sys.stdout
+    results = main.run_companies(["acme"], [], "model", concurrency=4)
+    assert results == [{"company_name": "acme", "run_id": "0"}]
+    assert capsys.readouterr().out == "Researching acme\nDone"
+    assert sys.stdout is stdout
+
+
+def test_concurrent_output_is_prefixed_per_line(monkeypatch, capsys):
+    monkeypatch.setattr(main, "run_company", fake_run_company)
+    results = main.run_companies(["acme", "broken"], [], "model", concurrency=2)
+    assert results[0] == {"company_name": "acme", "run_id": "0"}
+    assert results[1] == {"company_name": "broken", "error": "ValueError('boom')"}
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == [
+        "[acme] Done",
+        "[acme] Researching acme",
+        "[broken] DoneFailed competitive analysis for broken: ValueError('boom')",
+        "[broken] Researching broken",
+    ]
@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from competitive_analysis_gpt import prefetch
+from competitive_analysis_gpt.commands import browse
+
+
+@pytest.fixture
+def busy_executor(monkeypatch):
+    """An executor whose only worker is busy, so prefetches stay queued"""
+    executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    monkeypatch.setattr(prefetch, "_prefetch_executor", executor)
+    monkeypatch.setattr(browse, "fetch_and_convert", lambda url: f"# {url}")
+    yield executor
+    release.set()
+    executor.shutdown()
+
+
+def run_with_timeout(func, timeout=5):
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "deadlocked"
+
+
+def test_clear_cancels_queued_prefetches(busy_executor):
+    prefetcher = prefetch.Prefetcher()
+    prefetcher.schedule(["https://acme.com/pricing", "https://acme.com/about"])
+    futures = list(prefetcher.entries.values())
+
+    run_with_timeout(prefetcher.clear)
+    assert prefetcher.entries == {}
+    assert all(future.cancelled() for future in futures)
+
+
+def test_trim_cancels_queued_prefetches(busy_executor):
+    prefetcher = prefetch.Prefetcher(max_entries=1)
+    run_with_timeout(
+        lambda: prefetcher.schedule(["https://acme.com/pricing", "https://acme.com/about"])
+    )
+    assert list(prefetcher.entries) == ["https://acme.com/about"]
+
+
+def test_prefetched_page_is_served_once(monkeypatch):
+    monkeypatch.setattr(browse, "fetch_and_convert", lambda url: f"# {url}")
+    prefetcher = prefetch.Prefetcher()
+    prefetcher.schedule(["https://acme.com/pricing?utm_source=x"])
+    assert prefetcher.get("https://acme.com/pricing") == "# https://acme.com/pricing?utm_source=x"
+    assert prefetcher.get("https://acme.com/pricing") is None
+    assert (prefetcher.hits, prefetcher.misses) == (1, 1)
@@ -0,0 +1,71 @@
+import pytest
+
+from competitive_analysis_gpt import ratelimit
+from competitive_analysis_gpt.ratelimit import RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    return clock
+
+
+def test_bucket_allows_burst_up_to_capacity(clock):
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1.0)
+    # Waiters queue up behind each other
+    assert bucket.reserve() == pytest.approx(2.0)
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(60, capacity=1)
+    bucket.reserve()
+    clock.now += 0.5
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.now += 100
+    assert bucket.reserve() == 0
+
+
+def test_reservation_larger_than_capacity_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(600, capacity=100)
+    assert bucket.reserve(1000) == 0
+    assert bucket.reserve(10) == pytest.approx(1.0)
+
+
+def test_adjust_corrects_estimate(clock):
+    bucket = TokenBucket(60, capacity=10)
+    bucket.reserve(10)
+    bucket.adjust(-5)
+    assert bucket.reserve(5) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_refund_gives_back_a_failed_request(clock):
+    limiter = RateLimiter()
+    limiter.wait_for_openai("gpt-test", 40000)
+    limiter.refund_openai("gpt-test", 40000)
+    assert limiter.wait_for_openai("gpt-test", 40000) == 0
+    assert limiter.get_stats() == {}
+
+
+def test_waits_are_counted_per_kind(clock):
+    limiter = RateLimiter()
+    for _ in range(ratelimit.FETCH_DOMAIN_BURST + 1):
+        limiter.wait_for_domain("https://www.example.com/page")
+    limiter.wait_for_domain("https://other.example.com/")
+    stats = limiter.get_stats()
+    assert list(stats) == ["fetch"]
+    assert stats["fetch"]["waits"] == 1
+    assert stats["fetch"]["wait_seconds"] == pytest.approx(1.0)
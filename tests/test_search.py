@@ -0,0 +1,55 @@
+import itertools
+import threading
+
+import pytest
+
+from competitive_analysis_gpt.commands import search
+
+_queries = itertools.count()
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Fake DuckDuckGo sessions, recorded as they are created"""
+    created = []
+    lock = threading.Lock()
+
+    class FakeDDGS:
+        def __init__(self, timeout=None):
+            with lock:
+                created.append(self)
+
+        def text(self, keywords):
+            if keywords.startswith("broken"):
+                raise RuntimeError("ratelimit")
+            for index in range(3):
+                yield {"title": keywords, "href": f"https://example.com/{index}", "body": ""}
+
+    monkeypatch.setattr(search, "DDGS", FakeDDGS)
+    monkeypatch.setattr(search, "_idle_sessions", [])
+    monkeypatch.setattr(search.rate_limiter, "wait_for_search", lambda source: None)
+    return created
+
+
+def unique_queries(count, prefix="query"):
+    # Queries are never repeated across tests, since results are cached on disk
+    return [f"{prefix} {next(_queries)}" for _ in range(count)]
+
+
+def test_search_many_reuses_sessions_across_calls(sessions):
+    for _ in range(3):
+        results = search.search_many(unique_queries(6), limit=2)
+        assert all(len(result) == 2 for result in results)
+
+    assert 1 <= len(sessions) <= search.MAX_PARALLEL_SEARCHES
+    assert len(search._idle_sessions) == len(sessions)
+
+
+def test_failed_session_is_not_reused(sessions):
+    [result] = search.search_many(unique_queries(1, prefix="broken"))
+    assert isinstance(result, RuntimeError)
+    assert search._idle_sessions == []
+
+    search.search(unique_queries(1)[0])
+    assert len(sessions) == 2
+    assert search._idle_sessions == [sessions[1]]
@@ -0,0 +1,33 @@
+from competitive_analysis_gpt.commands.urls import canonicalize_url, url_cache_key
+
+
+def test_scheme_and_host_are_lowercased_and_default_port_dropped():
+    assert canonicalize_url("HTTPS://Acme.COM:443/Pricing") == "https://acme.com/Pricing"
+    assert canonicalize_url("http://acme.com:8080") == "http://acme.com:8080/"
+
+
+def test_tracking_parameters_are_dropped_and_query_sorted():
+    url = "https://acme.com/p?utm_source=x&b=2&gclid=y&a=1&fbclid=z"
+    assert canonicalize_url(url) == "https://acme.com/p?a=1&b=2"
+
+
+def test_ref_parameter_is_kept():
+    url = "https://github.com/acme/app/blob/main/README.md?ref=v2"
+    assert canonicalize_url(url) == url
+
+
+def test_fragments_are_dropped_except_hash_routes():
+    assert canonicalize_url("https://acme.com/about#team") == "https://acme.com/about"
+    assert canonicalize_url("https://acme.com/#/pricing") == "https://acme.com/#/pricing"
+    assert canonicalize_url("https://acme.com/#!/pricing") == "https://acme.com/#!/pricing"
+
+
+def test_ipv6_hosts_keep_their_brackets():
+    assert canonicalize_url("http://[::1]:8080/a") == "http://[::1]:8080/a"
+    assert canonicalize_url("https://[2001:DB8::1]/") == "https://[2001:db8::1]/"
+
+
+def test_cache_key_is_shared_by_scheme_and_www_variants():
+    key = url_cache_key("https://www.acme.com/pricing?utm_medium=email")
+    assert key == url_cache_key("http://acme.com/pricing")
+    assert key != url_cache_key("http://acme.com/#/pricing")
@@ -0,0 +1,68 @@
+import pytest
+
+from competitive_analysis_gpt.commands import youtube
+from competitive_analysis_gpt.commands.browse import html_to_markdown
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://www.youtube.com/embed/ET822mQtO0I?rel=0&controls=1&autoplay=1&mute=1&start=0",
+        "https://www.youtube.com/watch?v=ET822mQtO0I",
+        "https://www.youtube.com/watch?feature=share&v=ET822mQtO0I#t=42",
+        "https://youtu.be/ET822mQtO0I?t=42",
+        "https://www.youtube.com/shorts/ET822mQtO0I",
+        "https://www.youtube.com/live/ET822mQtO0I?si=abc",
+        "https://www.youtube-nocookie.com/embed/ET822mQtO0I",
+        "//www.youtube.com/embed/ET822mQtO0I",
+    ],
+)
+def test_get_video_id(url):
+    assert youtube.get_video_id(url) == "ET822mQtO0I"
+
+
+@pytest.mark.parametrize(
+    "url", ["https://www.youtube.com/", "https://www.youtube.com/@acme", "https://vimeo.com/123"]
+)
+def test_get_video_id_without_video(url):
+    assert youtube.get_video_id(url) is None
+
+
+def test_condense_transcript_merges_captions_into_paragraphs():
+    transcript = [
+        {"text": "um welcome to", "start": 0.0, "duration": 2.0},
+        {"text": "welcome to", "start": 1.0, "duration": 2.0},
+        {"text": "the [Music] demo", "start": 2.0, "duration": 2.0},
+        {"text": "welcome to", "start": 30.0, "duration": 2.0},
+        {"text": "pricing", "start": 75.0, "duration": 2.0},
+    ]
+    assert youtube.condense_transcript(transcript) == [
+        "[0:00] welcome to the demo welcome to",
+        "[1:15] pricing",
+    ]
+
+
+def test_split_transcript_respects_token_budget():
+    paragraphs = [f"[{i}:00] " + "word " * 50 for i in range(10)]
+    tokens = youtube.count_tokens(paragraphs[0])
+    parts = youtube.split_transcript(paragraphs, max_tokens=2 * tokens + 1)
+    assert len(parts) == 5
+    assert "\n\n".join(parts) == "\n\n".join(paragraphs)
+
+
+def test_embedded_videos_are_described_by_their_transcript(monkeypatch):
+    fetched = []
+
+    def fetch_transcript(video_id):
+        fetched.append(video_id)
+        return [{"text": f"this is video {video_id}", "start": 0.0, "duration": 1.0}]
+
+    monkeypatch.setattr(youtube, "fetch_transcript", fetch_transcript)
+    html = (
+        '<p>Watch the demos</p><iframe src="https://www.youtube.com/embed/testVideoA1"></iframe>'
+        '<iframe src="https://youtu.be/testVideoB2"></iframe>'
+    )
+    markdown = html_to_markdown(html)
+    assert sorted(fetched) == ["testVideoA1", "testVideoB2"]
+    assert "transcript starts with: [0:00] this is video testVideoA1" in markdown
+    assert "transcript starts with: [0:00] this is video testVideoB2" in markdown